@@ -1,35 +1,148 @@
 import uuid
 import os
 import json
+import time
 import tempfile
 import logging as log
 
-from os import remove
 from os import path
 
 from bioblend.galaxy import GalaxyInstance
 
+# Suffix of files that are still being downloaded, they are renamed to
+# their final name once complete
+PARTIAL_SUFFIX = '.partial'
 
-def new_upload(gi, history, name, string):
+# Seconds between checks on a running invocation for newly finished outputs
+POLL_INTERVAL = 5
+
+# Invocation states after which no more jobs will be scheduled
+INVOCATION_FINISHED_STATES = ('scheduled', 'cancelled', 'failed')
+
+# Dataset states that will not change any more
+DATASET_FINISHED_STATES = (
+    'ok', 'empty', 'error', 'paused', 'failed_metadata', 'deferred', 'discarded'
+)
+
+# Characters Galaxy keeps in dataset names when it names a download
+FILENAME_VALID_CHARS = (
+    '.,^_-()[]0123456789abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ '
+)
+
+
+def new_upload(gi, history, name, string, file_type='auto'):
     """
     Function to upload a string to a galaxy history as a dataset
-        write the string to a file then upload the file to the history
-        then remove the file
+        the string is sent as the body of the upload request, nothing is
+        written to disk
 
     Args:
         gi (GalaxyInstance): GalaxyInstance object
         history (string): History ID
         name (string): Name of the dataset
         string (string): String to be uploaded to the history
+        file_type (string): Galaxy datatype of the dataset, 'auto' lets
+            Galaxy sniff it
 
     Returns:
         upload (dict): Dictionary of the uploaded dataset
     """
-    with open(name, 'w') as f:
-        f.write(string)
-    upload = gi.tools.upload_file(name, history)
-    remove(name)
-    return upload
+    return gi.tools.paste_content(
+        string, history, file_name=name, file_type=file_type
+    )
+
+
+def dataset_filename(dataset):
+    """
+    Function to get the file name Galaxy gives a dataset when downloaded
+
+    Args:
+        dataset (dict): Dataset dictionary as returned by the datasets API
+
+    Returns:
+        filename (string): Galaxy<hid>-[<name>].<extension>
+    """
+    name = ''.join(
+        c if c in FILENAME_VALID_CHARS else '_' for c in dataset['name']
+    )[0:150]
+    extension = dataset.get('extension') or 'data'
+    return f"Galaxy{dataset['hid']}-[{name}].{extension}"
+
+
+def download_dataset_to(gi, dataset, out_dir):
+    """
+    Function to download a dataset straight into its final folder
+        the data is written to <name>.partial and renamed when complete, so
+        a file with its final name is always a finished download
+
+    Args:
+        gi (GalaxyInstance): GalaxyInstance object
+        dataset (dict): Dataset dictionary as returned by the datasets API
+        out_dir (string): Folder to save the dataset in
+
+    Returns:
+        file_path (string): Path of the downloaded file
+    """
+    file_path = path.join(out_dir, dataset_filename(dataset))
+    partial_path = file_path + PARTIAL_SUFFIX
+    gi.datasets.download_dataset(
+        dataset_id=dataset['id'],
+        file_path=partial_path,
+        use_default_filename=False
+    )
+    os.replace(partial_path, file_path)
+    return file_path
+
+
+def stream_history_outputs(
+    gi,
+    history_id,
+    invocation_id,
+    out_dir,
+    on_download=None,
+    poll_interval=POLL_INTERVAL
+):
+    """
+    Function to download the datasets of a running workflow invocation as
+    soon as the step that makes each of them has finished, rather than
+    waiting for the whole workflow
+
+    Args:
+        gi (GalaxyInstance): GalaxyInstance object
+        history_id (string): History the invocation writes to
+        invocation_id (string): Invocation to follow
+        out_dir (string): Folder to save the datasets in
+        on_download (callable): Called with the path of each file as soon
+            as it has been saved
+        poll_interval (float): Seconds to wait between checks
+
+    Returns:
+        file_paths (list of strings): Paths of all the downloaded files
+    """
+    saved = {}
+    while True:
+        # Check the invocation first so that nothing created after the
+        # dataset listing below can be missed on the last pass
+        invocation = gi.invocations.show_invocation(invocation_id)
+        finished = invocation['state'] in INVOCATION_FINISHED_STATES
+
+        pending = False
+        for dataset in gi.datasets.get_datasets(
+            history_id=history_id,
+            order='hid-asc'
+        ):
+            if dataset['id'] in saved:
+                continue
+            if dataset['state'] == 'ok':
+                saved[dataset['id']] = download_dataset_to(gi, dataset, out_dir)
+                if on_download is not None:
+                    on_download(saved[dataset['id']])
+            elif dataset['state'] not in DATASET_FINISHED_STATES:
+                pending = True
+
+        if finished and not pending:
+            return list(saved.values())
+        time.sleep(poll_interval)
 
 
 def check_server_api(server, api_key):
@@ -91,7 +204,9 @@ def launch_workflow(
     workflow_name,
     inputs,
     uid=None,
-    from_omni=False
+    from_omni=False,
+    out_dir=None,
+    on_download=None
 ):
     """
     Function to call galaxy workflow via API
@@ -104,9 +219,17 @@ def launch_workflow(
         inputs (dict): Dictionary of inputs for the workflow, these should
             be named the same as the inputs in the workflow
             format: {input_name: input_string/filename, ...}
+            a dataset input can also be given as (content, file_type) to
+            upload content held in memory with a known datatype
         uid (string): Unique identifier for the workflow run
         from_omni (bool): If true, the function will save the files to a
             location where they can be accessed by the omniverse extension
+        out_dir (string): Folder the files are saved straight into when
+            from_omni is set, a temporary directory is used if not given
+        on_download (callable): Called with the path of each file as soon
+            as it has been saved when from_omni is set, outputs are saved
+            as each step finishes so this is called while the workflow is
+            still running
 
     Returns:
         True if workflow successfully launched
@@ -148,8 +271,14 @@ def launch_workflow(
             for name, string in inputs.items():
                 if wf_input[1] != name:
                     continue
-                # Check for case of input being a file or a string
-                if path.isfile(string):
+                # Check for case of input being in memory content, a file
+                # or a string
+                if isinstance(string, tuple):
+                    content, file_type = string
+                    uploads.append(
+                        new_upload(gi, new_hist['id'], name, content, file_type)
+                    )
+                elif path.isfile(string):
                     # Input is a file
                     uploads.append(
                         gi.tools.upload_file(string, new_hist['id'])
@@ -183,39 +312,48 @@ def launch_workflow(
         history_id=new_hist['id']
     )
 
-    # Gets the invocation of the above workflow and then waits for it to
-    # complete (need to check max time on this - especially for long sim runs)
+    # Gets the invocation of the above workflow
     invocation_workflow = gi.invocations.get_invocations(
         workflow_id=api_workflow[0]['id']
     )
     invocation_id = invocation_workflow[0]['id']
-    gi.invocations.wait_for_invocation(invocation_id=invocation_id)
-
-    # Find the job created by the invocation
-    job = gi.jobs.get_jobs(invocation_id=invocation_id)
-    # Wait for this job to finish
-    gi.jobs.wait_for_job(job_id=job[0]['id'])
 
     # From omniverse we want to save files in a location where we can access
-    # Pull all the files from the history and save them to a temp location
+    # Pull each file from the history as soon as the step that makes it has
+    # finished and save it straight to out_dir (or a temp location if no
+    # out_dir is given)
     if from_omni:
-        tempdir = tempfile.TemporaryDirectory()
-        for dataset in gi.datasets.get_datasets(history_id=new_hist['id']):
-            download = gi.datasets.download_dataset(
-                file_path=tempdir.name,
-                dataset_id=dataset['id'],
-                use_default_filename=True
-            )
+        tempdir = None
+        if out_dir is None:
+            tempdir = tempfile.TemporaryDirectory()
+            out_dir = tempdir.name
+
+        stream_history_outputs(
+            gi, new_hist['id'], invocation_id, out_dir, on_download
+        )
+
         download = gi.invocations.get_invocation_biocompute_object(
             invocation_id=invocation_workflow[0]['id']
         )
         dict_to_save = json.dumps(download)
-        bco_fname = tempdir.name + os.sep + 'biocompute_object.json'
-        with open(bco_fname, 'w') as f_write:
+        bco_fname = out_dir + os.sep + 'biocompute_object.json'
+        with open(bco_fname + PARTIAL_SUFFIX, 'w') as f_write:
             f_write.write(dict_to_save)
+        os.replace(bco_fname + PARTIAL_SUFFIX, bco_fname)
+        if on_download is not None:
+            on_download(bco_fname)
 
         gi.histories.delete_history(history_id=new_hist['id'])
-        return tempdir
+        return out_dir if tempdir is None else tempdir
+
+    # Otherwise wait for the invocation to complete (need to check max time
+    # on this - especially for long sim runs)
+    gi.invocations.wait_for_invocation(invocation_id=invocation_id)
+
+    # Find the job created by the invocation
+    job = gi.jobs.get_jobs(invocation_id=invocation_id)
+    # Wait for this job to finish
+    gi.jobs.wait_for_job(job_id=job[0]['id'])
 
 
 def get_inputs(server, api_key, workflow_name):
@@ -17,6 +17,14 @@ class vtk(data.Data):
     file_ext = "vtk"
 
 
+class vti(data.Data):
+    file_ext = "vti"
+
+
+class vtu(data.Data):
+    file_ext = "vtu"
+
+
 class usd(data.Data):
     file_ext = "usd"
 
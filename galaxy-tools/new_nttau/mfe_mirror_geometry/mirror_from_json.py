@@ -83,7 +83,7 @@ if expander_coil is not False:
 
 # PF_coils.extend(end_cell)
 
-mg.export_pf_coils_to_csv(PF_coils)
+mg.export_pf_coils_to_csv(PF_coils, out_dir=output_directory)
 
 radial_build_cad, height_to_ec = mg.generate_radial_build_layers(
     radial_build, reactor_height, end_cell_radius)
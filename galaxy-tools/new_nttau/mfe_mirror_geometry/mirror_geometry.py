@@ -11,7 +11,7 @@ The module contains three main functions:
 """
 from dataclasses import dataclass
 import os
-import csv
+from coilset import coil_set_from_rows, write_coil_set
 import cadquery as cq
 import paramak as pm
 
@@ -39,7 +39,8 @@ def export_pf_coils_to_csv(
         out_dir: str = "out",
         filename: str = "pf_coils.csv") -> None:
     """
-    Export the PfCoil array to a CSV file.
+    Export the PfCoil array as a coil set in the coilset schema, to a CSV
+    file and to a .npz file of the same name for the field tools.
 
     Args:
         pf_coil_array (List[PfCoil]): List of PfCoil objects to be exported.
@@ -52,16 +53,11 @@ def export_pf_coils_to_csv(
     coil_x = 0
     coil_y = 0
 
-    with open(file_path, mode='w', newline='', encoding='utf-8') as file:
-        writer = csv.writer(file)
-        # Write the header
-        writer.writerow(["R_turns", "Z_turns", "I (A)", "R_av",
-                         "dr", "dz", "Coil_X", "Coil_Y", "Coil_Z", "Normal_x", "Normal_y", "Normal_z"])
-
-        # Write the data
-        for coil in pf_coil_array:
-            writer.writerow([r_turns, z_turns, current_per_turn, coil.radius,
-                            coil.dr, coil.dz, coil_x, coil_y, coil.height, 0, 0, 1])
+    coils = coil_set_from_rows([[r_turns, z_turns, current_per_turn, coil.radius,
+                                 coil.dr, coil.dz, coil_x, coil_y, coil.height, 0, 0, 1]
+                                for coil in pf_coil_array])
+    write_coil_set(file_path, coils)
+    write_coil_set(os.path.splitext(file_path)[0] + ".npz", coils)
 
     print(f"PF coils exported to {file_path}")
 
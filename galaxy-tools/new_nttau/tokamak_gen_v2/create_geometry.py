@@ -30,6 +30,7 @@ import os
 import zipfile
 
 import cadquery as cq
+from coilset import read_coil_set, write_coil_set
 from cq_utils import half_compound, save_bounding_box_to_csv
 from files import clear_directory
 from tokamakgen import create_geometry
@@ -58,7 +59,10 @@ def main(input_file: str, out_dir: str):
     tf_coil_path = os.path.join(out_dir, 'tf.csv')
     pf_coil_path = os.path.join(out_dir, 'pf.csv')
 
-    reactor_components = create_geometry(params, tf_coil_path, pf_coil_path)
+    reactor_components = create_geometry(params, tf_coil_path, pf_coil_path,
+                                         os.path.join(out_dir, 'plasma_boundary.csv'))
+    # The PF coils as .npz too, for the field tools
+    write_coil_set(os.path.join(out_dir, 'pf.npz'), read_coil_set(pf_coil_path))
 
     # Create a directory for the .step files
     step_files_dir = os.path.join(out_dir, 'step_files')
@@ -31,6 +31,7 @@ from typing import Tuple
 import cadquery as cq
 import numpy as np
 import paramak
+from coilset import append_coil_set, coil_set_from_rows
 from TokamakGeometryParams import TokamakGeometryParams
 
 # Defining constants for magic numbers
@@ -391,18 +392,18 @@ def generate_pf_coil_from_array(coil_array):
 
 def write_pf_coils_to_csv(coil_data, csv_file_path="pf_coils_1.csv"):
     """
-    Writes or appends poloidal field(PF) coil data to a CSV file.
+    Writes or appends poloidal field(PF) coil data to a coil set file in the
+    coilset schema, csv or .npz by the extension.
 
     Parameters:
-    coil_data(list): The list of PF coil data to write to the CSV file.
-    csv_file_path(str): The path to the CSV file to write to. Default is "pf_coils_1.csv".
+    coil_data(list): Rows of R_turns, Z_turns, I, r_av, dr, dz, coil_x, coil_y, coil_z,
+        normal_x, normal_y, normal_z for each PF coil.
+    csv_file_path(str): The path to the file to write to. Default is "pf_coils_1.csv".
 
     Returns:
     None
     """
-    with open(csv_file_path, "a", newline="", encoding='utf-8') as csvfile:
-        csv_writer = csv.writer(csvfile)
-        csv_writer.writerows(coil_data)
+    append_coil_set(csv_file_path, coil_set_from_rows(coil_data))
     print(f"PF Coil data appended to {csv_file_path}")
 
 
@@ -461,6 +462,7 @@ def create_geometry(
     params: TokamakGeometryParams,
     tf_coil_path: str,
     pf_coil_path: str,
+    boundary_path: str = None,
 ):
     """
     Generates a 3D model of a tokamak fusion reactor using the provided parameters.
@@ -469,6 +471,8 @@ def create_geometry(
     - params (TokamakGeometryParams): Tokamak Geometry Parameters
     - tf_coil_path (str): Path to the CSV file for the toroidal field coils.
     - pf_coil_path (str): Path to the CSV file for the poloidal field coils.
+    - boundary_path (str): Path to write the plasma boundary (R, Z points) to, for
+        checking against the flux of the PF coils. Not written if None.
 
     Returns:
     - list of cadquery.Workplane: Cadquery objects representing the tokamak components.
@@ -497,6 +501,8 @@ def create_geometry(
                 r_0=major_radius, a=minor_radius, wire=False, degrees=FULL_REVOLVE
             )
             is_plasma = False  # Reset flag after creating plasma
+            if boundary_path:
+                write_csv(*plasma_torus.get_r_and_z_points(), boundary_path)
             reactor_components.append(
                 {"name": component_name, "component": plasma_torus.torus}
             )
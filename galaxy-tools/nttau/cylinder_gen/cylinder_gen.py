@@ -3,6 +3,7 @@ import json
 import cadquery as cq
 import numpy as np
 from scipy.optimize import minimize
+from coilset import coil_set, write_coil_set
 
 
 radial_build = [0.5, 0.1, 0.2, 0.8, 0.2, 0.5, 0.2, 0.5]
@@ -261,33 +262,38 @@ def generate_cylinder(radial_build, height, N_coils, inner_radius, current, outp
     
     coils = cq.Assembly()
 
-    with open(output_filepath, "w") as file:
-        file.write(f"N,I (A),Inner Radius,Outer radius,Coil_X,Coil_Y,Coil_Z,Normal X,Normal Y,Normal Z \n")  
-   
-        for coil_z in coil_z:
-            coil, coil_radii, result, coil_cost = make_coil(inner_radius,current )
-            outer_radius=inner_radius + (0.1* inner_radius) 
-            coil = coil.translate(cq.Vector(0,0,coil_z))
-            total_cost += coil_cost
-            print("Total Cost of Coil",count,"is:", coil_cost)
-            cylinder.reactor.add(coil)
-            coils.add(coil)
-            count+=1
-            if count ==1: 
-                I_val = 10*current 
-            elif count ==1: 
-                I_val = 10*current
-            else: 
-                I_val = current 
-
-            file.write(f"1,{I_val},{inner_radius},{outer_radius},0,0,{coil_z},0,0,1\n")
-        
-        
-        #print("Count : ",count,N_coils)
-        cylinder.reactor.save("reactor.step")
-        coils.save("coils.step")
-        print("Total Cost of all Coils is:", total_cost)
-        return cylinder
+    coil_currents = []
+    coil_centres = []
+    for coil_z in coil_z:
+        coil, coil_radii, result, coil_cost = make_coil(inner_radius,current )
+        outer_radius=inner_radius + (0.1* inner_radius) 
+        coil = coil.translate(cq.Vector(0,0,coil_z))
+        total_cost += coil_cost
+        print("Total Cost of Coil",count,"is:", coil_cost)
+        cylinder.reactor.add(coil)
+        coils.add(coil)
+        count+=1
+        if count ==1: 
+            I_val = 10*current 
+        elif count ==1: 
+            I_val = 10*current
+        else: 
+            I_val = current 
+
+        coil_currents.append(I_val)
+        coil_centres.append([0, 0, coil_z])
+
+    # Single turn coils with a square winding pack, in the coilset schema
+    # (.npz if output_filepath ends in .npz, csv otherwise)
+    width = outer_radius - inner_radius
+    write_coil_set(output_filepath, coil_set(1, coil_currents, (inner_radius + outer_radius)/2,
+                                             coil_centres, [0, 0, 1], width, width))
+
+    #print("Count : ",count,N_coils)
+    cylinder.reactor.save("reactor.step")
+    coils.save("coils.step")
+    print("Total Cost of all Coils is:", total_cost)
+    return cylinder
 
 
 
@@ -0,0 +1,259 @@
+"""
+Converts a magnetic field map written by magnetic_field_calc (npz, VTK
+ImageData, HDF5 or csv) into a USD PointInstancer of arrow glyphs.
+
+The grid is decimated onto a coarser voxel grid first, each arrow is the
+mean field of the points in its voxel. Every arrow is one entry in the
+instancer's arrays rather than a prim of its own, and the layer is written
+as a binary crate (.usdc) file, so large maps stay small and quick to load.
+"""
+import argparse
+import re
+
+import numpy as np
+from pxr import Gf, Sdf, Usd, UsdGeom, Vt
+
+FIELD_COLUMNS = ["x", "y", "z", "Bx", "By", "Bz", "Bmag"]
+MAX_ARROWS = 50000
+# Sides of the arrow glyph, more looks rounder but costs more per arrow
+ARROW_SIDES = 8
+
+# Viridis sampled at five points, interpolated in between
+COLOUR_STOPS = np.array([
+    [0.267, 0.005, 0.329],
+    [0.229, 0.322, 0.546],
+    [0.128, 0.567, 0.551],
+    [0.369, 0.789, 0.383],
+    [0.993, 0.906, 0.144],
+])
+
+
+def read_field(path):
+    """
+    Reads a field map, the format is found from the start of the file as
+    Galaxy datasets do not keep their extension
+
+    Args:
+        path (string): npz, vti or h5 map from magnetic_field_calc, or a
+            csv with a header row and columns x,y,z,Bx,By,Bz[,Bmag]
+
+    Returns:
+        points (ndarray (n, 3)): Grid point coordinates
+        field (ndarray (n, 3)): Field at each point
+    """
+    with open(path, 'rb') as file:
+        magic = file.read(8)
+    if magic.startswith(b"PK"):
+        with np.load(path) as data:
+            return _grid_points(data["origin"], data["spacing"], data["shape"]), data["B"]
+    if magic.startswith(b"\x89HDF"):
+        import h5py
+        with h5py.File(path, 'r') as data:
+            return _grid_points(data.attrs["origin"], data.attrs["spacing"], data.attrs["shape"]), data["B"][()]
+    if magic.startswith(b"<?xml") or magic.startswith(b"<VTKFile"):
+        return _read_vti(path)
+
+    with open(path, 'r') as file:
+        header = [name.strip() for name in file.readline().split(',')]
+    if header[:6] != FIELD_COLUMNS[:6]:
+        raise ValueError(f"{path} is not a field map, expected columns {','.join(FIELD_COLUMNS)}")
+
+    data = np.loadtxt(path, delimiter=',', skiprows=1, usecols=range(6), ndmin=2)
+    return data[:, :3], data[:, 3:6]
+
+
+def _grid_points(origin, spacing, shape):
+    """Coordinates of a regular grid, x fastest as the binary maps store it"""
+    k, j, i = np.meshgrid(*(np.arange(n) for n in shape[::-1]), indexing='ij')
+    return np.stack((i.ravel(), j.ravel(), k.ravel()), axis=1)*spacing + origin
+
+
+def _read_vti(path):
+    """Reads the raw appended ImageData written by magnetic_field_calc"""
+    with open(path, 'rb') as file:
+        content = file.read()
+    marker = content.index(b'<AppendedData encoding="raw">')
+    header = content[:marker].decode()
+    if 'header_type="UInt64"' not in header or 'format="appended"' not in header:
+        raise ValueError(f"{path} is not a field map written by magnetic_field_calc")
+
+    def attribute(name):
+        return np.array(re.search(f'{name}="([^"]*)"', header).group(1).split(), dtype=float)
+
+    extent = attribute("WholeExtent").astype(np.int64)
+    shape = extent[1::2] - extent[0::2] + 1
+    start = content.index(b"_", marker) + 1
+    n_bytes = int(np.frombuffer(content, dtype='<u8', count=1, offset=start)[0])
+    field = np.frombuffer(content, dtype='<f8', count=n_bytes//8, offset=start + 8).reshape(-1, 3)
+    return _grid_points(attribute("Origin"), attribute("Spacing"), shape), field
+
+
+def decimate(points, field, max_arrows=MAX_ARROWS):
+    """
+    Averages the field onto a voxel grid with at most max_arrows occupied
+    voxels, the voxel size is grown 10% at a time until the points fit
+
+    Returns:
+        points (ndarray (m, 3)): Mean position of the points in each voxel
+        field (ndarray (m, 3)): Mean field in each voxel
+        size (float): Side of the voxels, 0 if no decimation was needed
+    """
+    if len(points) <= max_arrows:
+        return points, field, 0.0
+
+    lower = points.min(axis=0)
+    extent = points.max(axis=0) - lower
+    # Start from the voxel size that would give max_arrows over the bounding box
+    size = max(np.prod(np.maximum(extent, 1e-12)) / max_arrows, 1e-36) ** (1 / 3)
+    size = min(size, extent.max())
+    while True:
+        keys = np.floor((points - lower) / size).astype(np.int64)
+        _, cell = np.unique(keys, axis=0, return_inverse=True)
+        cell = cell.reshape(-1)
+        n_cells = cell.max() + 1
+        if n_cells <= max_arrows:
+            break
+        size *= 1.1
+
+    counts = np.bincount(cell, minlength=n_cells)[:, None]
+    new_points = np.zeros((n_cells, 3))
+    new_field = np.zeros((n_cells, 3))
+    np.add.at(new_points, cell, points)
+    np.add.at(new_field, cell, field)
+    return new_points / counts, new_field / counts, size
+
+
+def arrow_mesh(stage, path, sides=ARROW_SIDES):
+    """
+    Defines a unit length arrow along +Z starting at the origin, used as
+    the prototype of every glyph
+    """
+    shaft_radius, head_radius, head_start = 0.03, 0.08, 0.7
+    angles = np.linspace(0, 2 * np.pi, sides, endpoint=False)
+    ring = np.stack((np.cos(angles), np.sin(angles), np.zeros(sides)), axis=1)
+
+    points = np.concatenate((
+        ring * shaft_radius,
+        ring * shaft_radius + [0, 0, head_start],
+        ring * head_radius + [0, 0, head_start],
+        [[0, 0, 1.0], [0, 0, 0]],
+    ))
+    tip, base = 3 * sides, 3 * sides + 1
+
+    nxt = (np.arange(sides) + 1) % sides
+    cur = np.arange(sides)
+    shaft = np.stack((cur, nxt, nxt + sides, cur + sides), axis=1)
+    collar = np.stack((cur + sides, nxt + sides, nxt + 2 * sides, cur + 2 * sides), axis=1)
+    head = np.stack((cur + 2 * sides, nxt + 2 * sides, np.full(sides, tip)), axis=1)
+    bottom = np.stack((nxt, cur, np.full(sides, base)), axis=1)
+
+    mesh = UsdGeom.Mesh.Define(stage, path)
+    mesh.GetPointsAttr().Set(Vt.Vec3fArray.FromNumpy(points.astype(np.float32)))
+    mesh.GetFaceVertexCountsAttr().Set([4] * (2 * sides) + [3] * (2 * sides))
+    mesh.GetFaceVertexIndicesAttr().Set(Vt.IntArray.FromNumpy(
+        np.concatenate((shaft.ravel(), collar.ravel(), head.ravel(), bottom.ravel())).astype(np.int32)
+    ))
+    mesh.GetSubdivisionSchemeAttr().Set(UsdGeom.Tokens.none)
+    mesh.GetExtentAttr().Set([Gf.Vec3f(-head_radius, -head_radius, 0), Gf.Vec3f(head_radius, head_radius, 1)])
+    return mesh
+
+
+def orientations(directions):
+    """
+    Quaternions rotating +Z onto each direction, as (i, j, k, real) rows
+    ready for Vt.QuathArray.FromNumpy
+    """
+    unit = directions / np.maximum(np.linalg.norm(directions, axis=1), 1e-300)[:, None]
+    # Half way rotation: q = (z x d, 1 + z . d), normalised
+    quats = np.stack((-unit[:, 1], unit[:, 0], np.zeros(len(unit)), 1 + unit[:, 2]), axis=1)
+    # Antiparallel to +Z (or zero field), any half turn about a horizontal axis
+    flipped = quats[:, 3] < 1e-9
+    quats[flipped] = [1.0, 0.0, 0.0, 0.0]
+    return quats / np.linalg.norm(quats, axis=1)[:, None]
+
+
+def colours(values):
+    """Maps values in [0, 1] onto COLOUR_STOPS"""
+    stops = np.linspace(0, 1, len(COLOUR_STOPS))
+    return np.stack([np.interp(values, stops, COLOUR_STOPS[:, i]) for i in range(3)], axis=1)
+
+
+def write_field_usd(points, field, out_path, arrow_length=None, scale_by_magnitude=True):
+    """
+    Writes the field as a PointInstancer of arrows to a usdc layer
+
+    Args:
+        points (ndarray (n, 3)): Arrow positions
+        field (ndarray (n, 3)): Field at each position
+        out_path (string): Layer to write, .usdc is recommended
+        arrow_length (float): Length of the strongest arrow, defaults to
+            the mean spacing of the arrows
+        scale_by_magnitude (bool): Arrow length follows Bmag (with a floor
+            so weak regions stay visible), otherwise all arrows are equal
+    """
+    magnitude = np.linalg.norm(field, axis=1)
+    b_max = magnitude.max() if len(magnitude) and magnitude.max() > 0 else 1.0
+
+    if arrow_length is None:
+        extent = points.max(axis=0) - points.min(axis=0) if len(points) else np.ones(3)
+        occupied = extent[extent > 0]
+        volume = np.prod(occupied) if len(occupied) else 1.0
+        arrow_length = (volume / max(len(points), 1)) ** (1 / max(len(occupied), 1))
+
+    if scale_by_magnitude:
+        lengths = arrow_length * np.maximum(magnitude / b_max, 0.1)
+    else:
+        lengths = np.full(len(points), arrow_length)
+
+    stage = Usd.Stage.CreateNew(out_path)
+    UsdGeom.SetStageUpAxis(stage, UsdGeom.Tokens.z)
+    UsdGeom.SetStageMetersPerUnit(stage, 1.0)
+    root = UsdGeom.Xform.Define(stage, "/MagneticField")
+    stage.SetDefaultPrim(root.GetPrim())
+
+    instancer = UsdGeom.PointInstancer.Define(stage, "/MagneticField/Arrows")
+    arrow_mesh(stage, "/MagneticField/Arrows/Prototypes/Arrow")
+    instancer.GetPrototypesRel().SetTargets([Sdf.Path("/MagneticField/Arrows/Prototypes/Arrow")])
+
+    instancer.GetProtoIndicesAttr().Set(Vt.IntArray.FromNumpy(np.zeros(len(points), dtype=np.int32)))
+    instancer.GetPositionsAttr().Set(Vt.Vec3fArray.FromNumpy(points.astype(np.float32)))
+    instancer.GetOrientationsAttr().Set(Vt.QuathArray.FromNumpy(orientations(field).astype(np.float16)))
+    scales = np.repeat(lengths[:, None], 3, axis=1)
+    instancer.GetScalesAttr().Set(Vt.Vec3fArray.FromNumpy(scales.astype(np.float32)))
+
+    # One value per arrow, renderers map vertex interpolated primvars on a
+    # PointInstancer onto its instances
+    primvars = UsdGeom.PrimvarsAPI(instancer)
+    primvars.CreatePrimvar(
+        "displayColor", Sdf.ValueTypeNames.Color3fArray, UsdGeom.Tokens.vertex
+    ).Set(Vt.Vec3fArray.FromNumpy(colours(magnitude / b_max).astype(np.float32)))
+    primvars.CreatePrimvar(
+        "Bmag", Sdf.ValueTypeNames.FloatArray, UsdGeom.Tokens.vertex
+    ).Set(Vt.FloatArray.FromNumpy(magnitude.astype(np.float32)))
+    root.GetPrim().SetCustomDataByKey("Bmag_max", float(b_max))
+
+    stage.GetRootLayer().Save()
+    return len(points)
+
+
+def field_to_usd(in_path, out_path, max_arrows=MAX_ARROWS, scale_by_magnitude=True):
+    """Reads a field map, decimates it and writes it as arrows"""
+    points, field = read_field(in_path)
+    n_points = len(points)
+    points, field, size = decimate(points, field, max_arrows)
+    n_arrows = write_field_usd(points, field, out_path, arrow_length=size or None,
+                               scale_by_magnitude=scale_by_magnitude)
+    print(f"Wrote {n_arrows} arrows for {n_points} field points to {out_path}")
+    return out_path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('field_map')
+    parser.add_argument('output')
+    parser.add_argument('--max-arrows', type=int, default=MAX_ARROWS)
+    parser.add_argument('--uniform-length', action='store_true',
+                        help="Draw every arrow the same length instead of scaling by Bmag")
+    args = parser.parse_args()
+
+    field_to_usd(args.field_map, args.output, args.max_arrows, not args.uniform_length)
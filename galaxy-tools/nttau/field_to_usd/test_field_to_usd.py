@@ -0,0 +1,116 @@
+"""
+Tests for the field map to USD arrows conversion, run with
+
+    python -m pytest galaxy-tools/nttau/field_to_usd
+"""
+import os
+import sys
+
+import numpy as np
+import pytest
+from pxr import Sdf, Usd, UsdGeom
+
+from field_to_usd import decimate, field_to_usd, orientations, read_field
+
+# The maps are written by magnetic_field_calc's own writers
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "magnetic_field_calc"))
+from field_writers import grid_points, open_field_writer  # noqa: E402
+
+ORIGIN, SPACING, SHAPE = np.array([-1.0, -0.5, 0.25]), np.array([0.5, 0.25, 0.125]), np.array([5, 4, 3])
+
+
+def _rotate(quats, vectors):
+    """Rotates vectors by (i, j, k, real) quaternions"""
+    q, w = quats[:, :3], quats[:, 3:]
+    t = 2*np.cross(q, vectors)
+    return vectors + w*t + np.cross(q, t)
+
+
+def _grid_field():
+    points = grid_points(ORIGIN, SPACING, SHAPE, 0, int(np.prod(SHAPE)))
+    return points, np.stack((points[:, 0]*points[:, 1], np.cos(points[:, 2]), points[:, 0] + 2), axis=1)
+
+
+def test_decimate_means_per_voxel():
+    rng = np.random.default_rng(0)
+    points = rng.uniform(-1, 3, (5000, 3))*[1, 2, 0.5]
+    field = rng.normal(size=(5000, 3))
+    for max_arrows in (1, 7, 60, 999):
+        new_points, new_field, size = decimate(points, field, max_arrows)
+        assert 0 < len(new_points) <= max_arrows and size > 0
+
+        # Group the points into the same voxels by hand
+        keys = np.floor((points - points.min(axis=0))/size).astype(np.int64)
+        groups = {}
+        for key, point, B in zip(map(tuple, keys), points, field):
+            groups.setdefault(key, []).append((point, B))
+        assert len(groups) == len(new_points)
+        for (key, members), point, B in zip(sorted(groups.items()), new_points, new_field):
+            assert np.allclose(point, np.mean([m[0] for m in members], axis=0))
+            assert np.allclose(B, np.mean([m[1] for m in members], axis=0))
+
+
+def test_decimate_not_needed():
+    points, field = _grid_field()
+    new_points, new_field, size = decimate(points, field, len(points))
+    assert new_points is points and new_field is field and size == 0.0
+
+
+def test_orientations_map_z_onto_the_field():
+    rng = np.random.default_rng(1)
+    directions = np.concatenate((
+        rng.normal(size=(200, 3))*rng.uniform(1e-6, 1e3, (200, 1)),
+        [[0, 0, 2.0], [0, 0, -3.0], [0, 1e-12, -1.0], [1e-3, 0, -1.0], [1.0, 0, 0]],
+    ))
+    quats = orientations(directions)
+    assert np.allclose(np.linalg.norm(quats, axis=1), 1)
+    z = np.tile([0.0, 0, 1], (len(directions), 1))
+    unit = directions/np.linalg.norm(directions, axis=1)[:, None]
+    assert np.allclose(_rotate(quats, z), unit, atol=1e-6)
+
+    # Zero field has no direction, any rotation will do as long as it is one
+    zero = orientations(np.zeros((2, 3)))
+    assert np.all(np.isfinite(zero)) and np.allclose(np.linalg.norm(zero, axis=1), 1)
+
+
+@pytest.mark.parametrize("file_format", ["npz", "vtk", "hdf5", "csv"])
+def test_read_field(tmp_path, file_format):
+    if file_format == "hdf5":
+        pytest.importorskip("h5py")
+    points, field = _grid_field()
+    path = tmp_path/"field.dat"
+    with open_field_writer(file_format, path, ORIGIN, SPACING, SHAPE) as writer:
+        writer.write(field[:17])
+        writer.write(field[17:])
+    read_points, read_B = read_field(path)
+    assert np.allclose(read_points, points, rtol=0, atol=1e-15)
+    assert np.array_equal(read_B, field)
+
+
+def test_read_field_csv_without_bmag(tmp_path):
+    points, field = _grid_field()
+    np.savetxt(tmp_path/"field.csv", np.hstack((points, field)), delimiter=',', fmt='%.17g',
+               header="x, y, z, Bx, By, Bz", comments="")
+    read_points, read_B = read_field(tmp_path/"field.csv")
+    assert np.array_equal(read_points, points) and np.array_equal(read_B, field)
+
+    (tmp_path/"coils.csv").write_text("turns,current,radius\n1,2,3\n")
+    with pytest.raises(ValueError, match="not a field map"):
+        read_field(tmp_path/"coils.csv")
+
+
+def test_usdc_arrows(tmp_path):
+    points, field = _grid_field()
+    path = tmp_path/"field.npz"
+    with open_field_writer("npz", path, ORIGIN, SPACING, SHAPE) as writer:
+        writer.write(field)
+    out = str(tmp_path/"out.usdc")
+    field_to_usd(str(path), out, max_arrows=20)
+
+    assert Sdf.Layer.FindOrOpen(out).GetFileFormat().formatId == "usdc"
+    stage = Usd.Stage.Open(out)
+    instancer = UsdGeom.PointInstancer(stage.GetPrimAtPath("/MagneticField/Arrows"))
+    positions = np.array(instancer.GetPositionsAttr().Get())
+    assert 0 < len(positions) <= 20
+    bmag = np.array(UsdGeom.PrimvarsAPI(instancer).GetPrimvar("Bmag").Get())
+    assert len(bmag) == len(positions) and len(instancer.GetOrientationsAttr().Get()) == len(positions)
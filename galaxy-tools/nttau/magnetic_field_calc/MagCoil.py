@@ -1,6 +1,5 @@
 from pylab import *
 from scipy.special import ellipe, ellipk
-from scipy.optimize._basinhopping import RandomDisplacement
 try:
    from scipy.special import ellipkm1
    have_ellipkm1=True
@@ -23,6 +22,10 @@ class MagCoil:
       I: float: The current in the loop, oriented by the right-hand-rule about the normal vector.  
       r_minor: float: The minor radius (for rendering only, not for field calculations)
       wire: dict: a selection from AWG or AWG_square (overrides r_minor)
+
+      The frame (rotmtx) and B0 are worked out when first needed and kept until
+      normal, R or I are set again. Assign a new normal rather than changing the
+      array in place, or call update() after doing so.
    """
    def __init__(self,r0,normal,R=1.0,I=1.0,r_minor=None,wire=None):
       self.r0=r0
@@ -32,9 +35,47 @@ class MagCoil:
       self.mu=pi*4e-7
       self.r_minor=r_minor
       self.wire=wire
-      self.update()
       self.mesh=self.render # for compatibility
 
+   @property
+   def normal(self):
+      return self._normal
+
+   @normal.setter
+   def normal(self, normal):
+      self._normal=array(normal, dtype=float)/norm(normal)
+      self._rotmtx=None
+
+   @property
+   def R(self):
+      return self._R
+
+   @R.setter
+   def R(self, R):
+      self._R=R
+      self._B0=None
+
+   @property
+   def I(self):
+      return self._I
+
+   @I.setter
+   def I(self, I):
+      self._I=I
+      self._B0=None
+
+   @property
+   def rotmtx(self):
+      if self._rotmtx is None:
+         self._rotmtx=self._frame()
+      return self._rotmtx
+
+   @property
+   def B0(self):
+      if self._B0 is None:
+         self._B0=self.mu*self.I/2/self.R
+      return self._B0
+
    def move(self,displacement):
       self.r0 += displacement
       
@@ -55,22 +96,24 @@ class MagCoil:
       IdL=matrix([-sin(theta)*IdLmag, cos(theta)*IdLmag, zeros_like(theta)])
       return array((self.rotmtx.transpose()*IdL).transpose()),points
       
-   def update(self):
+   def _frame(self):
       """ Calculates rotmtx, which transforms coordinates from the lab frame
-          to axes with coil field in positive Z direction
+          to axes with coil field in positive Z direction. The in-plane axes
+          are fixed by the normal alone (as in MagCoilSet) so results repeat
       """
-      self.normal=self.normal/norm(self.normal)
-      self.rotmtx=matrix(zeros((3,3)))
-      v1=random(3)
-      while (norm(cross(v1,self.normal)) < 0.1):
-         v1=random(3)
+      v1=zeros(3)
+      v1[argmin(abs(self.normal))]=1.0 # the lab axis least aligned with the normal
       v2=cross(self.normal,v1)
       v2=v2/norm(v2)
       v3=cross(self.normal,v2)
-      self.rotmtx[0,:]=v2
-      self.rotmtx[1,:]=v3
-      self.rotmtx[2,:]=self.normal
-      self.B0=self.mu*self.I/2/self.R
+      return matrix([v2, v3, self.normal])
+
+   def update(self):
+      """ Recalculates the frame and B0, only needed after changing normal in place
+      """
+      self.normal=self.normal
+      self._rotmtx=self._frame()
+      self._B0=self.mu*self.I/2/self.R
 
    def A(self,r):
       """
@@ -88,7 +131,6 @@ class MagCoil:
           The vector potential at each position specified in r 
           in T*m
       """
-      self.update()
       rtrans=matrix(r).transpose()
       for i in range(3): rtrans[i,:] -= self.r0[i]
 
@@ -137,7 +179,6 @@ class MagCoil:
           a vector for the B field at each position specified in r 
           in T
       """
-      self.update()
       rtrans=matrix(r).transpose()
       for i in range(3): rtrans[i,:] -= self.r0[i]
 
@@ -204,7 +245,6 @@ class MagCoil:
       flux: float
          the flux through the coil, in Wb
       """
-      self.update()
       if coax:
          R1=matrix([self.R,0.0,0]).transpose()
       else:
@@ -241,7 +281,6 @@ class MagCoil:
           in Wb
       """
 
-      self.update()
       rtrans=matrix(r).transpose()
       for i in range(3): rtrans[i,:] -= self.r0[i]
 
@@ -262,7 +301,7 @@ class MagCoil:
    
       E = ellipe(m)
       K = ellipk(m)
-      psi=self.B0*0.5*K/pi*sqrt(Q)*(2*(K-E)/K-m)
+      psi=self.B0*self.R**2*0.5*K/pi*sqrt(Q)*(2*(K-E)/K-m) # rho*Aphi
       psi[isnan(psi)] = 0
 
    
@@ -270,7 +309,6 @@ class MagCoil:
       return array(psi)
 
    def _meshpoints(self, n_points=50, **keywords):
-      self.update()
 
       try:
          render_type=self.wire['render_type']
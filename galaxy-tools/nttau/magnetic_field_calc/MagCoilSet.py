@@ -0,0 +1,257 @@
+"""
+MagCoilSet: the field of a set of circular current loops, evaluated for
+every coil at once.
+
+The coils are held as packed arrays (centres, normals, radii, currents and
+the rotation into each coil's frame) and A, B and psi are computed for all
+coils over a block of points with broadcast operations, then summed into
+the result in place. Same formulas as MagCoil, on plain ndarrays.
+"""
+import numpy as np
+from scipy.special import ellipe, ellipk, ellipkm1
+
+from coilset import read_coil_set
+
+MU0 = np.pi*4e-7
+
+# Coil x point pairs evaluated together, bounds the size of the temporaries
+BLOCK_ELEMENTS = 2**20
+
+
+class MagCoilSet:
+   """
+      MagCoilSet(centres, normals, radii, currents)
+
+      centres: ndarray (n, 3): The centre of each loop [x y z]
+      normals: ndarray (n, 3): The normal to the plane of each loop
+      radii: ndarray (n, ): The radius of each loop
+      currents: ndarray (n, ): The current in each loop (ampere turns), oriented
+         by the right-hand-rule about the normal vector
+   """
+   def __init__(self, centres, normals, radii, currents):
+      self.centres = np.array(centres, dtype=float).reshape(-1, 3)
+      self.normals = np.array(normals, dtype=float).reshape(-1, 3)
+      self.radii = np.array(radii, dtype=float).reshape(-1)
+      self.currents = np.array(currents, dtype=float).reshape(-1)
+      self.mu = MU0
+      self.update()
+
+   def __len__(self):
+      return len(self.radii)
+
+   @classmethod
+   def from_csv(cls, path):
+      """Builds the set from any of the coil set files read by read_coil_csv"""
+      coils = read_coil_csv(path)
+      return cls(coils["centres"], coils["normals"], coils["radii"], coils["turns"]*coils["currents"])
+
+   @classmethod
+   def from_coils(cls, coils):
+      """Builds the set from MagCoil objects, which use the same frames"""
+      return cls([coil.r0 for coil in coils], [coil.normal for coil in coils],
+                 [coil.R for coil in coils], [coil.I for coil in coils])
+
+   def update(self):
+      """
+      Calculates rotmtx (n, 3, 3), which transforms coordinates from the lab
+      frame to axes with each coil's field in the positive Z direction. The
+      in-plane axes are fixed by the normal alone so results are repeatable.
+      """
+      self.normals = self.normals/np.linalg.norm(self.normals, axis=1)[:, None]
+      # Cross with the lab axis least aligned with the normal
+      helper = np.zeros_like(self.normals)
+      helper[np.arange(len(self)), np.argmin(np.abs(self.normals), axis=1)] = 1.0
+      v2 = np.cross(self.normals, helper)
+      v2 /= np.linalg.norm(v2, axis=1)[:, None]
+      v3 = np.cross(self.normals, v2)
+      self.rotmtx = np.stack((v2, v3, self.normals), axis=1)
+      self.B0 = self.mu*self.currents/2/self.radii
+
+   def common_axis(self, tol=1e-9):
+      """
+      Finds the axis shared by all the coils, if they are coaxial their field
+      is axisymmetric and only depends on (rho, z) about it
+
+      Returns:
+         (point, direction) (ndarrays (3, )): A point on the axis (the first
+            coil's centre) and its unit direction, or None if the coils are
+            not coaxial
+      """
+      point = self.centres[0]
+      direction = self.normals[0]
+      scale = max(np.max(self.radii), np.max(np.abs(self.centres - point)), 1.0)
+      # Normals parallel or anti-parallel to the first
+      parallel = np.linalg.norm(np.cross(self.normals, direction), axis=1) < tol
+      # Centres on the line through the first centre
+      offset = self.centres - point
+      on_axis = np.linalg.norm(np.cross(offset, direction), axis=1) < tol*scale
+      if not np.all(parallel & on_axis):
+         return None
+      return point.copy(), direction.copy()
+
+   def _blocks(self, n_points, block_size):
+      if block_size is None:
+         block_size = max(1, BLOCK_ELEMENTS//max(len(self), 1))
+      for start in range(0, n_points, block_size):
+         yield slice(start, min(start + block_size, n_points))
+
+   def _local(self, r):
+      """Points (m, 3) in every coil's frame, (n, m, 3)"""
+      return np.einsum('nij,nmj->nmi', self.rotmtx, r[None, :, :] - self.centres[:, None, :])
+
+   def _to_lab(self, local, out):
+      """
+      Rotates per coil vectors (n, m, 3) back to the lab frame and adds them
+      to out, summed over the coils if out is (m, 3)
+      """
+      if out.ndim == 3:
+         out += np.einsum('nji,nmj->nmi', self.rotmtx, local)
+      else:
+         out += np.einsum('nji,nmj->mi', self.rotmtx, local)
+
+   def A(self, r, block_size=None, per_coil=False):
+      """
+      Returns the magnetic vector potential of all the coils
+      Arguments
+      ----------
+          r: ndarray, shape (m, 3)
+               Positions where the vector potential is evaluated, in m
+          block_size: int, optional
+               Points evaluated together, by default chosen so that about
+               BLOCK_ELEMENTS coil x point pairs are held at once
+          per_coil: bool, optional
+               Return each coil's vector potential rather than their sum
+
+      Returns
+      --------
+      A: ndarray, shape (m, 3), or (n, m, 3) per coil
+          The vector potential at each position in T*m
+      """
+      r = np.asarray(r, dtype=float).reshape(-1, 3)
+      total = np.zeros((len(self), len(r), 3)) if per_coil else np.zeros_like(r)
+      radii = self.radii[:, None]
+      B0 = self.B0[:, None]
+      for block in self._blocks(len(r), block_size):
+         rrot = self._local(r[block])
+         x = rrot[:, :, 0]
+         y = rrot[:, :, 1]
+         z = rrot[:, :, 2]
+         rho = np.sqrt(x**2 + y**2)
+         theta = np.arctan2(y, x)
+         alpha = rho/radii
+         beta = z/radii
+         Q = (1 + alpha)**2 + beta**2
+         m = 4*alpha/Q
+
+         with np.errstate(divide='ignore', invalid='ignore'):
+            E = ellipe(m)
+            K = ellipkm1(1 - m)
+            Aphi = 2*radii*B0*((2 - m)*K - 2*E)/(m*np.pi*np.sqrt(Q))
+         Aphi[~np.isfinite(Aphi)] = 0
+
+         local = np.stack((-np.sin(theta)*Aphi, np.cos(theta)*Aphi, np.zeros_like(Aphi)), axis=2)
+         self._to_lab(local, total[..., block, :])
+      return total
+
+   def B(self, r, block_size=None, per_coil=False):
+      """
+      Returns the magnetic field of all the coils
+      Arguments
+      ----------
+          r: ndarray, shape (m, 3)
+               Positions where the magnetic field is evaluated, in m
+          block_size: int, optional
+               Points evaluated together, by default chosen so that about
+               BLOCK_ELEMENTS coil x point pairs are held at once
+          per_coil: bool, optional
+               Return each coil's field rather than their sum
+
+      Returns
+      --------
+      B: ndarray, shape (m, 3), or (n, m, 3) per coil
+          The field at each position in T
+      """
+      r = np.asarray(r, dtype=float).reshape(-1, 3)
+      total = np.zeros((len(self), len(r), 3)) if per_coil else np.zeros_like(r)
+      radii = self.radii[:, None]
+      B0 = self.B0[:, None]
+      axis_B = self.mu*self.currents[:, None]*radii**2/2
+      for block in self._blocks(len(r), block_size):
+         rrot = self._local(r[block])
+         x = rrot[:, :, 0] # radial
+         y = rrot[:, :, 1] # also radial
+         z = rrot[:, :, 2] # axial
+         rho = np.sqrt(x**2 + y**2)
+         theta = np.arctan2(y, x)
+         alpha = rho/radii
+         axis = alpha < 1e-9
+         rho[axis] = 5.678e6 # bogus value, is huge
+         beta = z/radii
+         gamma = z/rho # should be ~ inf on axis, bogus value makes it small
+         Q = (1 + alpha)**2 + beta**2 # ~ alpha**2 for the bogus value
+         m = 4*alpha/Q #~4/alpha for the bogus value
+
+         with np.errstate(divide='ignore', invalid='ignore'):
+            denom = Q - 4*alpha
+            E = ellipe(m)
+            K = ellipkm1(1 - m)
+
+            a2_plus_b2 = alpha**2 + beta**2
+            B0overPiSqrtQ = B0/np.pi/np.sqrt(Q)
+            Bz = B0overPiSqrtQ*(E*(1 - a2_plus_b2)/denom + K)
+            Brho = B0overPiSqrtQ*gamma*(E*(1 + a2_plus_b2)/denom - K)
+         Brho[~np.isfinite(Brho) | axis] = 0
+         Bz[~np.isfinite(Bz)] = 0
+         on_axis = np.broadcast_to(axis_B, axis.shape)[axis]
+         Bz[axis] = on_axis/(np.broadcast_to(radii, axis.shape)[axis]**2 + z[axis]**2)**1.5
+
+         local = np.stack((np.cos(theta)*Brho, np.sin(theta)*Brho, Bz), axis=2)
+         self._to_lab(local, total[..., block, :])
+      return total
+
+   def psi(self, r, block_size=None):
+      """
+      Returns the magnetic flux function of all the coils, each coil's psi is
+      taken about its own axis so the sum is the poloidal flux (per radian)
+      only for a coaxial set
+      Arguments
+      ----------
+          r: ndarray, shape (m, 3)
+               Positions where psi is evaluated, in m
+
+      Returns
+      --------
+      psi: ndarray, shape (m, )
+          The flux function at each position in Wb
+      """
+      r = np.asarray(r, dtype=float).reshape(-1, 3)
+      total = np.zeros(len(r))
+      radii = self.radii[:, None]
+      B0 = self.B0[:, None]
+      for block in self._blocks(len(r), block_size):
+         rrot = self._local(r[block])
+         rho = np.sqrt(rrot[:, :, 0]**2 + rrot[:, :, 1]**2)
+         alpha = rho/radii
+         beta = rrot[:, :, 2]/radii
+         Q = (1 + alpha)**2 + beta**2
+         m = 4*alpha/Q
+
+         with np.errstate(divide='ignore', invalid='ignore'):
+            E = ellipe(m)
+            K = ellipk(m)
+            psi = B0*radii**2*0.5*K/np.pi*np.sqrt(Q)*(2*(K - E)/K - m) # rho*Aphi
+         psi[np.isnan(psi)] = 0
+         total[block] += psi.sum(axis=0)
+      return total
+
+
+def read_coil_csv(path):
+   """
+   Reads a coil set written by any of the coil generators, .npz or csv in
+   the coilset schema or one of the older csv layouts (see coilset.read_coil_set)
+
+   Returns:
+      coils (dict of ndarrays): turns, currents (per turn), radii, centres (n, 3),
+         normals (n, 3) and the winding pack's radial and axial widths dr and dz
+   """
+   return read_coil_set(path)
@@ -0,0 +1,172 @@
+"""
+SegmentCoilSet: the field of coils given as polylines of straight current
+filaments, such as the TF coil centre lines written by TF_step.
+
+Each straight segment's field is the closed form Biot-Savart result
+(Hanson and Hirshman, Phys. Plasmas 9, 2002), evaluated for blocks of
+segments against blocks of points with broadcast operations. Distances are
+softened by a core radius, so the field stays finite in and next to the
+conductor instead of diverging on its centre line.
+"""
+import copy
+
+import numpy as np
+
+MU0 = np.pi*4e-7
+
+# Segment x point pairs evaluated together, bounds the size of the temporaries
+BLOCK_ELEMENTS = 2**20
+# Softening of the filaments, roughly the conductor radius, in m
+CORE_RADIUS = 0.05
+
+
+class SegmentCoilSet:
+   """
+      SegmentCoilSet(lines, currents, core_radius=CORE_RADIUS)
+
+      lines: list of ndarrays (k, 3): The points along each coil, a coil that
+         does not end where it starts is closed back to its first point
+      currents: float or ndarray (n, ): The current in each coil (ampere
+         turns), flowing in the order of its points
+      core_radius: float: Distance below which the field is softened
+   """
+   def __init__(self, lines, currents, core_radius=CORE_RADIUS):
+      starts = []
+      ends = []
+      coil = []
+      for index, line in enumerate(lines):
+         line = np.asarray(line, dtype=float).reshape(-1, 3)
+         if np.linalg.norm(line[-1] - line[0]) > 1e-9*max(np.ptp(line), 1.0):
+            line = np.vstack((line, line[:1]))
+         length = np.linalg.norm(np.diff(line, axis=0), axis=1)
+         # Repeated points make zero length segments, which carry no field
+         keep = length > 0
+         starts.append(line[:-1][keep])
+         ends.append(line[1:][keep])
+         coil.append(np.full(np.count_nonzero(keep), index))
+      self.n_coils = len(lines)
+      self.starts = np.concatenate(starts) if starts else np.empty((0, 3))
+      self.ends = np.concatenate(ends) if ends else np.empty((0, 3))
+      self.coil = np.concatenate(coil) if coil else np.empty(0, dtype=int)
+      self.currents = np.broadcast_to(np.asarray(currents, dtype=float), (self.n_coils, )).copy()
+      self.core_radius = float(core_radius)
+      self.mu = MU0
+
+   def __len__(self):
+      return len(self.starts)
+
+   @classmethod
+   def from_csv(cls, path, current, core_radius=CORE_RADIUS):
+      """Builds the set from a TF coil csv, with the same current in every coil"""
+      return cls(read_tf_csv(path), current, core_radius)
+
+   def with_currents(self, currents):
+      """A copy of the set with new currents, sharing its segments"""
+      coils = copy.copy(self)
+      coils.currents = np.broadcast_to(np.asarray(currents, dtype=float), (self.n_coils, )).copy()
+      return coils
+
+   def _blocks(self, n, block_size):
+      for start in range(0, n, block_size):
+         yield slice(start, min(start + block_size, n))
+
+   def B(self, r, block_size=None):
+      """
+      Returns the magnetic field of all the coils
+      Arguments
+      ----------
+          r: ndarray, shape (m, 3)
+               Positions where the magnetic field is evaluated, in m
+          block_size: int, optional
+               Points evaluated together, by default chosen so that about
+               BLOCK_ELEMENTS segment x point pairs are held at once
+
+      Returns
+      --------
+      B: ndarray, shape (m, 3)
+          The field at each position in T
+      """
+      r = np.asarray(r, dtype=float).reshape(-1, 3)
+      total = np.zeros_like(r)
+      if not len(self):
+         return total
+      n_segments = min(len(self), BLOCK_ELEMENTS)
+      if block_size is None:
+         block_size = max(1, BLOCK_ELEMENTS//n_segments)
+      eps2 = self.core_radius**2
+      current = self.currents[self.coil]*self.mu/(4*np.pi)
+
+      for segments in self._blocks(len(self), n_segments):
+         start = self.starts[segments]
+         seg = self.ends[segments] - start
+         L = np.linalg.norm(seg, axis=1)[:, None]
+         unit = seg/L
+         for points in self._blocks(len(r), block_size):
+            Ri = r[points][None, :, :] - start[:, None, :]
+            Rf = Ri - seg[:, None, :]
+            ri = np.sqrt(np.sum(Ri**2, axis=2) + eps2)
+            rf = np.sqrt(np.sum(Rf**2, axis=2) + eps2)
+            factor = current[segments][:, None]*2*L*(ri + rf)/(ri*rf*((ri + rf)**2 - L**2))
+            total[points] += np.einsum('sm,smi->mi', factor, np.cross(unit[:, None, :], Ri))
+      return total
+
+   def distance(self, r, block_size=None):
+      """Distance from each point (m, 3) to the nearest segment"""
+      r = np.asarray(r, dtype=float).reshape(-1, 3)
+      nearest = np.full(len(r), np.inf)
+      n_segments = min(max(len(self), 1), BLOCK_ELEMENTS)
+      if block_size is None:
+         block_size = max(1, BLOCK_ELEMENTS//n_segments)
+      for segments in self._blocks(len(self), n_segments):
+         start = self.starts[segments]
+         seg = self.ends[segments] - start
+         seg2 = np.sum(seg**2, axis=1)[:, None]
+         for points in self._blocks(len(r), block_size):
+            Ri = r[points][None, :, :] - start[:, None, :]
+            t = np.clip(np.einsum('smi,si->sm', Ri, seg)/seg2, 0, 1)
+            d = np.linalg.norm(Ri - t[:, :, None]*seg[:, None, :], axis=2)
+            nearest[points] = np.minimum(nearest[points], d.min(axis=0))
+      return nearest
+
+
+def read_tf_csv(path):
+   """
+   Reads the TF coil csv written by TF_step, blocks of
+
+      TF Coil n
+      x,y,z
+      x,y,z rows
+
+   A file without "TF Coil" lines is read as a single coil.
+
+   Returns:
+      lines (list of ndarrays (k, 3)): The points along each coil
+   """
+   lines = []
+   rows = None
+   with open(path, 'r') as file:
+      for text in file:
+         text = text.strip()
+         if not text:
+            continue
+         if text.lower().startswith("tf coil"):
+            rows = []
+            lines.append(rows)
+            continue
+         cells = [cell.strip() for cell in text.split(',')]
+         try:
+            values = [float(cell) for cell in cells[:3]]
+         except ValueError:
+            if cells[:2] == ["R", "Z"]:
+               raise ValueError(f"{path} is a 2-D TF profile (R,Z,Connection), "
+                                "the field needs the 3-D coils written by TF_step")
+            # The x,y,z header of each block
+            continue
+         if rows is None:
+            rows = []
+            lines.append(rows)
+         rows.append(values)
+   lines = [np.array(rows, dtype=float) for rows in lines if len(rows) > 1]
+   if not lines:
+      raise ValueError(f"No TF coils in {path}")
+   return lines
@@ -0,0 +1,141 @@
+"""
+Adaptive octree sampling of a coil set's field.
+
+The cells of the uniform dx, dy, dz grid are the roots. A cell is split
+into eight when the field at its centre differs from the mean of its
+corners by more than the tolerance, or when a winding passes within the
+cell, until the maximum depth is reached. A whole level of cells is
+handled at once, and every point is evaluated only once however many
+cells share it. Smooth regions stay at the grid spacing and the windings
+are resolved at grid spacing / 2**max_depth.
+"""
+import numpy as np
+
+MAX_DEPTH = 4
+TOLERANCE = 1e-3
+# Relative errors are measured against at least this fraction of the
+# typical |B|, so cells where the field is close to zero are not refined forever
+FIELD_FLOOR = 1e-3
+
+# Corners of a unit cell, x fastest as VTK voxels order them
+CORNER_OFFSETS = np.array([[i, j, k] for k in (0, 1) for j in (0, 1) for i in (0, 1)], dtype=np.int64)
+
+
+class _PointStore:
+    """Field at points of the finest integer lattice, each evaluated once"""
+    def __init__(self, lower, step, dims, evaluate):
+        self.lower = np.asarray(lower, dtype=float)
+        self.step = np.asarray(step, dtype=float)
+        self.dims = np.asarray(dims, dtype=np.int64)
+        self.evaluate = evaluate
+        self.keys = np.empty(0, dtype=np.int64)
+        self.B = np.empty((0, 3))
+
+    def _key(self, coords):
+        return (coords[..., 0]*self.dims[1] + coords[..., 1])*self.dims[2] + coords[..., 2]
+
+    def position(self, coords):
+        return self.lower + coords*self.step
+
+    def field(self, coords):
+        """Field at integer coords (..., 3), evaluating points not seen before"""
+        keys = self._key(coords)
+        new = np.unique(keys[~np.isin(keys, self.keys)])
+        if len(new):
+            k = new % self.dims[2]
+            j = (new//self.dims[2]) % self.dims[1]
+            i = new//(self.dims[1]*self.dims[2])
+            B = self.evaluate(self.position(np.stack((i, j, k), axis=1)))
+            keys_all = np.concatenate((self.keys, new))
+            order = np.argsort(keys_all)
+            self.keys = keys_all[order]
+            self.B = np.concatenate((self.B, B))[order]
+        return self.B[np.searchsorted(self.keys, keys)]
+
+    def index(self, coords):
+        return np.searchsorted(self.keys, self._key(coords))
+
+    def points(self):
+        k = self.keys % self.dims[2]
+        j = (self.keys//self.dims[2]) % self.dims[1]
+        i = self.keys//(self.dims[1]*self.dims[2])
+        return self.position(np.stack((i, j, k), axis=1))
+
+
+def winding_distance(coils, points):
+    """Distance from each point (n, 3) to the nearest coil winding"""
+    nearest = np.full(len(points), np.inf)
+    for block in coils._blocks(len(points), None):
+        local = coils._local(points[block])
+        rho = np.sqrt(local[:, :, 0]**2 + local[:, :, 1]**2)
+        distance = np.sqrt((rho - coils.radii[:, None])**2 + local[:, :, 2]**2)
+        nearest[block] = distance.min(axis=0)
+    return nearest
+
+
+def sample_adaptive(coils, lower, spacing, shape, evaluate, max_depth=MAX_DEPTH, tolerance=TOLERANCE,
+                    segments=None):
+    """
+    Samples the field on an octree refined from the uniform grid
+
+    Args:
+        coils (MagCoilSet): The coils, used to find the windings
+        lower (array-like (3, )): Lowest corner of the grid
+        spacing (array-like (3, )): dx, dy, dz of the uniform grid
+        shape (array-like (3, )): Points of the uniform grid along x, y and z
+        evaluate (callable): evaluate(points (n, 3)) returns B (n, 3)
+        max_depth (int): Times a grid cell can be halved
+        tolerance (float): Relative difference between the field at a
+            cell's centre and the mean of its corners above which it is split
+        segments (SegmentCoilSet): Filament coils, cells they pass through
+            are split like those of the loops
+
+    Returns:
+        points (ndarray (n, 3)): Every evaluated point
+        B (ndarray (n, 3)): The field at each point
+        cells (ndarray (m, 8)): Point indices of the leaf cells' corners
+        depth (ndarray (m, )): Depth of each leaf cell
+    """
+    scale = 2**max_depth
+    shape = np.asarray(shape, dtype=np.int64)
+    cells_shape = np.maximum(shape - 1, 1)
+    store = _PointStore(lower, np.asarray(spacing, dtype=float)/scale, cells_shape*scale + 1, evaluate)
+
+    # Roots are the cells of the uniform grid, in integer units of the finest level
+    cells = scale*np.stack(np.meshgrid(*(np.arange(n) for n in cells_shape), indexing='ij'), axis=-1).reshape(-1, 3)
+    leaves = []
+    depths = []
+    typical = None
+    for depth in range(max_depth + 1):
+        size = scale//2**depth
+        corners = cells[:, None, :] + size*CORNER_OFFSETS
+        B_corners = store.field(corners)
+        if typical is None:
+            typical = np.median(np.linalg.norm(B_corners, axis=2))
+        if depth == max_depth:
+            leaves.append(cells)
+            depths.append(np.full(len(cells), depth))
+            break
+
+        centres = cells + size//2
+        B_centres = store.field(centres)
+        error = np.linalg.norm(B_centres - B_corners.mean(axis=1), axis=1)
+        refine = error > tolerance*np.maximum(np.linalg.norm(B_centres, axis=1), FIELD_FLOOR*typical)
+        # Cells a winding passes through are split whatever their corners say
+        half_diagonal = 0.5*np.linalg.norm(size*store.step)
+        distance = winding_distance(coils, store.position(centres))
+        if segments is not None:
+            distance = np.minimum(distance, segments.distance(store.position(centres)))
+        refine |= distance < half_diagonal
+
+        leaves.append(cells[~refine])
+        depths.append(np.full(np.count_nonzero(~refine), depth))
+        cells = (cells[refine][:, None, :] + (size//2)*CORNER_OFFSETS).reshape(-1, 3)
+        if not len(cells):
+            break
+
+    leaves = np.concatenate(leaves)
+    depths = np.concatenate(depths)
+    sizes = scale//2**depths
+    cell_points = store.index(leaves[:, None, :] + sizes[:, None, None]*CORNER_OFFSETS)
+    return store.points(), store.B, cell_points, depths
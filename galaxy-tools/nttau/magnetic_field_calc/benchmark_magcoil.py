@@ -0,0 +1,220 @@
+"""
+Accuracy and speed of the circular loop field engines, MagCoil (one coil at
+a time) and MagCoilSet (every coil at once).
+
+The accuracy checks compare against closed forms: the on-axis field, the
+dipole far field, div B = 0 and the flux through a circle. They return
+relative errors, which test_magcoil.py bounds and the benchmark records. The
+timings are seconds per million points for A, B and psi. Results are written
+as json so an engine change can be compared with the run before it:
+
+    python benchmark_magcoil.py benchmark.json
+"""
+import argparse
+import json
+import os
+import platform
+import time
+
+import numpy as np
+import scipy
+
+from MagCoil import MagCoil
+from MagCoilSet import MagCoilSet
+
+MU0 = np.pi*4e-7
+COIL_COUNTS = (1, 10, 100, 1000)
+# Coil x point pairs evaluated per timing, larger sets use fewer points
+PAIRS = 2*10**6
+REPEATS = 3
+
+
+class LoopEngine:
+    """
+    LoopEngine(coils): sums MagCoil objects one at a time, the way the
+    field was calculated before MagCoilSet
+    """
+    name = "MagCoil"
+
+    def __init__(self, coils):
+        self.coils = coils
+
+    def A(self, r):
+        return sum(coil.A(r) for coil in self.coils)
+
+    def B(self, r):
+        return sum(coil.B(r) for coil in self.coils)
+
+    def psi(self, r):
+        return sum(coil.psi(r) for coil in self.coils)
+
+
+class SetEngine(MagCoilSet):
+    """SetEngine(coils): MagCoilSet built from MagCoil objects"""
+    name = "MagCoilSet"
+
+    def __init__(self, coils):
+        MagCoilSet.__init__(self, [coil.r0 for coil in coils], [coil.normal for coil in coils],
+                            [coil.R for coil in coils], [coil.I for coil in coils])
+
+
+ENGINES = (LoopEngine, SetEngine)
+
+
+def tilted_coil(R=0.7, I=2.5e4):
+    """A coil off the origin with a normal along no lab axis"""
+    return MagCoil(np.array([0.3, -0.2, 0.5]), np.array([1.0, 2.0, 2.0]), R, I)
+
+
+def random_coils(n, seed=0):
+    """n coils with random centres, normals, radii and currents"""
+    rng = np.random.default_rng(seed)
+    return [MagCoil(rng.uniform(-2, 2, 3), rng.normal(size=3), rng.uniform(0.2, 1.5), rng.normal()*1e4)
+            for _ in range(n)]
+
+
+def on_axis_error(engine):
+    """Largest relative error against mu0 I R^2/(2 (R^2 + z^2)^1.5) along the axis"""
+    coil = tilted_coil()
+    z = np.linspace(-5, 5, 101)*coil.R
+    r = coil.r0 + z[:, None]*coil.normal
+    B = engine([coil]).B(r)
+    exact = MU0*coil.I*coil.R**2/(2*(coil.R**2 + z**2)**1.5)
+    return float(np.max(np.linalg.norm(B - exact[:, None]*coil.normal, axis=1)/exact))
+
+
+def dipole_error(engine, distance=100.0):
+    """
+    Largest relative error against the field of a dipole of moment I pi R^2
+    at distance coil radii, where the loop's own correction is ~(R/d)^2
+    """
+    coil = tilted_coil()
+    rng = np.random.default_rng(1)
+    direction = rng.normal(size=(50, 3))
+    direction /= np.linalg.norm(direction, axis=1)[:, None]
+    d = distance*coil.R
+    moment = coil.I*np.pi*coil.R**2*coil.normal
+    exact = MU0/(4*np.pi*d**3)*(3*(direction @ moment)[:, None]*direction - moment)
+    B = engine([coil]).B(coil.r0 + d*direction)
+    return float(np.max(np.linalg.norm(B - exact, axis=1)/np.linalg.norm(exact, axis=1)))
+
+
+def divergence_error(engine, h=1e-4):
+    """
+    Largest |div B| from central differences, relative to |B|/R at points
+    around (not on) the winding
+    """
+    coils = random_coils(3, seed=2)
+    field = engine(coils)
+    rng = np.random.default_rng(3)
+    r = rng.uniform(-3, 3, (200, 3))
+    distance = np.min([np.abs(np.linalg.norm(np.cross(r - c.r0, c.normal), axis=1) - c.R) +
+                       np.abs((r - c.r0) @ c.normal) for c in coils], axis=0)
+    r = r[distance > 0.1]
+    div = sum((field.B(r + h*e)[:, i] - field.B(r - h*e)[:, i])/(2*h) for i, e in enumerate(np.eye(3)))
+    scale = np.linalg.norm(field.B(r), axis=1)/min(c.R for c in coils)
+    return float(np.max(np.abs(div)/scale))
+
+
+def flux_error(engine):
+    """
+    Largest relative error of 2 pi psi against the flux of B through circles
+    about the coil axis, integrated numerically
+    """
+    coil = tilted_coil()
+    field = engine([coil])
+    u = np.cross(coil.normal, [1.0, 0, 0])
+    u /= np.linalg.norm(u)
+    errors = []
+    for rho, z in ((0.3, 0.2), (0.7, 0.4), (1.5, -0.3), (3.0, 1.0)):
+        rho_axis = np.linspace(0, rho, 4001)
+        r = coil.r0 + rho_axis[:, None]*u + z*coil.normal
+        Bn = field.B(r) @ coil.normal
+        # Trapezoidal rule, np.trapezoid is not in the numpy 1.x of the tool containers
+        integrand = 2*np.pi*rho_axis*Bn
+        flux = (rho_axis[1] - rho_axis[0])*(np.sum(integrand) - (integrand[0] + integrand[-1])/2)
+        psi = field.psi(r[-1:])[0]
+        errors.append(abs(2*np.pi*psi - flux)/abs(flux))
+    return float(max(errors))
+
+
+ACCURACY = {
+    "on_axis": on_axis_error,
+    "dipole": dipole_error,
+    "divergence": divergence_error,
+    "flux": flux_error,
+}
+
+
+def time_per_million(function, r, repeats=REPEATS):
+    """Best of repeats, in seconds per million points"""
+    best = np.inf
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function(r)
+        best = min(best, time.perf_counter() - start)
+    return best*1e6/len(r)
+
+
+def benchmark(coil_counts=COIL_COUNTS, pairs=PAIRS, engines=ENGINES, repeats=REPEATS):
+    """
+    Runs the accuracy checks and timings
+
+    Args:
+        coil_counts (tuple of ints): Sizes of the coil sets timed
+        pairs (int): Coil x point pairs per timing, sets the number of points
+        engines (tuple): Engine classes, built from a list of MagCoil
+        repeats (int): Timings are the best of this many runs
+
+    Returns:
+        results (dict): json serialisable, the environment, the relative
+            errors per engine and one timing record per engine, quantity and
+            coil count
+    """
+    results = {
+        "environment": {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "scipy": scipy.__version__,
+            "machine": platform.machine(),
+            "processor": platform.processor(),
+            "cpus": os.cpu_count(),
+        },
+        "accuracy": {engine.name: {name: check(engine) for name, check in ACCURACY.items()}
+                     for engine in engines},
+        "timings": [],
+    }
+    rng = np.random.default_rng(4)
+    for n_coils in coil_counts:
+        coils = random_coils(n_coils)
+        r = rng.uniform(-3, 3, (max(100, pairs//n_coils), 3))
+        for engine in engines:
+            field = engine(coils)
+            for quantity in ("A", "B", "psi"):
+                results["timings"].append({
+                    "engine": engine.name,
+                    "quantity": quantity,
+                    "coils": n_coils,
+                    "points": len(r),
+                    "seconds_per_million_points": time_per_million(getattr(field, quantity), r, repeats),
+                })
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('output', help="json file for the results")
+    parser.add_argument('--coils', type=int, nargs='+', default=COIL_COUNTS, help="Coil set sizes timed")
+    parser.add_argument('--pairs', type=int, default=PAIRS, help="Coil x point pairs per timing")
+    parser.add_argument('--repeats', type=int, default=REPEATS)
+    args = parser.parse_args()
+
+    results = benchmark(args.coils, args.pairs, repeats=args.repeats)
+    with open(args.output, 'w') as file:
+        json.dump(results, file, indent=2)
+    for name, errors in results["accuracy"].items():
+        print(name, ", ".join(f"{check} {error:.2e}" for check, error in errors.items()))
+    for record in results["timings"]:
+        print(f"{record['engine']:>10} {record['quantity']:>3} {record['coils']:>5} coils "
+              f"{record['seconds_per_million_points']:10.3f} s per million points")
+    print("Wrote", args.output)
@@ -0,0 +1,168 @@
+"""
+The coil set format shared by the coil generators (tokamakgen,
+tokamak_gen_v2, mfe_mirror_geometry and cylinder_gen) and the field tools.
+
+A coil set is a dict of typed arrays, one entry per coil:
+
+    turns    (n, )   float64  turns in the winding pack
+    currents (n, )   float64  current per turn in A, right handed about the normal
+    radii    (n, )   float64  mean radius of the winding pack in m
+    dr, dz   (n, )   float64  radial and axial widths of the winding pack in m
+    centres  (n, 3)  float64  centre x, y, z in m
+    normals  (n, 3)  float64  unit normal to the plane of the coil
+
+It is stored as .npz (those arrays plus schema_version) or, as a fallback
+that opens in a spreadsheet, as csv with exactly the CSV_COLUMNS header.
+Both are read without a Python loop over coils. The older csv layouts the
+generators used to write are still read.
+
+This file is copied into each tool that reads or writes coil sets, keep the
+copies the same.
+"""
+import csv
+import os
+
+import numpy as np
+
+SCHEMA_VERSION = 1
+
+CSV_COLUMNS = ["turns", "current", "radius", "dr", "dz", "centre_x", "centre_y", "centre_z",
+               "normal_x", "normal_y", "normal_z"]
+
+
+def coil_set(turns, currents, radii, centres, normals, dr, dz):
+    """
+    Builds a coil set from per coil values, a scalar (or one normal) is used for every coil
+
+    Returns:
+        coils (dict of ndarrays): See the module docstring
+    """
+    centres = np.array(centres, dtype=float).reshape(-1, 3)
+    normals = np.array(normals, dtype=float).reshape(-1, 3)
+    n = len(centres)
+    if len(normals) not in (1, n):
+        raise ValueError(f"{n} coil centres but {len(normals)} normals")
+    normals = np.broadcast_to(normals, (n, 3))
+    length = np.linalg.norm(normals, axis=1)
+    if np.any(length == 0):
+        raise ValueError("Coil normals must not be zero")
+    # Unit normals are kept as they are so that a set reads back bit for bit
+    length[np.abs(length - 1) < 1e-12] = 1
+
+    def column(values):
+        return np.broadcast_to(np.asarray(values, dtype=float), (n, )).copy()
+
+    return {
+        "turns": column(turns),
+        "currents": column(currents),
+        "radii": column(radii),
+        "dr": column(dr),
+        "dz": column(dz),
+        "centres": centres,
+        "normals": normals/length[:, None],
+    }
+
+
+def coil_set_from_rows(rows):
+    """
+    Builds a coil set from the rows the generators make for each coil:
+    R_turns, Z_turns, I, r_av, dr, dz, coil_x, coil_y, coil_z, normal_x, normal_y, normal_z
+    """
+    rows = np.array(rows, dtype=float).reshape(-1, 12)
+    return coil_set(rows[:, 0]*rows[:, 1], rows[:, 2], rows[:, 3], rows[:, 6:9], rows[:, 9:12], rows[:, 4], rows[:, 5])
+
+
+def write_coil_set(path, coils):
+    """Writes a coil set, as .npz if path ends in .npz and as csv otherwise"""
+    coils = coil_set(coils["turns"], coils["currents"], coils["radii"], coils["centres"], coils["normals"],
+                     coils["dr"], coils["dz"])
+    if str(path).endswith(".npz"):
+        np.savez(path, schema_version=SCHEMA_VERSION, **coils)
+        return
+    rows = np.column_stack((coils["turns"], coils["currents"], coils["radii"], coils["dr"], coils["dz"],
+                            coils["centres"], coils["normals"]))
+    np.savetxt(path, rows, delimiter=',', fmt='%.17g', header=",".join(CSV_COLUMNS), comments='')
+
+
+def append_coil_set(path, coils):
+    """Adds coils to the coil set at path, which is created if it does not exist"""
+    coils = coil_set(coils["turns"], coils["currents"], coils["radii"], coils["centres"], coils["normals"],
+                     coils["dr"], coils["dz"])
+    if os.path.exists(path) and os.path.getsize(path) > 0:
+        existing = read_coil_set(path)
+        coils = {name: np.concatenate((existing[name], coils[name])) for name in existing}
+    write_coil_set(path, coils)
+
+
+def read_coil_set(path):
+    """
+    Reads a coil set from .npz, the schema csv or one of the older csv files:
+        tokamak_gen_v2: no header, R_turns,Z_turns,I,r_av,dr,dz,coil_x,coil_y,coil_z,normal_x,normal_y,normal_z
+        tokamakgen: the same columns with that header
+        mfe_mirror_geometry: R_turns,Z_turns,I (A),R_av,dr,dz,Coil_X,Coil_Y,Coil_Z,Normal_x,Normal_y,Normal_z
+        cylinder_gen: N,I (A),Inner Radius,Outer radius,Coil_X,Coil_Y,Coil_Z,Normal X,Normal Y,Normal Z
+            (no axial width, the winding pack is taken to be square)
+
+    Returns:
+        coils (dict of ndarrays): See the module docstring
+    """
+    with open(path, 'rb') as file:
+        start = file.read(4096)
+    if start.startswith(b"PK"):
+        with np.load(path) as data:
+            version = int(data["schema_version"]) if "schema_version" in data else SCHEMA_VERSION
+            if version > SCHEMA_VERSION:
+                raise ValueError(f"{path} is coil set schema {version}, this reader knows up to {SCHEMA_VERSION}")
+            return coil_set(data["turns"], data["currents"], data["radii"], data["centres"], data["normals"],
+                            data["dr"], data["dz"])
+
+    header = start.split(b"\n", 1)[0].decode().strip().split(",")
+    if [name.strip() for name in header] == CSV_COLUMNS:
+        rows = np.loadtxt(path, delimiter=',', skiprows=1, ndmin=2)
+        return coil_set(rows[:, 0], rows[:, 1], rows[:, 2], rows[:, 5:8], rows[:, 8:11], rows[:, 3], rows[:, 4])
+    return _read_legacy_csv(path)
+
+
+def _column_key(name):
+    """Normalises the header names used by the different coil generators"""
+    return name.strip().lower().replace(' (a)', '').replace(' ', '_')
+
+
+def _read_legacy_csv(path):
+    with open(path, 'r', newline='') as file:
+        for number, first in enumerate(file):
+            if first.strip(" ,\r\n"):
+                break
+        else:
+            raise ValueError(f"No coils in {path}")
+    names = next(csv.reader([first]))
+    try:
+        [float(cell) for cell in names if cell.strip()]
+        header = ["r_turns", "z_turns", "i", "r_av", "dr", "dz",
+                  "coil_x", "coil_y", "coil_z", "normal_x", "normal_y", "normal_z"]
+        skip = number
+    except ValueError:
+        header = [_column_key(name) for name in names]
+        skip = number + 1
+
+    used = [index for index, name in enumerate(header) if name]
+    rows = np.genfromtxt(path, delimiter=',', skip_header=skip, usecols=used, dtype=float).reshape(-1, len(used))
+    # Rows of empty cells, as spreadsheets leave at the end, read as NaN
+    rows = rows[~np.all(np.isnan(rows), axis=1)]
+    columns = {header[index]: rows[:, column] for column, index in enumerate(used)}
+
+    if "n" in columns:
+        turns = columns["n"]
+    else:
+        turns = columns["r_turns"]*columns["z_turns"]
+    if "r_av" in columns:
+        radii = columns["r_av"]
+        dr = columns["dr"]
+    else:
+        radii = (columns["inner_radius"] + columns["outer_radius"])/2
+        dr = columns["outer_radius"] - columns["inner_radius"]
+    dz = columns.get("dz", dr)
+
+    return coil_set(turns, columns["i"], radii,
+                    np.stack([columns[f"coil_{axis}"] for axis in "xyz"], axis=1),
+                    np.stack([columns[f"normal_{axis}"] for axis in "xyz"], axis=1), dr, dz)
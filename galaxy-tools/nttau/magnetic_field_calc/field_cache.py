@@ -0,0 +1,201 @@
+"""
+On-disk cache of each coil's field per unit current.
+
+The field is linear in the coil currents, so once every coil's field for
+one ampere turn is known on a grid, the field for any currents is the
+weighted sum of those responses and needs no elliptic integrals. A
+response is keyed by the coil geometry (centre, normal and radius) and the
+grid it was evaluated on, never by the current, so current scans and
+current optimisation reuse them.
+
+Responses are .npy files named by the key, read memory mapped so that a
+weighted sum only holds a chunk of each in memory. The least recently used
+responses are deleted once the cache is over its size limit.
+"""
+import hashlib
+import json
+import os
+
+import numpy as np
+
+# Part of every key, bump it when the field calculation changes
+CACHE_VERSION = 1
+CACHE_MAX_BYTES = 4*1024**3
+
+
+def _floats(values):
+    return [float(v) for v in np.ravel(values)]
+
+
+def coil_key(centre, normal, radius, grid):
+    """
+    Key of one coil's unit current field on a grid
+
+    Args:
+        centre, normal (array-like (3, )): The coil, the normal is included
+            with its sign as it sets the direction of the current
+        radius (float): Radius of the coil
+        grid (dict): Describes the points the field is evaluated on, any
+            json serialisable values
+
+    Returns:
+        key (string): sha256 hex digest
+    """
+    description = {
+        "version": CACHE_VERSION,
+        "centre": _floats(centre),
+        "normal": _floats(normal),
+        "radius": float(radius),
+        "grid": grid,
+    }
+    return hashlib.sha256(json.dumps(description, sort_keys=True).encode()).hexdigest()
+
+
+def segments_key(starts, ends, core_radius, grid):
+    """
+    Key of the unit current field of a set of straight segments (the TF
+    coils, which all carry the same current) on a grid
+    """
+    geometry = hashlib.sha256()
+    for values in (starts, ends):
+        geometry.update(np.ascontiguousarray(values, dtype='<f8').tobytes())
+    description = {
+        "version": CACHE_VERSION,
+        "segments": geometry.hexdigest(),
+        "core_radius": float(core_radius),
+        "grid": grid,
+    }
+    return hashlib.sha256(json.dumps(description, sort_keys=True).encode()).hexdigest()
+
+
+class FieldCache:
+    """
+    FieldCache(path, max_bytes)
+
+    path: Directory the responses are kept in, created if needed
+    max_bytes: Size the cache is trimmed to after new responses are added,
+       0 or less for no limit
+    """
+    def __init__(self, path, max_bytes=CACHE_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        os.makedirs(path, exist_ok=True)
+        if not os.access(path, os.W_OK | os.X_OK):
+            raise PermissionError(f"Field cache {path} is not writable")
+
+    def _file(self, key):
+        return os.path.join(self.path, key + ".npy")
+
+    def get(self, key):
+        """Returns the response for key memory mapped, or None if it is not cached"""
+        path = self._file(key)
+        try:
+            response = np.load(path, mmap_mode='r')
+        except (FileNotFoundError, ValueError):
+            return None
+        # Marks it as recently used for eviction
+        os.utime(path)
+        return response
+
+    def create(self, key, shape):
+        """
+        Opens a new response for writing, it only becomes visible to get()
+        once passed to commit()
+        """
+        temp_path = f"{self._file(key)}.{os.getpid()}.tmp"
+        return np.lib.format.open_memmap(temp_path, mode='w+', dtype=np.float64, shape=shape)
+
+    def commit(self, key, response):
+        """Stores a response opened with create(), returns it memory mapped"""
+        temp_path = response.filename
+        response.flush()
+        del response
+        os.replace(temp_path, self._file(key))
+        return np.load(self._file(key), mmap_mode='r')
+
+    def discard(self, response):
+        """Deletes a response opened with create() that was not committed"""
+        temp_path = response.filename
+        del response
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+    def evict(self, protect=()):
+        """
+        Deletes least recently used responses until the cache fits max_bytes
+
+        Args:
+            protect (iterable of strings): Keys that must not be removed,
+                such as the responses of the current run
+
+        Returns:
+            evicted (list of strings): Keys that were deleted
+        """
+        if self.max_bytes <= 0:
+            return []
+        entries = []
+        for name in os.listdir(self.path):
+            if not name.endswith(".npy"):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.path, name))
+            except FileNotFoundError:
+                # Removed by another job in the meantime
+                continue
+            entries.append((stat.st_mtime, stat.st_size, name[:-len(".npy")]))
+
+        total = sum(size for _, size, _ in entries)
+        protect = set(protect)
+        evicted = []
+        for _, size, key in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if key in protect:
+                continue
+            try:
+                os.remove(self._file(key))
+            except FileNotFoundError:
+                pass
+            total -= size
+            evicted.append(key)
+        return evicted
+
+
+def unit_responses(cache, keys, shape, evaluate):
+    """
+    Loads each source's unit current response from the cache, evaluating
+    the missing ones together
+
+    Args:
+        cache (FieldCache): Where the responses are kept
+        keys (list of strings): Key of each source, see coil_key and
+            segments_key
+        shape (tuple): Shape of one response
+        evaluate (callable): evaluate(indices) evaluates the unit current
+            field of the sources at those indices, yielding blocks
+            (len(indices), block length, ...) along the first axis of shape
+
+    Returns:
+        responses (list of memmaps): One per source, in order
+        n_missing (int): Sources that had to be evaluated
+    """
+    responses = [cache.get(key) for key in keys]
+    missing = [c for c, response in enumerate(responses) if response is None]
+
+    if missing:
+        # Each coil's blocks are written straight into its new response
+        created = [cache.create(keys[c], shape) for c in missing]
+        try:
+            start = 0
+            for blocks in evaluate(missing):
+                for response, block in zip(created, blocks):
+                    response[start:start + len(block)] = block
+                start += len(blocks[0])
+            for c, response in zip(missing, created):
+                responses[c] = cache.commit(keys[c], response)
+            created = []
+        finally:
+            for response in created:
+                cache.discard(response)
+        cache.evict(protect=keys)
+    return responses, len(missing)
@@ -0,0 +1,382 @@
+"""
+Traces magnetic field lines and writes them as VTK PolyData (.vtp), which
+vtp_to_obj turns into tubes for the USD stage.
+
+The field comes from a field map written by magnetic_field_calc, read once
+and interpolated trilinearly, and/or directly from the coil csv. With both,
+the map is used inside its grid and the coils outside it. Every seed is
+integrated at once with an adaptive Dormand-Prince RK45 along the unit
+field direction, so the step is arc length, and the seeds are split across
+worker processes.
+"""
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from MagCoilSet import MagCoilSet
+from SegmentCoilSet import SegmentCoilSet
+from field_writers import read_field_map, write_vtp
+
+N_SEEDS = 100
+MAX_STEPS = 10000
+# Position error allowed per step, in m
+TOLERANCE = 1e-5
+
+# Dormand-Prince 5(4) tableau
+DP_A = [
+    [],
+    [1/5],
+    [3/40, 9/40],
+    [44/45, -56/15, 32/9],
+    [19372/6561, -25360/2187, 64448/6561, -212/729],
+    [9017/3168, -355/33, 46732/5247, 49/176, -5103/18656],
+    [35/384, 0, 500/1113, 125/192, -2187/6784, 11/84],
+]
+DP_B5 = np.array([35/384, 0, 500/1113, 125/192, -2187/6784, 11/84, 0])
+DP_B4 = np.array([5179/57600, 0, 7571/16695, 393/640, -92097/339200, 187/2100, 1/40])
+
+
+class GridField:
+    """
+    GridField(origin, spacing, shape, B, fallback=None)
+
+    Trilinear interpolation of a field map (B indexed [k, j, i] as
+    read_field_map returns it). Points outside the grid are passed to
+    fallback, or are NaN without one.
+    """
+    def __init__(self, origin, spacing, shape, B, fallback=None):
+        self.origin = np.asarray(origin, dtype=float)
+        self.spacing = np.asarray(spacing, dtype=float)
+        self.shape = np.asarray(shape, dtype=np.int64)
+        self.B = np.asarray(B, dtype=float)
+        self.fallback = fallback
+        self.lower = self.origin
+        self.upper = self.origin + self.spacing*(self.shape - 1)
+
+    @classmethod
+    def from_file(cls, path, fallback=None):
+        return cls(*read_field_map(path), fallback=fallback)
+
+    def __call__(self, points):
+        f = (points - self.origin)/self.spacing
+        inside = np.all((f >= -1e-9) & (f <= self.shape - 1 + 1e-9), axis=1)
+        # Points that are NaN (a line that already left) are outside
+        cell = np.clip(np.floor(np.nan_to_num(f)).astype(np.int64), 0, np.maximum(self.shape - 2, 0))
+        t = np.clip(f - cell, 0, 1)
+        upper = np.minimum(cell + 1, self.shape - 1)
+
+        result = np.zeros((len(points), 3))
+        for dk in (0, 1):
+            k = upper[:, 2] if dk else cell[:, 2]
+            wk = t[:, 2] if dk else 1 - t[:, 2]
+            for dj in (0, 1):
+                j = upper[:, 1] if dj else cell[:, 1]
+                wj = t[:, 1] if dj else 1 - t[:, 1]
+                for di in (0, 1):
+                    i = upper[:, 0] if di else cell[:, 0]
+                    wi = t[:, 0] if di else 1 - t[:, 0]
+                    result += (wi*wj*wk)[:, None]*self.B[k, j, i]
+
+        if not np.all(inside):
+            if self.fallback is None:
+                result[~inside] = np.nan
+            else:
+                result[~inside] = self.fallback(points[~inside])
+        return result
+
+
+class CoilField:
+    """
+    CoilField(coils, tf=None): The field of a MagCoilSet, plus the TF coils
+    (SegmentCoilSet) if given, evaluated directly. coils is None for TF
+    coils on their own
+    """
+    def __init__(self, coils, tf=None):
+        if coils is None and tf is None:
+            raise ValueError("CoilField needs coils or TF coils")
+        self.coils = coils
+        self.tf = tf
+
+    def __call__(self, points):
+        B = np.zeros((len(points), 3))
+        if self.coils is not None:
+            B += self.coils.B(points)
+        if self.tf is not None:
+            B += self.tf.B(points)
+        return B
+
+    def extent(self):
+        """Centre and size of the coils (the loops if there are any), for the default seeds and step"""
+        if self.coils is not None and len(self.coils):
+            centre = self.coils.centres.mean(axis=0)
+            size = 2*np.max(np.linalg.norm(self.coils.centres - centre, axis=1) + self.coils.radii)
+            return centre, size
+        points = np.concatenate((self.tf.starts, self.tf.ends))
+        centre = points.mean(axis=0)
+        return centre, 2*np.max(np.linalg.norm(points - centre, axis=1))
+
+
+def load_field(field_map=None, coil_csv=None, tf_csv=None, tf_current=0.0):
+    """
+    Builds the field from a field map, the coil csv and/or TF coil csv or
+    both, the coils are used outside the map
+    """
+    tf = SegmentCoilSet.from_csv(tf_csv, tf_current) if tf_csv else None
+    coils = MagCoilSet.from_csv(coil_csv) if coil_csv else None
+    direct = CoilField(coils, tf) if coils is not None or tf is not None else None
+    if field_map:
+        return GridField.from_file(field_map, fallback=direct)
+    if direct is None:
+        raise ValueError("Field lines need a field map, a coil csv or a TF coil csv")
+    return direct
+
+
+def _direction(field, points):
+    """Unit field direction and the field at points, NaN where there is no field"""
+    B = field(points)
+    norm = np.linalg.norm(B, axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        direction = B/norm[:, None]
+    direction[~(norm > 0)] = np.nan
+    return direction, B
+
+
+def _segment_distance(points, start, end):
+    """Distance from each point to the segment start to end"""
+    segment = end - start
+    with np.errstate(invalid='ignore', divide='ignore'):
+        t = np.clip(np.sum((points - start)*segment, axis=1)/np.sum(segment**2, axis=1), 0, 1)
+    t = np.nan_to_num(t)
+    return np.linalg.norm(start + t[:, None]*segment - points, axis=1)
+
+
+def trace(field, seeds, step, max_length, max_steps=MAX_STEPS, tolerance=TOLERANCE, sign=1.0):
+    """
+    Integrates dx/ds = sign*B/|B| from every seed at once
+
+    Args:
+        field (callable): field(points (n, 3)) returns B (n, 3), NaN where
+            the line should stop (outside a field map)
+        seeds (ndarray (n, 3)): Start points
+        step (float): First step, also the largest step is 10x this
+        max_length (float): Length at which a line stops
+        max_steps (int): Accepted steps at which a line stops
+        tolerance (float): Position error allowed per step, in m
+        sign (float): 1 to follow the field, -1 to trace against it
+
+    Returns:
+        lines (list of ndarrays (k, 3)): Points along each line
+        fields (list of ndarrays (k, 3)): B at those points
+        closed (ndarray of bools): Lines that came back to their seed
+    """
+    seeds = np.asarray(seeds, dtype=float).reshape(-1, 3)
+    n = len(seeds)
+    h_max = 10*step
+    h_min = 1e-6*step
+
+    x = seeds.copy()
+    k1, B = _direction(field, x)
+    k1 *= sign
+    h = np.full(n, step)
+    length = np.zeros(n)
+    steps = np.zeros(n, dtype=np.int64)
+    closed = np.zeros(n, dtype=bool)
+    active = np.all(np.isfinite(k1), axis=1)
+
+    # Accepted points as (line index, point, B) per iteration, sorted at the end
+    history = [(np.arange(n), seeds.copy(), B)]
+    while np.any(active):
+        index = np.flatnonzero(active)
+        xa = x[index]
+        ha = h[index][:, None]
+        stages = [k1[index]]
+        for stage in range(1, 7):
+            y = xa + ha*sum(a*k for a, k in zip(DP_A[stage], stages))
+            direction, B_new = _direction(field, y)
+            stages.append(sign*direction)
+        x5 = xa + ha*sum(b*k for b, k in zip(DP_B5, stages))
+        error = np.linalg.norm(ha*sum((b5 - b4)*k for b5, b4, k in zip(DP_B5, DP_B4, stages)), axis=1)
+
+        # Stages that left the field (NaN) are retried with a smaller step
+        with np.errstate(invalid='ignore'):
+            accept = np.isfinite(error) & np.all(np.isfinite(x5), axis=1) & (error <= tolerance)
+        ok = index[accept]
+        x[ok] = x5[accept]
+        k1[ok] = stages[6][accept]
+        length[ok] += h[ok]
+        steps[ok] += 1
+        history.append((ok, x5[accept], B_new[accept]))
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            factor = np.where(np.isfinite(error), 0.9*(tolerance/np.maximum(error, 1e-300))**0.2, 0.25)
+        h[index] = np.clip(h[index]*np.clip(factor, 0.2, 5.0), 0, h_max)
+
+        # A line ends at the boundary of the field, after its length or
+        # steps, or when it comes back round to its seed
+        back = (length[ok] > 4*step) & (_segment_distance(seeds[ok], xa[accept], x5[accept]) < 0.5*step)
+        closed[ok[back]] = True
+        done = (h[index] < h_min) | (length[index] >= max_length) | (steps[index] >= max_steps) | closed[index]
+        active[index[done]] = False
+
+    line_index = np.concatenate([entry[0] for entry in history])
+    points = np.concatenate([entry[1] for entry in history])
+    fields = np.concatenate([entry[2] for entry in history])
+    order = np.argsort(line_index, kind='stable')
+    bounds = np.searchsorted(line_index[order], np.arange(n + 1))
+    lines = [points[order[bounds[i]:bounds[i + 1]]] for i in range(n)]
+    line_fields = [fields[order[bounds[i]:bounds[i + 1]]] for i in range(n)]
+    return lines, line_fields, closed
+
+
+def trace_both(field, seeds, step, max_length, max_steps=MAX_STEPS, tolerance=TOLERANCE):
+    """Traces each seed along and against the field, joined into one line through the seed"""
+    forward, forward_B, closed = trace(field, seeds, step, max_length, max_steps, tolerance, 1.0)
+    backward, backward_B, _ = trace(field, seeds, step, max_length, max_steps, tolerance, -1.0)
+    lines = []
+    fields = []
+    for i in range(len(forward)):
+        if closed[i]:
+            # A closed line is complete in one direction
+            lines.append(forward[i])
+            fields.append(forward_B[i])
+        else:
+            lines.append(np.concatenate((backward[i][::-1], forward[i][1:])))
+            fields.append(np.concatenate((backward_B[i][::-1], forward_B[i][1:])))
+    return lines, fields, closed
+
+
+def disc_seeds(centre, normal, radius, n_seeds):
+    """n_seeds points spread evenly over a disc (a sunflower pattern)"""
+    normal = np.asarray(normal, dtype=float)
+    normal = normal/np.linalg.norm(normal)
+    helper = np.zeros(3)
+    helper[np.argmin(np.abs(normal))] = 1.0
+    u = np.cross(normal, helper)
+    u /= np.linalg.norm(u)
+    v = np.cross(normal, u)
+    index = np.arange(n_seeds) + 0.5
+    r = radius*np.sqrt(index/n_seeds)
+    theta = np.pi*(3 - np.sqrt(5))*index
+    return np.asarray(centre, dtype=float) + (r*np.cos(theta))[:, None]*u + (r*np.sin(theta))[:, None]*v
+
+
+def default_seeds(coil_csv, field, n_seeds):
+    """
+    A disc of seeds: across the bore at the mean coil centre for coaxial
+    coils (the mirror midplane), otherwise across the middle of the map or
+    of the coils
+    """
+    if coil_csv:
+        coils = MagCoilSet.from_csv(coil_csv)
+        axis = coils.common_axis()
+        if axis is not None:
+            centre = coils.centres.mean(axis=0)
+            return disc_seeds(centre, axis[1], 0.5*np.min(coils.radii), n_seeds)
+    if isinstance(field, GridField):
+        centre = 0.5*(field.lower + field.upper)
+        return disc_seeds(centre, (0, 0, 1), 0.25*np.min((field.upper - field.lower)[:2]), n_seeds)
+    centre, size = field.extent()
+    if field.coils is not None and len(field.coils):
+        return disc_seeds(centre, (0, 0, 1), 0.5*np.min(field.coils.radii), n_seeds)
+    return disc_seeds(centre, (0, 0, 1), 0.25*size, n_seeds)
+
+
+def read_seeds(path):
+    """Seeds from a csv with x,y,z columns and a header row"""
+    return np.loadtxt(path, delimiter=',', skiprows=1, usecols=range(3), ndmin=2)
+
+
+# Set in each worker process by _init_worker
+_worker_field = None
+
+
+def _init_worker(field_map, coil_csv, tf_csv=None, tf_current=0.0):
+    """Reads the map once per worker rather than once per batch of seeds"""
+    global _worker_field
+    _worker_field = load_field(field_map, coil_csv, tf_csv, tf_current)
+
+
+def _trace_batch(seeds, step, max_length, max_steps, tolerance, both):
+    if both:
+        return trace_both(_worker_field, seeds, step, max_length, max_steps, tolerance)
+    return trace(_worker_field, seeds, step, max_length, max_steps, tolerance)
+
+
+def field_lines(out_path, field_map=None, coil_csv=None, seeds=None, n_seeds=N_SEEDS, step=None,
+                max_length=None, max_steps=MAX_STEPS, tolerance=TOLERANCE, both=True, workers=None,
+                tf_csv=None, tf_current=0.0):
+    """
+    Traces field lines from seeds (a default disc if None) and writes them
+    to out_path as .vtp with B and Bmag at every point and the length of
+    each line
+    """
+    start_time = time.perf_counter()
+    field = load_field(field_map, coil_csv, tf_csv, tf_current)
+    if seeds is None:
+        seeds = default_seeds(coil_csv, field, n_seeds)
+
+    if isinstance(field, GridField):
+        size = np.linalg.norm(field.upper - field.lower)
+        step = step or np.min(field.spacing[field.shape > 1])
+    else:
+        _, size = field.extent()
+        step = step or 0.01*size
+    max_length = max_length or 4*size
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = max(1, min(workers, len(seeds)))
+    args = (step, max_length, max_steps, tolerance, both)
+    if workers == 1:
+        _init_worker(field_map, coil_csv, tf_csv, tf_current)
+        lines, fields, closed = _trace_batch(seeds, *args)
+    else:
+        lines, fields, closed = [], [], []
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(field_map, coil_csv, tf_csv, tf_current)) as executor:
+            for result in executor.map(_trace_batch, np.array_split(seeds, workers), *([arg]*workers for arg in args)):
+                lines += result[0]
+                fields += result[1]
+                closed.append(result[2])
+        closed = np.concatenate(closed)
+
+    lengths = np.array([np.sum(np.linalg.norm(np.diff(line, axis=0), axis=1)) for line in lines])
+    write_vtp(out_path, lines, fields, {"length": lengths, "closed": closed.astype(float)})
+    print("Traced", len(lines), "field lines,", int(closed.sum()), "closed, with",
+          sum(len(line) for line in lines), "points in", time.perf_counter() - start_time, "s")
+    print("Wrote", out_path)
+    return out_path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('output', help=".vtp file for the lines")
+    parser.add_argument('--field-map', help="Field map from magnetic_field_calc (npz, vti, h5 or csv)")
+    parser.add_argument('--coils', help="Coil csv, used outside the field map or on its own")
+    parser.add_argument('--tf-coils', help="TF coil csv from TF_step, added to the field of --coils or on its own")
+    parser.add_argument('--tf-current', type=float, default=0.0, help="Current in each TF coil in ampere turns")
+    parser.add_argument('--seeds', help="csv of x,y,z seed points, by default a disc across the coils")
+    parser.add_argument('--n-seeds', type=int, default=N_SEEDS)
+    parser.add_argument('--seed-centre', type=float, nargs=3)
+    parser.add_argument('--seed-normal', type=float, nargs=3, default=(0, 0, 1))
+    parser.add_argument('--seed-radius', type=float)
+    parser.add_argument('--step', type=float, help="First step in m, defaults to the map spacing")
+    parser.add_argument('--max-length', type=float, help="Longest line in m")
+    parser.add_argument('--max-steps', type=int, default=MAX_STEPS)
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE, help="Position error per step in m")
+    parser.add_argument('--one-way', action='store_true', help="Only trace along the field from each seed")
+    parser.add_argument('--workers', type=int, default=None,
+                        help="Worker processes, defaults to the number of cores")
+    args = parser.parse_args()
+
+    seeds = None
+    if args.seeds:
+        seeds = read_seeds(args.seeds)
+    elif args.seed_centre is not None and args.seed_radius:
+        seeds = disc_seeds(args.seed_centre, args.seed_normal, args.seed_radius, args.n_seeds)
+
+    field_lines(args.output, args.field_map, args.coils, seeds, args.n_seeds, args.step, args.max_length,
+                args.max_steps, args.tolerance, not args.one_way, args.workers, args.tf_coils, args.tf_current)
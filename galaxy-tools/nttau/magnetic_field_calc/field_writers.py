@@ -0,0 +1,389 @@
+"""
+Writers for field maps on a structured grid.
+
+The grid is described by origin, spacing and shape (nx, ny, nz) rather
+than by coordinates for every point. Points are numbered with x fastest
+(index = i + nx*(j + ny*k)), the order VTK ImageData uses, and the field is
+handed to a writer block by block in that order so nothing holds the whole
+map in memory.
+
+    npz:  origin, spacing, shape and B (n, 3) arrays, B is streamed into the
+          archive (numpy.load reads it as usual)
+    vtk:  VTK XML ImageData (.vti) with the field as raw appended data
+    hdf5: origin, spacing and shape attributes and a chunked B (n, 3) dataset
+    csv:  x,y,z,Bx,By,Bz,Bmag rows, as written before the binary formats
+
+Points that are not on a regular grid, such as adaptive sampling, are
+written with write_vtu as a VTK UnstructuredGrid instead, field lines with
+write_vtp as PolyData and the field at mesh nodes with write_nodal_csv. read_field_map reads any of the grid formats
+back.
+"""
+import re
+import zipfile
+
+import numpy as np
+
+FIELD_FORMATS = {
+    "npz": ".npz",
+    "vtk": ".vti",
+    "hdf5": ".h5",
+    "csv": ".csv",
+}
+
+
+def grid_points(origin, spacing, shape, start, stop):
+    """Coordinates (stop - start, 3) of grid points start to stop"""
+    i, j, k = np.unravel_index(np.arange(start, stop), tuple(shape), order='F')
+    return np.stack((
+        origin[0] + spacing[0]*i,
+        origin[1] + spacing[1]*j,
+        origin[2] + spacing[2]*k,
+    ), axis=1)
+
+
+def open_field_writer(file_format, path, origin, spacing, shape):
+    """
+    Opens a writer for the given format, blocks of B are then passed to
+    write() in grid order and close() finishes the file
+    """
+    writers = {
+        "npz": NpzFieldWriter,
+        "vtk": VtiFieldWriter,
+        "hdf5": Hdf5FieldWriter,
+        "csv": CsvFieldWriter,
+    }
+    if file_format not in writers:
+        raise ValueError(f"Unknown field format {file_format}, expected one of {', '.join(writers)}")
+    return writers[file_format](path, origin, spacing, shape)
+
+
+class FieldWriter:
+    def __init__(self, path, origin, spacing, shape):
+        self.path = path
+        self.origin = np.asarray(origin, dtype=float)
+        self.spacing = np.asarray(spacing, dtype=float)
+        self.shape = np.asarray(shape, dtype=np.int64)
+        self.n_points = int(np.prod(self.shape))
+        self.written = 0
+
+    def write(self, B):
+        B = np.ascontiguousarray(B, dtype='<f8')
+        self._write(B)
+        self.written += len(B)
+
+    def close(self):
+        if self.written != self.n_points:
+            raise ValueError(f"Wrote {self.written} of {self.n_points} grid points to {self.path}")
+        self._close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self._abort()
+
+    def _abort(self):
+        self._close()
+
+
+class CsvFieldWriter(FieldWriter):
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.file = open(self.path, 'w')
+        print("x,y,z,Bx,By,Bz,Bmag", file=self.file)
+
+    def _write(self, B):
+        rows = np.empty((len(B), 7))
+        rows[:, 0:3] = grid_points(self.origin, self.spacing, self.shape, self.written, self.written + len(B))
+        rows[:, 3:6] = B
+        rows[:, 6] = np.sqrt(np.sum(B**2, axis=1))
+        np.savetxt(self.file, rows, delimiter=',', fmt='%.17g')
+
+    def _close(self):
+        self.file.close()
+
+
+class NpzFieldWriter(FieldWriter):
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.archive = zipfile.ZipFile(self.path, 'w', allowZip64=True)
+        for name, value in (("origin", self.origin), ("spacing", self.spacing), ("shape", self.shape)):
+            with self.archive.open(f"{name}.npy", 'w') as entry:
+                np.lib.format.write_array(entry, value)
+        # B goes last so that it can be streamed, its header is written up front
+        self.entry = self.archive.open("B.npy", 'w', force_zip64=True)
+        np.lib.format.write_array_header_2_0(self.entry, {
+            "descr": np.lib.format.dtype_to_descr(np.dtype('<f8')),
+            "fortran_order": False,
+            "shape": (self.n_points, 3),
+        })
+
+    def _write(self, B):
+        self.entry.write(B.tobytes())
+
+    def _close(self):
+        self.entry.close()
+        self.archive.close()
+
+
+class VtiFieldWriter(FieldWriter):
+    def __init__(self, *args):
+        super().__init__(*args)
+        nx, ny, nz = self.shape
+        extent = f"0 {nx - 1} 0 {ny - 1} 0 {nz - 1}"
+        header = (
+            '<?xml version="1.0"?>\n'
+            '<VTKFile type="ImageData" version="1.0" byte_order="LittleEndian" header_type="UInt64">\n'
+            f'  <ImageData WholeExtent="{extent}" '
+            f'Origin="{" ".join(repr(float(v)) for v in self.origin)}" '
+            f'Spacing="{" ".join(repr(float(v)) for v in self.spacing)}">\n'
+            f'    <Piece Extent="{extent}">\n'
+            '      <PointData Vectors="B">\n'
+            '        <DataArray type="Float64" Name="B" NumberOfComponents="3" format="appended" offset="0"/>\n'
+            '      </PointData>\n'
+            '      <CellData/>\n'
+            '    </Piece>\n'
+            '  </ImageData>\n'
+            '  <AppendedData encoding="raw">\n'
+            '   _'
+        )
+        self.file = open(self.path, 'wb')
+        self.file.write(header.encode())
+        self.file.write(np.uint64(self.n_points*3*8).astype('<u8').tobytes())
+
+    def _write(self, B):
+        self.file.write(B.tobytes())
+
+    def _close(self):
+        self.file.write(b'\n  </AppendedData>\n</VTKFile>\n')
+        self.file.close()
+
+
+class Hdf5FieldWriter(FieldWriter):
+    def __init__(self, *args):
+        super().__init__(*args)
+        try:
+            import h5py
+        except ImportError:
+            raise ImportError("The hdf5 field format needs h5py, choose npz or vtk instead")
+        self.file = h5py.File(self.path, 'w')
+        self.file.attrs["origin"] = self.origin
+        self.file.attrs["spacing"] = self.spacing
+        self.file.attrs["shape"] = self.shape
+        self.file.attrs["order"] = "x fastest"
+        self.dataset = self.file.create_dataset(
+            "B", shape=(self.n_points, 3), dtype='<f8',
+            chunks=(max(1, min(self.n_points, 65536)), 3), compression="gzip"
+        )
+
+    def _write(self, B):
+        self.dataset[self.written:self.written + len(B)] = B
+
+    def _close(self):
+        self.file.close()
+
+
+# VTK cell type of an axis aligned hexahedron, corners ordered x fastest
+VTK_VOXEL = 11
+
+
+def _write_appended(path, grid_type, piece, arrays):
+    """
+    Writes a VTK XML file with every array as raw appended data
+
+    Args:
+        grid_type (string): UnstructuredGrid or PolyData
+        piece (dict): Attributes of the Piece, such as NumberOfPoints
+        arrays (list of tuples): (section, name, components, values, vtk
+            type) in the order of their sections
+    """
+    sections = {}
+    blocks = []
+    offset = 0
+    for section, name, components, values, vtk_type in arrays:
+        data = np.ascontiguousarray(values).tobytes()
+        sections.setdefault(section, []).append(
+            f'        <DataArray type="{vtk_type}" Name="{name}" NumberOfComponents="{components}" '
+            f'format="appended" offset="{offset}"/>\n'
+        )
+        blocks.append(np.uint64(len(data)).astype('<u8').tobytes() + data)
+        offset += len(blocks[-1])
+
+    piece_attributes = " ".join(f'{key}="{value}"' for key, value in piece.items())
+    header = (
+        '<?xml version="1.0"?>\n'
+        f'<VTKFile type="{grid_type}" version="1.0" byte_order="LittleEndian" header_type="UInt64">\n'
+        f'  <{grid_type}>\n'
+        f'    <Piece {piece_attributes}>\n'
+    )
+    for section in sections:
+        attributes = ' Vectors="B" Scalars="Bmag"' if section == "PointData" else ""
+        header += f'      <{section}{attributes}>\n' + "".join(sections[section]) + f'      </{section}>\n'
+    header += (
+        '    </Piece>\n'
+        f'  </{grid_type}>\n'
+        '  <AppendedData encoding="raw">\n'
+        '   _'
+    )
+    with open(path, 'wb') as file:
+        file.write(header.encode())
+        for block in blocks:
+            file.write(block)
+        file.write(b'\n  </AppendedData>\n</VTKFile>\n')
+
+
+def _field_arrays(B):
+    B = np.asarray(B, dtype='<f8')
+    return [
+        ("PointData", "B", 3, B, "Float64"),
+        ("PointData", "Bmag", 1, np.sqrt(np.sum(B**2, axis=1)), "Float64"),
+    ]
+
+
+def write_nodal_csv(path, tags, points, blocks):
+    """
+    Writes node,x,y,z,Bx,By,Bz,Bmag rows, one per mesh node in the order
+    given, for codes that read nodal data by node id (MOOSE PropertyReadFile)
+
+    Args:
+        path (string): The .csv file
+        tags (ndarray (n, )): Node tags
+        points (ndarray (n, 3)): Node coordinates, written as given
+        blocks (iterable of ndarrays (k, 3)): B at the nodes, in order
+
+    Returns:
+        n_written (int): Rows written
+    """
+    n_written = 0
+    with open(path, 'w') as file:
+        print("node,x,y,z,Bx,By,Bz,Bmag", file=file)
+        for B in blocks:
+            stop = n_written + len(B)
+            rows = np.empty((len(B), 8))
+            rows[:, 0] = tags[n_written:stop]
+            rows[:, 1:4] = points[n_written:stop]
+            rows[:, 4:7] = B
+            rows[:, 7] = np.sqrt(np.sum(B**2, axis=1))
+            np.savetxt(file, rows, delimiter=',', fmt=['%d'] + ['%.17g']*7)
+            n_written = stop
+    if n_written != len(tags):
+        raise ValueError(f"Wrote {n_written} of {len(tags)} nodes to {path}")
+    return n_written
+
+
+def write_vtu(path, points, B, cells, cell_data=None):
+    """
+    Writes points with their field and voxel cells as VTK XML
+    UnstructuredGrid
+
+    Args:
+        path (string): Output .vtu file
+        points (ndarray (n, 3)): Point coordinates
+        B (ndarray (n, 3)): Field at each point
+        cells (ndarray (m, 8)): Point indices of each voxel, corners ordered
+            x fastest then y then z
+        cell_data (dict of ndarrays (m, )): Extra Float64 cell arrays
+    """
+    cells = np.asarray(cells, dtype='<i8').reshape(-1, 8)
+    cell_data = cell_data or {}
+    arrays = _field_arrays(B)
+    arrays += [("CellData", name, 1, np.asarray(values, dtype='<f8'), "Float64") for name, values in cell_data.items()]
+    arrays += [
+        ("Points", "Points", 3, np.asarray(points, dtype='<f8'), "Float64"),
+        ("Cells", "connectivity", 1, cells.ravel(), "Int64"),
+        ("Cells", "offsets", 1, 8*np.arange(1, len(cells) + 1, dtype='<i8'), "Int64"),
+        ("Cells", "types", 1, np.full(len(cells), VTK_VOXEL, dtype=np.uint8), "UInt8"),
+    ]
+    _write_appended(path, "UnstructuredGrid", {"NumberOfPoints": len(points), "NumberOfCells": len(cells)}, arrays)
+
+
+def write_vtp(path, lines, B, cell_data=None):
+    """
+    Writes polylines with the field along them as VTK XML PolyData, the
+    format vtp_to_obj reads
+
+    Args:
+        path (string): Output .vtp file
+        lines (list of ndarrays (k, 3)): Points along each line
+        B (list of ndarrays (k, 3)): Field at those points
+        cell_data (dict of ndarrays (lines, )): Extra Float64 line arrays
+    """
+    cell_data = cell_data or {}
+    lengths = np.array([len(line) for line in lines], dtype='<i8')
+    points = np.concatenate(lines) if len(lines) else np.empty((0, 3))
+    arrays = _field_arrays(np.concatenate(B) if len(B) else np.empty((0, 3)))
+    arrays += [("CellData", name, 1, np.asarray(values, dtype='<f8'), "Float64") for name, values in cell_data.items()]
+    arrays += [
+        ("Points", "Points", 3, np.asarray(points, dtype='<f8'), "Float64"),
+        ("Lines", "connectivity", 1, np.arange(len(points), dtype='<i8'), "Int64"),
+        ("Lines", "offsets", 1, np.cumsum(lengths), "Int64"),
+    ]
+    _write_appended(path, "PolyData", {
+        "NumberOfPoints": len(points), "NumberOfVerts": 0, "NumberOfLines": len(lines),
+        "NumberOfStrips": 0, "NumberOfPolys": 0,
+    }, arrays)
+
+
+def read_field_map(path):
+    """
+    Reads a field map written by the grid writers, the format is found from
+    the start of the file as Galaxy datasets do not keep their extension
+
+    Returns:
+        origin, spacing (ndarrays (3, )), shape (ndarray (3, ) of ints):
+            The grid
+        B (ndarray (nz, ny, nx, 3)): The field, indexed [k, j, i]
+    """
+    with open(path, 'rb') as file:
+        magic = file.read(8)
+    if magic.startswith(b"PK"):
+        with np.load(path) as data:
+            origin, spacing, shape, B = data["origin"], data["spacing"], data["shape"], data["B"]
+    elif magic.startswith(b"\x89HDF"):
+        import h5py
+        with h5py.File(path, 'r') as data:
+            origin, spacing, shape = data.attrs["origin"], data.attrs["spacing"], data.attrs["shape"]
+            B = data["B"][()]
+    elif magic.startswith(b"<?xml") or magic.startswith(b"<VTKFile"):
+        origin, spacing, shape, B = _read_vti(path)
+    else:
+        origin, spacing, shape, B = _read_csv(path)
+    shape = np.asarray(shape, dtype=np.int64)
+    return np.asarray(origin, dtype=float), np.asarray(spacing, dtype=float), shape, \
+        np.asarray(B, dtype=float).reshape(shape[2], shape[1], shape[0], 3)
+
+
+def _read_vti(path):
+    with open(path, 'rb') as file:
+        content = file.read()
+    marker = content.index(b'<AppendedData encoding="raw">')
+    header = content[:marker].decode()
+    if 'header_type="UInt64"' not in header or 'type="ImageData"' not in header:
+        raise ValueError(f"{path} is not a field map written by magnetic_field_calc")
+
+    def attribute(name):
+        return np.array(re.search(f'{name}="([^"]*)"', header).group(1).split(), dtype=float)
+
+    extent = attribute("WholeExtent").astype(np.int64)
+    start = content.index(b"_", marker) + 1
+    n_bytes = int(np.frombuffer(content, dtype='<u8', count=1, offset=start)[0])
+    B = np.frombuffer(content, dtype='<f8', count=n_bytes//8, offset=start + 8).reshape(-1, 3)
+    return attribute("Origin"), attribute("Spacing"), extent[1::2] - extent[0::2] + 1, B
+
+
+def _read_csv(path):
+    """Rebuilds the grid of a csv map from its coordinates, any row order"""
+    data = np.loadtxt(path, delimiter=',', skiprows=1, usecols=range(6), ndmin=2)
+    axes = [np.unique(data[:, column]) for column in range(3)]
+    shape = np.array([len(axis) for axis in axes])
+    if np.prod(shape) != len(data):
+        raise ValueError(f"{path} is not a regular grid")
+    origin = np.array([axis[0] for axis in axes])
+    spacing = np.array([axis[1] - axis[0] if len(axis) > 1 else 1.0 for axis in axes])
+    index = [np.rint((data[:, column] - origin[column])/spacing[column]).astype(np.int64) for column in range(3)]
+    B = np.empty((len(data), 3))
+    B[index[0] + shape[0]*(index[1] + shape[1]*index[2])] = data[:, 3:6]
+    return origin, spacing, shape, B
@@ -0,0 +1,151 @@
+"""
+Poloidal flux psi(R, Z) of a coaxial coil set, for equilibrium work.
+
+psi is the flux per radian through the circle of radius R about the coils'
+axis at height Z (rho*A_phi, in Wb/rad), summed over every coil in one
+MagCoilSet.psi pass. Its contours are the flux surfaces of the vacuum
+field, traced with contourpy, and comparing a plasma boundary (such as the
+points of Torus.get_r_and_z_points) with the contour through it shows how
+far the coil set is from holding that shape.
+"""
+import csv
+
+import contourpy
+import numpy as np
+
+from MagCoilSet import MagCoilSet
+from field_writers import write_vtp
+
+# Flux contours written when no levels are given
+N_LEVELS = 20
+
+
+def flux_frame(coils):
+    """
+    The (R, Z) frame of a coaxial coil set: the point of its axis nearest
+    the origin, so Z is the height the generators place coils at, and the
+    axis direction
+    """
+    axis = coils.common_axis()
+    if axis is None:
+        raise ValueError("Coils are not coaxial, psi(R, Z) is only defined about a common axis")
+    point, direction = axis
+    return point - (point @ direction)*direction, direction
+
+
+def aligned_coils(coils, direction):
+    """
+    The coils with every normal along direction, each coil's psi is about
+    its own normal so a coil facing the other way has its current reversed
+    """
+    sign = np.where(coils.normals @ direction < 0, -1.0, 1.0)
+    return MagCoilSet(coils.centres, np.tile(direction, (len(coils), 1)), coils.radii, sign*coils.currents)
+
+
+def psi_map(coils, r_axis, z_axis, frame):
+    """
+    psi of all the coils on an (R, Z) grid
+
+    Args:
+        coils (MagCoilSet): A coaxial set
+        r_axis, z_axis (ndarrays): Grid points from the axis and along it in m
+        frame (tuple): The axis point, R direction and axis direction, as
+            rz_axes returns it
+
+    Returns:
+        psi (ndarray (nz, nr)): Flux per radian in Wb/rad
+    """
+    point, e_r, e_z = frame
+    R, Z = np.meshgrid(r_axis, z_axis)
+    points = point + R.reshape(-1, 1)*e_r + Z.reshape(-1, 1)*e_z
+    return aligned_coils(coils, e_z).psi(points).reshape(len(z_axis), len(r_axis))
+
+
+def default_levels(psi, n_levels=N_LEVELS):
+    """n_levels flux values spread over the map, leaving out its extremes"""
+    return np.linspace(np.min(psi), np.max(psi), n_levels + 2)[1:-1]
+
+
+def flux_contours(r_axis, z_axis, psi, levels):
+    """
+    Contour polylines of the map at each level
+
+    Returns:
+        contours (list of (level, ndarray (k, 2))): R, Z points along each
+            line, a level can give several lines or none
+    """
+    generator = contourpy.contour_generator(r_axis, z_axis, psi, line_type=contourpy.LineType.Separate)
+    return [(float(level), line) for level in levels for line in generator.lines(level)]
+
+
+def distance_to_lines(points, lines):
+    """Distance from each point (n, 2) to the nearest of the polylines"""
+    nearest = np.full(len(points), np.inf)
+    for line in lines:
+        if len(line) < 2:
+            nearest = np.minimum(nearest, np.linalg.norm(points - line[0], axis=1))
+            continue
+        start = line[:-1]
+        segment = line[1:] - start
+        length2 = np.maximum(np.sum(segment**2, axis=1), 1e-300)
+        t = np.clip(np.einsum('psi,si->ps', points[:, None, :] - start[None], segment)/length2, 0, 1)
+        closest = start[None] + t[:, :, None]*segment[None]
+        nearest = np.minimum(nearest, np.min(np.linalg.norm(points[:, None, :] - closest, axis=2), axis=1))
+    return nearest
+
+
+def read_boundary(path):
+    """R, Z points (n, 2) of a boundary csv with a header, as Torus points are written by write_csv"""
+    return np.loadtxt(path, delimiter=',', skiprows=1, usecols=(0, 1), ndmin=2)
+
+
+def compare_boundary(coils, frame, r_axis, z_axis, psi, boundary):
+    """
+    How well a boundary follows the coils' flux surfaces
+
+    Returns:
+        level (float): Mean psi on the boundary, the flux surface it is compared with
+        psi_boundary (ndarray (n, )): psi at each boundary point
+        distance (ndarray (n, )): Distance from each point to that contour in m
+        spread (float): Range of psi on the boundary over the range of the map
+    """
+    point, e_r, e_z = frame
+    psi_boundary = aligned_coils(coils, e_z).psi(point + boundary[:, :1]*e_r + boundary[:, 1:2]*e_z)
+    level = float(np.mean(psi_boundary))
+    lines = [line for _, line in flux_contours(r_axis, z_axis, psi, [level])]
+    distance = distance_to_lines(boundary, lines) if lines else np.full(len(boundary), np.inf)
+    spread = np.ptp(psi_boundary)/max(np.ptp(psi), 1e-300)
+    return level, psi_boundary, distance, spread
+
+
+def write_psi_map(path, r_axis, z_axis, psi, frame):
+    """Writes the map as npz: r, z, psi (nz, nr) and the axis point, e_r and e_z"""
+    point, e_r, e_z = frame
+    np.savez(path, r=r_axis, z=z_axis, psi=psi, point=point, e_r=e_r, e_z=e_z)
+
+
+def write_contours(csv_path, vtp_path, contours, coils, frame):
+    """
+    Writes the contours as csv rows of level, line, R, Z and as VTK PolyData
+    in the lab frame with the field of the coils along them
+    """
+    with open(csv_path, 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(["psi (Wb/rad)", "line", "R", "Z"])
+        for index, (level, line) in enumerate(contours):
+            for r, z in line:
+                writer.writerow([f"{level:.10g}", index, f"{r:.10g}", f"{z:.10g}"])
+
+    point, e_r, e_z = frame
+    lines = [point + line[:, :1]*e_r + line[:, 1:2]*e_z for _, line in contours]
+    B = [coils.B(line) for line in lines]
+    write_vtp(vtp_path, lines, B, {"psi": [level for level, _ in contours]})
+
+
+def write_boundary(path, boundary, psi_boundary, distance):
+    """Writes the boundary points with psi and their distance to the flux surface"""
+    with open(path, 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(["R", "Z", "psi (Wb/rad)", "distance (m)"])
+        for row in zip(boundary[:, 0], boundary[:, 1], psi_boundary, distance):
+            writer.writerow([f"{value:.10g}" for value in row])
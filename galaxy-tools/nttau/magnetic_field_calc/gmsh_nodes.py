@@ -0,0 +1,124 @@
+"""
+Reads the nodes of a gmsh mesh (.msh), such as those written by
+GMSHsphereBCMesh (format 4.1) and CylinderSurface (format 2.2), so the field
+can be evaluated at the nodes a thermal or structural model runs on.
+
+Only the $Nodes section is parsed. ASCII sections are converted with a
+single numpy call and binary ones are read with numpy.frombuffer, with no
+Python loop over nodes in either case.
+"""
+import numpy as np
+
+
+def _section(data, name, start=0):
+    """Offsets of the body of $name in data, after its header line"""
+    # The leading newline keeps matches on section lines, not in binary data
+    marker = b"\n$" + name + b"\n"
+    begin = data.find(marker, start)
+    if begin < 0:
+        raise ValueError(f"No ${name.decode()} section")
+    return begin + len(marker)
+
+
+def _mesh_format(data):
+    """Version, binary flag, size of size_t and byte order of the file"""
+    if not data.startswith(b"$MeshFormat"):
+        raise ValueError("Not a gmsh .msh file")
+    line_end = data.index(b"\n", data.index(b"\n") + 1)
+    version, file_type, data_size = data[data.index(b"\n") + 1:line_end].split()[:3]
+    binary = int(file_type) == 1
+    byte_order = '<'
+    if binary:
+        # A binary file writes the int 1 after the format line to give its byte order
+        one = data[line_end + 1:line_end + 5]
+        byte_order = '<' if np.frombuffer(one, '<i4')[0] == 1 else '>'
+    return version.decode(), binary, int(data_size), byte_order
+
+
+def _ascii_nodes_41(values):
+    """Nodes from the numbers of an ASCII 4.1 $Nodes section"""
+    n_blocks, n_nodes = int(values[0]), int(values[1])
+    tags = np.empty(n_nodes, dtype=np.int64)
+    coords = np.empty((n_nodes, 3))
+    position = 4
+    filled = 0
+    for _ in range(n_blocks):
+        dim, parametric, count = int(values[position]), int(values[position + 2]), int(values[position + 3])
+        position += 4
+        tags[filled:filled + count] = values[position:position + count]
+        position += count
+        width = 3 + dim*parametric
+        block = values[position:position + count*width].reshape(count, width)
+        coords[filled:filled + count] = block[:, :3]
+        position += count*width
+        filled += count
+    return tags, coords
+
+
+def _binary_nodes_41(data, offset, size_t, byte_order):
+    """Nodes from a binary 4.1 $Nodes section starting at offset"""
+    size_type = f"{byte_order}u{size_t}"
+    int_type = f"{byte_order}i4"
+    double_type = f"{byte_order}f8"
+    n_blocks, n_nodes = np.frombuffer(data, size_type, 4, offset)[:2]
+    offset += 4*size_t
+    tags = np.empty(n_nodes, dtype=np.int64)
+    coords = np.empty((n_nodes, 3))
+    filled = 0
+    for _ in range(int(n_blocks)):
+        dim, _, parametric = np.frombuffer(data, int_type, 3, offset)
+        count = int(np.frombuffer(data, size_type, 1, offset + 12)[0])
+        offset += 12 + size_t
+        tags[filled:filled + count] = np.frombuffer(data, size_type, count, offset)
+        offset += count*size_t
+        width = 3 + int(dim)*int(parametric)
+        block = np.frombuffer(data, double_type, count*width, offset).reshape(count, width)
+        coords[filled:filled + count] = block[:, :3]
+        offset += count*width*8
+        filled += count
+    return tags, coords
+
+
+def _nodes_22(data, offset, binary, byte_order):
+    """Nodes from a 2.2 $Nodes section starting at offset"""
+    line_end = data.index(b"\n", offset)
+    n_nodes = int(data[offset:line_end])
+    offset = line_end + 1
+    if binary:
+        record = np.dtype([("tag", f"{byte_order}i4"), ("xyz", f"{byte_order}f8", 3)])
+        nodes = np.frombuffer(data, record, n_nodes, offset)
+        return nodes["tag"].astype(np.int64), nodes["xyz"].astype(float)
+    end = data.index(b"$EndNodes", offset)
+    values = np.array(data[offset:end].split(), dtype=float).reshape(n_nodes, 4)
+    return values[:, 0].astype(np.int64), values[:, 1:4].copy()
+
+
+def read_msh_nodes(path):
+    """
+    Reads every node of a gmsh mesh, ASCII or binary, format 4.1 or 2.2
+
+    Args:
+        path (string): The .msh file
+
+    Returns:
+        tags (ndarray (n, )): Node tags, in increasing order
+        coords (ndarray (n, 3)): x, y, z of each node in the mesh's units
+    """
+    with open(path, 'rb') as file:
+        data = file.read()
+    version, binary, size_t, byte_order = _mesh_format(data)
+    offset = _section(data, b"Nodes")
+
+    if version.startswith("4"):
+        if binary:
+            tags, coords = _binary_nodes_41(data, offset, size_t, byte_order)
+        else:
+            end = data.index(b"$EndNodes", offset)
+            tags, coords = _ascii_nodes_41(np.array(data[offset:end].split(), dtype=float))
+    elif version.startswith("2"):
+        tags, coords = _nodes_22(data, offset, binary, byte_order)
+    else:
+        raise ValueError(f"{path} is gmsh format {version}, only 2.2 and 4.1 are read")
+
+    order = np.argsort(tags, kind='stable')
+    return tags[order], coords[order]
@@ -0,0 +1,220 @@
+"""
+Self and mutual inductances of a coil set, for sizing the coil power supplies.
+
+Each coil is a circular filament of N turns at its mean radius. The mutual
+inductance of two filaments is the flux of one through the other:
+
+    coaxial pairs: Maxwell's closed form in complete elliptic integrals
+    other pairs:   the line integral of the other coil's vector potential
+                   around the coil, by the trapezoidal rule (the integrand
+                   is periodic, so it converges exponentially), for a block
+                   of coils against every coil at once
+
+A coil's self inductance is the mutual inductance of two coaxial filaments
+of its radius a geometric mean distance of its rectangular winding pack
+apart. Coil inductances are the filament values times the turns of both
+coils.
+"""
+import argparse
+import csv
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from scipy.special import ellipe, ellipk
+
+from MagCoilSet import MU0, MagCoilSet, read_coil_csv
+
+# Points around each coil for the line integral
+N_QUADRATURE = 64
+# Coil x quadrature point pairs per block of the line integral
+BLOCK_ELEMENTS = 2**20
+# Geometric mean distance of a b x c rectangle is about GMD_RECTANGLE*(b + c)
+GMD_RECTANGLE = 0.2235
+
+
+def mutual_coaxial(R1, R2, d):
+    """
+    Mutual inductance of coaxial circular filaments (Maxwell)
+
+    Args:
+        R1, R2 (array-like): Radii of the two filaments in m
+        d (array-like): Distance between their planes in m
+
+    Returns:
+        M (ndarray): Mutual inductance in H
+    """
+    R1, R2, d = np.broadcast_arrays(*(np.asarray(value, dtype=float) for value in (R1, R2, d)))
+    k2 = 4*R1*R2/((R1 + R2)**2 + d**2)
+    k = np.sqrt(k2)
+    return MU0*np.sqrt(R1*R2)*((2/k - k)*ellipk(k2) - 2/k*ellipe(k2))
+
+
+def self_inductance(radii, dr, dz):
+    """
+    Self inductance of single turn circular coils with rectangular winding
+    packs dr x dz, from the geometric mean distance of the rectangle
+    """
+    gmd = GMD_RECTANGLE*(np.asarray(dr, dtype=float) + np.asarray(dz, dtype=float))
+    if np.any(gmd <= 0):
+        raise ValueError("Self inductance needs coils with a cross section (dr, dz)")
+    return mutual_coaxial(radii, radii, gmd)
+
+
+def loop_quadrature(coils, n_quadrature=N_QUADRATURE):
+    """
+    Points around each coil of a MagCoilSet and the length element dl at
+    each, (n, n_quadrature, 3) both
+    """
+    theta = 2*np.pi*np.arange(n_quadrature)/n_quadrature
+    cos, sin = np.cos(theta)[None, :, None], np.sin(theta)[None, :, None]
+    v2 = coils.rotmtx[:, None, 0, :]
+    v3 = coils.rotmtx[:, None, 1, :]
+    radii = coils.radii[:, None, None]
+    points = coils.centres[:, None, :] + radii*(cos*v2 + sin*v3)
+    dl = radii*(2*np.pi/n_quadrature)*(cos*v3 - sin*v2)
+    return points, dl
+
+
+def coaxial_pairs(coils, tol=1e-9):
+    """
+    Mask (n, n) of coil pairs sharing an axis, the sign of the normals'
+    dot product and the distance between the coils' planes
+    """
+    dot = coils.normals @ coils.normals.T
+    parallel = np.abs(np.abs(dot) - 1) < tol
+    offset = coils.centres[None, :, :] - coils.centres[:, None, :]
+    along = np.einsum('ijk,ik->ij', offset, coils.normals)
+    across = np.linalg.norm(offset - along[:, :, None]*coils.normals[:, None, :], axis=2)
+    scale = np.maximum(coils.radii[:, None], coils.radii[None, :])
+    return parallel & (across < tol*scale), np.sign(dot), np.abs(along)
+
+
+# Set in each worker process by _init_worker
+_worker_coils = None
+
+
+def _init_worker(centres, normals, radii):
+    """Builds the unit current coil set once per worker"""
+    global _worker_coils
+    _worker_coils = MagCoilSet(centres, normals, radii, np.ones(len(radii)))
+
+
+def _mutual_rows(start, stop, n_quadrature):
+    """Filament mutual inductances of coils start to stop with every coil, (stop - start, n)"""
+    coils = _worker_coils
+    rows = MagCoilSet(coils.centres[start:stop], coils.normals[start:stop], coils.radii[start:stop],
+                      coils.currents[start:stop])
+    points, dl = loop_quadrature(rows, n_quadrature)
+    A = coils.A(points.reshape(-1, 3), per_coil=True).reshape(len(coils), stop - start, n_quadrature, 3)
+    return np.einsum('jiqk,iqk->ij', A, dl)
+
+
+def filament_inductance(coils, n_quadrature=N_QUADRATURE, workers=1):
+    """
+    Mutual inductance matrix of single turn filaments, with the diagonal
+    left at zero
+
+    Args:
+        coils (MagCoilSet): The coils, currents are ignored
+        n_quadrature (int): Points around each coil for non-coaxial pairs
+        workers (int): Processes the rows are shared between
+
+    Returns:
+        M (ndarray (n, n)): Symmetric, in H
+    """
+    n = len(coils)
+    coaxial, sign, distance = coaxial_pairs(coils)
+    M = np.zeros((n, n))
+    if not np.all(coaxial):
+        rows_per_block = max(1, BLOCK_ELEMENTS//(n*n_quadrature))
+        blocks = [(start, min(start + rows_per_block, n)) for start in range(0, n, rows_per_block)]
+        initargs = (coils.centres, coils.normals, coils.radii)
+        if workers == 1 or len(blocks) == 1:
+            _init_worker(*initargs)
+            results = [_mutual_rows(start, stop, n_quadrature) for start, stop in blocks]
+        else:
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=initargs) as executor:
+                results = list(executor.map(_mutual_rows, *zip(*blocks), [n_quadrature]*len(blocks)))
+        M = np.concatenate(results)
+        # The integral is around coil i of coil j's potential, average the two ways round
+        M = 0.5*(M + M.T)
+
+    R1, R2 = np.meshgrid(coils.radii, coils.radii, indexing='ij')
+    with np.errstate(divide='ignore', invalid='ignore'):
+        exact = sign*mutual_coaxial(R1, R2, distance)
+    M[coaxial] = exact[coaxial]
+    np.fill_diagonal(M, 0.0)
+    return M
+
+
+def inductance_matrix(coils, turns, dr, dz, n_quadrature=N_QUADRATURE, workers=1):
+    """
+    Inductance matrix of the coils' terminals, L[i, j] = N_i N_j M_ij with
+    the self inductances on the diagonal, in H
+    """
+    turns = np.asarray(turns, dtype=float)
+    M = filament_inductance(coils, n_quadrature, workers)
+    M[np.diag_indices(len(coils))] = self_inductance(coils.radii, dr, dz)
+    return turns[:, None]*turns[None, :]*M
+
+
+def power_supply(L, currents, ramp_time):
+    """
+    What each coil's supply has to deliver to ramp every coil linearly from
+    zero to its current in ramp_time
+
+    Returns:
+        flux (ndarray (n, )): Flux linkage at full current in Wb
+        voltage (ndarray (n, )): Inductive voltage during the ramp in V
+        power (ndarray (n, )): Power at the end of the ramp in W
+        energy (float): Stored magnetic energy at full current in J
+    """
+    currents = np.asarray(currents, dtype=float)
+    flux = L @ currents
+    voltage = flux/ramp_time
+    return flux, voltage, voltage*currents, 0.5*currents @ flux
+
+
+def coil_inductance(coil_csv, matrix_path="inductance.csv", supply_path="power_supply.csv", ramp_time=1.0,
+                    n_quadrature=N_QUADRATURE, workers=None):
+    """
+    Reads a coil csv, writes its inductance matrix and the per coil power
+    supply requirements, returns the matrix
+    """
+    start_time = time.perf_counter()
+    data = read_coil_csv(coil_csv)
+    coils = MagCoilSet(data["centres"], data["normals"], data["radii"], np.ones(len(data["radii"])))
+    if workers is None:
+        workers = os.cpu_count() or 1
+    L = inductance_matrix(coils, data["turns"], data["dr"], data["dz"], n_quadrature, workers)
+
+    np.savetxt(matrix_path, L, delimiter=',', fmt='%.10g',
+               header=",".join(f"coil_{i}" for i in range(len(L))), comments='')
+    flux, voltage, power, energy = power_supply(L, data["currents"], ramp_time)
+    with open(supply_path, 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(["coil", "turns", "I (A)", "L (H)", "flux_linkage (Wb)", "ramp_voltage (V)", "peak_power (W)"])
+        for row in zip(range(len(L)), data["turns"], data["currents"], np.diag(L), flux, voltage, power):
+            writer.writerow([f"{value:.10g}" for value in row])
+
+    print("Inductance of", len(L), "coils in", time.perf_counter() - start_time, "s")
+    print("Stored energy", energy, "J, largest ramp voltage", np.max(np.abs(voltage)), "V over", ramp_time, "s")
+    print("Wrote", matrix_path, "and", supply_path)
+    return L
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('coil_csv', help="Coil csv from any of the coil generators")
+    parser.add_argument('--matrix', default="inductance.csv", help="csv for the inductance matrix in H")
+    parser.add_argument('--supply', default="power_supply.csv", help="csv for the per coil supply requirements")
+    parser.add_argument('--ramp-time', type=float, default=1.0, help="Time to ramp every coil to full current in s")
+    parser.add_argument('--quadrature', type=int, default=N_QUADRATURE,
+                        help="Points around each coil for pairs that are not coaxial")
+    parser.add_argument('--workers', type=int, default=None,
+                        help="Worker processes, defaults to the number of cores")
+    args = parser.parse_args()
+
+    coil_inductance(args.coil_csv, args.matrix, args.supply, args.ramp_time, args.quadrature, args.workers)
@@ -1,8 +1,19 @@
-import array
-from MagCoil import MagCoil
+import os
+import tempfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from MagCoilSet import MagCoilSet
+from coilset import read_coil_set
+from SegmentCoilSet import CORE_RADIUS, SegmentCoilSet
+from adaptive_field import MAX_DEPTH, TOLERANCE, sample_adaptive
+from field_cache import CACHE_MAX_BYTES, FieldCache, coil_key, segments_key, unit_responses
+from field_writers import FIELD_FORMATS, open_field_writer, write_nodal_csv, write_vtu
+from flux_map import (compare_boundary, default_levels, flux_contours, flux_frame, psi_map, read_boundary,
+                      write_boundary, write_contours, write_psi_map)
+from gmsh_nodes import read_msh_nodes
+from symmetry import SYMMETRIES, from_representatives, fundamental_points, grid_symmetries, representatives
 import numpy as np
-import math
-from pylab import *
 import time
 import csv
 
@@ -11,30 +22,386 @@ import csv
 import argparse
 import json
 
-
-def loop_field(geom_type,pf_coil_datafile_path, bounding_box_filepath, dx, dy, dz):
-    geom_type = "Torus"
-    #Set file names to write values to 
-    start_time = time.perf_counter()
-    grid_file = bounding_box_filepath
-    grid_vals_str = [] 
-    if geom_type =="Cylinder": 
-
-        B_file= open("B_multi.csv", "w")
-        filename = open(pf_coil_datafile_path, 'r')
-        file = csv.DictReader(filename)
-
-    elif geom_type =="Torus": 
-
-        
-        B_file =open("PF_B.csv", 'w')
-
-        filename = open(pf_coil_datafile_path, 'r')
-        file = csv.DictReader(filename)
-
+# Grid points evaluated (and held in memory) per chunk
+CHUNK_SIZE = 100000
+
+# The (rho, z) map of a coaxial coil set written with --rz-map is this many
+# times finer than the finest grid spacing
+RZ_REFINE = 4
+# Grid points whose (rho, z) about the axis of a coaxial coil set agree to
+# this fraction of the grid spacing share one field evaluation
+RZ_TOLERANCE = 1e-9
+
+# Set in each worker process by _init_worker
+_worker_coils = None
+_worker_tf = None
+_worker_axes = None
+
+
+def _init_worker(centres, normals, radii, currents, axes, tf=None):
+    """Builds the coil set once per worker rather than once per chunk"""
+    global _worker_coils, _worker_tf, _worker_axes
+    _worker_coils = MagCoilSet(centres, normals, radii, currents)
+    _worker_tf = tf
+    _worker_axes = axes
+
+
+def _worker_B(points, per_coil=False):
+    """
+    The field of the loops and TF coils, per coil the TF coils follow the
+    loops as one more source as they all carry the same current
+    """
+    B = _worker_coils.B(points, per_coil=per_coil)
+    if _worker_tf is None:
+        return B
+    B_tf = _worker_tf.B(points)
+    if per_coil:
+        return np.concatenate((B, B_tf[None]))
+    return B + B_tf
+
+
+def _eval_chunk(start, stop, per_coil=False):
+    """
+    Evaluates all coils on grid points start to stop (x fastest, z
+    slowest, the order of the field writers), returns B (n, 3) or each
+    coil's B (coils, n, 3)
+    """
+    return _worker_B(_grid_points(_worker_axes, start, stop), per_coil=per_coil)
+
+
+def _eval_rz_chunk(start, stop, per_coil=False):
+    """
+    Evaluates all coils on points start to stop of a (rho, z) table about
+    their common axis (rho fastest), returns the field along rho and z (n, 2)
+    or each coil's (coils, n, 2)
+    """
+    rho_axis, z_axis, frame = _worker_axes
+    k, i = np.unravel_index(np.arange(start, stop), (len(z_axis), len(rho_axis)))
+    return _rz_B(rho_axis[i], z_axis[k], frame, per_coil)
+
+
+def _eval_rz_points_chunk(start, stop, per_coil=False):
+    """
+    Evaluates all coils on points start to stop of the worker's list of
+    (rho, z) about their common axis, as _eval_rz_chunk
+    """
+    rho, z, frame = _worker_axes
+    return _rz_B(rho[start:stop], z[start:stop], frame, per_coil)
+
+
+def _rz_B(rho, z, frame, per_coil):
+    point, e_rho, e_z = frame
+    B = _worker_B(point + rho[:,None]*e_rho + z[:,None]*e_z, per_coil=per_coil)
+    return np.stack((B @ e_rho, B @ e_z), axis=-1)
+
+
+def _eval_points_chunk(start, stop, per_coil=False):
+    """Evaluates all coils on points start to stop of the worker's point list"""
+    return _worker_B(_worker_axes[start:stop], per_coil=per_coil)
+
+
+def _eval_indices_chunk(start, stop, per_coil=False):
+    """
+    Evaluates all coils on the grid points whose flat indices are start to
+    stop of the worker's index file, which is read rather than sent to it
+    """
+    axes, index_path, n_indices = _worker_axes
+    flat = np.memmap(index_path, dtype=np.int64, mode="r", shape=(n_indices,))[start:stop]
+    return _worker_B(_grid_points_at(axes, np.asarray(flat)), per_coil=per_coil)
+
+
+def _spill(path, blocks, dtype, shape=()):
+    """Writes the blocks to path one after another, returns them memory mapped as one array"""
+    n = 0
+    with open(path, "wb") as f_write:
+        for block in blocks:
+            block = np.ascontiguousarray(block, dtype=dtype)
+            block.tofile(f_write)
+            n += len(block)
+    if n == 0:
+        return np.zeros((0,) + shape, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode="r", shape=(n,) + shape)
+
+
+def _evaluate(function, n_points, chunk_size, workers, initargs):
+    """
+    Yields function(start, stop) for consecutive chunks of n_points, in order,
+    on a pool of workers. At most two chunks per worker are queued or waiting
+    to be used, so memory is set by the chunk size and not the grid size
+    """
+    chunks = [(start, min(start+chunk_size, n_points)) for start in range(0, n_points, chunk_size)]
+    if workers <= 1:
+        _init_worker(*initargs)
+        for start, stop in chunks:
+            yield function(start, stop)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=initargs) as executor:
+        pending = deque()
+        for start, stop in chunks:
+            pending.append(executor.submit(function, start, stop))
+            if len(pending) >= 2*workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def _cached_responses(cache, coils, tf, grid, n_points, width, function, axes, chunk_size, workers):
+    """
+    Each coil's field for unit current from the cache (the TF coils last, as
+    one source), the missing ones are evaluated together with
+    function(start, stop, per_coil=True)
+    """
+    keys = [coil_key(coils.centres[c], coils.normals[c], coils.radii[c], grid) for c in range(len(coils))]
+    if tf is not None:
+        keys.append(segments_key(tf.starts, tf.ends, tf.core_radius, grid))
+
+    def evaluate(missing):
+        loops = [c for c in missing if c < len(coils)]
+        unit_tf = None
+        if len(coils) in missing:
+            unit_tf = tf.with_currents(1.0)
+        initargs = (coils.centres[loops], coils.normals[loops], coils.radii[loops],
+                    np.ones(len(loops)), axes, unit_tf)
+        # Chunks hold every missing coil's field, keep them the same size
+        return _evaluate(partial(function, per_coil=True), n_points,
+                         max(1, chunk_size//len(missing)), workers, initargs)
+
+    responses, n_missing = unit_responses(cache, keys, (n_points, width), evaluate)
+    print("Field cache:", len(keys) - n_missing, "of", len(keys), "coils cached in", cache.path)
+    return responses
+
+
+def _source_currents(coils, tf):
+    """Weights of the unit current responses, the TF coils' current last"""
+    if tf is None:
+        return coils.currents
+    return np.append(coils.currents, tf.currents[0] if tf.n_coils else 0.0)
+
+
+def _weighted_sum(responses, currents, start, stop):
+    """The field of the coils from their unit current responses, rows start to stop"""
+    total = np.zeros((stop - start,) + responses[0].shape[1:])
+    for response, current in zip(responses, currents):
+        total += current*response[start:stop]
+    return total
+
+
+def grid_field(coils, axes, chunk_size=CHUNK_SIZE, workers=1, cache=None, tf=None, symmetry=None):
+    """
+    Yields the field of the coils (and TF coils) on the grid axes (x
+    fastest) a chunk at a time, from the unit current responses in cache if
+    one is given. Given the symmetries of the coils on the grid (from
+    symmetry.grid_symmetries) only one point of each symmetric set is
+    evaluated. Those points and their field go to temporary files that each
+    output chunk reads its rows back from, so memory is still set by the
+    chunk size, at the cost of 32 bytes of disk per evaluated point.
+    """
+    shape = tuple(len(axis) for axis in axes)
+    n_points = int(np.prod(shape))
+    if symmetry is None or len(symmetry) <= 1:
+        yield from _field_blocks(coils, tf, _grid_key(axes), _eval_chunk, axes, n_points,
+                                 chunk_size, workers, cache)
+        return
+
+    with tempfile.TemporaryDirectory() as scratch:
+        index_path = os.path.join(scratch, "fundamental.bin")
+        fundamental = _spill(index_path, fundamental_points(symmetry, shape, chunk_size), np.int64)
+        n_evaluated = len(fundamental)
+        print("Coil symmetries:", len(symmetry), "evaluated", n_evaluated, "of", n_points, "grid points")
+
+        grid = _grid_key(axes)
+        # The points evaluated are set by the grid and the transforms
+        grid["symmetry"] = [T.tolist() for T, _, _ in symmetry]
+        blocks = _field_blocks(coils, tf, grid, _eval_indices_chunk, (axes, index_path, n_evaluated), n_evaluated,
+                               chunk_size, workers, cache)
+        B_fundamental = _spill(os.path.join(scratch, "B.bin"), blocks, np.float64, (3,))
+        for start in range(0, n_points, chunk_size):
+            rep, which = representatives(symmetry, shape, start, min(start+chunk_size, n_points))
+            # Representatives of a chunk are sorted, the rows read are near each other in the file
+            rows = np.searchsorted(fundamental, rep)
+            yield from_representatives(symmetry, np.asarray(B_fundamental[rows]), which)
+        del fundamental, B_fundamental
+
+
+def _field_blocks(coils, tf, grid, function, points, n_points, chunk_size, workers, cache):
+    """
+    Yields the field from function(start, stop) on n_points a chunk at a
+    time, or from the unit current responses in cache for the grid
+    """
+    if cache is None:
+        yield from _evaluate(function, n_points, chunk_size, workers,
+                             (coils.centres, coils.normals, coils.radii, coils.currents, points, tf))
+        return
+    responses = _cached_responses(cache, coils, tf, grid, n_points, 3, function, points, chunk_size, workers)
+    currents = _source_currents(coils, tf)
+    for start in range(0, n_points, chunk_size):
+        yield _weighted_sum(responses, currents, start, min(start+chunk_size, n_points))
+
+
+def _grid_key(axes):
+    """Describes the grid axes in a cache key"""
+    return {
+        "kind": "grid",
+        "origin": [float(axis[0]) for axis in axes],
+        "spacing": [float(axis[1] - axis[0]) if len(axis) > 1 else 0.0 for axis in axes],
+        "shape": [len(axis) for axis in axes],
+    }
+
+
+def _grid_points(axes, start, stop):
+    """Grid points start to stop (n, 3), x fastest"""
+    return _grid_points_at(axes, np.arange(start, stop))
+
+
+def _grid_points_at(axes, flat):
+    """Grid points (n, 3) at flat indices, x fastest"""
+    x_axis, y_axis, z_axis = axes
+    k, j, i = np.unravel_index(flat, (len(z_axis), len(y_axis), len(x_axis)))
+    return np.stack((x_axis[i], y_axis[j], z_axis[k]), axis=1)
+
+
+def _perpendicular(direction):
+    """A unit vector perpendicular to direction, fixed by direction alone"""
+    helper = np.zeros(3)
+    helper[np.argmin(np.abs(direction))] = 1.0
+    e_rho = np.cross(direction, helper)
+    return e_rho/np.linalg.norm(e_rho)
+
+
+def rz_frame(axis):
+    """The axis point, a rho direction and the axis direction of a common axis"""
+    point, e_z = axis
+    return point, _perpendicular(e_z), e_z
+
+
+def rz_points(axes, frame, chunk_size=CHUNK_SIZE):
+    """
+    The distinct (rho, z) about the axis of the grid points (x fastest),
+    equal to within RZ_TOLERANCE of the grid spacing
+
+    Returns:
+        rho, z (ndarrays (m, )): Distinct points of the half plane, those of
+            the first grid point with each
+        inverse (ndarray (n, )): Index into rho and z of each grid point
+    """
+    n_points = int(np.prod([len(axis) for axis in axes]))
+    spacings = [axis[1] - axis[0] for axis in axes if len(axis) > 1]
+    resolution = RZ_TOLERANCE*(min(spacings) if spacings else 1.0)
+    keys = []
+    for start in range(0, n_points, chunk_size):
+        rho, z = _rho_z(_grid_points(axes, start, min(start+chunk_size, n_points)), frame)
+        keys.append(np.rint(np.stack((rho, z), axis=1)/resolution).astype(np.int64))
+    _, first, inverse = np.unique(np.concatenate(keys), axis=0, return_index=True, return_inverse=True)
+    # Evaluated at a grid point rather than the rounded key
+    rho, z = _rho_z(_grid_points_at(axes, first), frame)
+    return rho, z, inverse.reshape(-1)
+
+
+def _rho_z(points, frame):
+    """Distance of points (n, 3) from the axis and along it from the axis point"""
+    point, _, e_z = frame
+    offset = points - point
+    z = offset @ e_z
+    return np.linalg.norm(offset - z[:,None]*e_z, axis=1), z
+
+
+def rz_grid_field(coils, axes, frame, rz, chunk_size=CHUNK_SIZE, workers=1, cache=None):
+    """
+    Yields the field of a coaxial coil set on the grid axes (x fastest) a
+    chunk at a time. The field only depends on (rho, z) about the axis, so
+    it is evaluated once at each distinct (rho, z) from rz_points, from the
+    unit current responses in cache if one is given, and turned back into B
+    at every grid point.
+    """
+    rho, z, inverse = rz
+    points = (rho, z, frame)
+    if cache is None:
+        initargs = (coils.centres, coils.normals, coils.radii, coils.currents, points)
+        B_rz = np.concatenate(list(_evaluate(_eval_rz_points_chunk, len(rho), chunk_size, workers, initargs)))
     else:
-        print("invalid geometry type given") 
-
+        grid = _grid_key(axes)
+        grid["kind"] = "rz_points"
+        grid["frame"] = [[float(v) for v in vector] for vector in frame]
+        responses = _cached_responses(cache, coils, None, grid, len(rho), 2, _eval_rz_points_chunk, points,
+                                      chunk_size, workers)
+        B_rz = _weighted_sum(responses, coils.currents, 0, len(rho))
+    for start in range(0, len(inverse), chunk_size):
+        stop = min(start+chunk_size, len(inverse))
+        yield _from_rz(B_rz[inverse[start:stop]], frame, _grid_points(axes, start, stop))
+
+
+def _from_rz(B_rz, frame, points):
+    """B (n, 3) at points from its components along rho and the axis (n, 2)"""
+    point, _, e_z = frame
+    offset = points - point
+    radial = offset - (offset @ e_z)[:,None]*e_z
+    rho = np.linalg.norm(radial, axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        rho_hat = radial/rho[:,None]
+    rho_hat[rho < 1e-12] = 0
+    return B_rz[:,0:1]*rho_hat + B_rz[:,1:2]*e_z
+
+
+def rz_axes(axis, lower, upper, spacing):
+    """
+    A (rho, z) grid covering the box lower to upper, rho from the axis and z
+    along it from the axis point
+
+    Returns:
+        rho_axis, z_axis (ndarrays): Grid points of the table
+        frame (tuple): The axis point, rho direction (of the table's plane)
+            and axis direction
+    """
+    point, e_rho, e_z = rz_frame(axis)
+    corners = np.array([[x, y, z] for x in (lower[0], upper[0]) for y in (lower[1], upper[1])
+                        for z in (lower[2], upper[2])]) - point
+    along = corners @ e_z
+    # Distance to a line is convex, so the furthest box point is a corner
+    rho_max = np.max(np.linalg.norm(corners - along[:,None]*e_z, axis=1))
+    rho_axis = spacing*np.arange(int(np.ceil(rho_max/spacing - 1e-9)) + 1)
+    z_axis = along.min() + spacing*np.arange(int(np.ceil((along.max() - along.min())/spacing - 1e-9)) + 1)
+
+    return rho_axis, z_axis, (point, e_rho, e_z)
+
+
+def rz_table(coils, rho_axis, z_axis, frame, chunk_size=CHUNK_SIZE, workers=1, cache=None):
+    """
+    Evaluates a coaxial coil set on the (rho, z) grid from rz_axes, from the
+    unit current responses in cache if one is given
+
+    Returns:
+        rho_axis, z_axis, table (ndarray (nz, nrho, 2)), frame: table holds
+            the field along rho and along the axis
+    """
+    axes = (rho_axis, z_axis, frame)
+    n_table = len(rho_axis)*len(z_axis)
+    if cache is None:
+        initargs = (coils.centres, coils.normals, coils.radii, coils.currents, axes)
+        table = np.concatenate(list(_evaluate(_eval_rz_chunk, n_table, chunk_size, workers, initargs)))
+    else:
+        grid = {
+            "kind": "rz",
+            "spacing": float(rho_axis[1] - rho_axis[0]),
+            "shape": [len(rho_axis), len(z_axis)],
+            "z0": float(z_axis[0]),
+            "frame": [[float(v) for v in vector] for vector in frame],
+        }
+        responses = _cached_responses(cache, coils, None, grid, n_table, 2, _eval_rz_chunk, axes, chunk_size, workers)
+        table = _weighted_sum(responses, coils.currents, 0, n_table)
+    return rho_axis, z_axis, table.reshape(len(z_axis), len(rho_axis), 2), frame
+
+
+def loop_field(pf_coil_datafile_path, bounding_box_filepath, dx, dy, dz, chunk_size=CHUNK_SIZE, workers=None, file_format="npz", axisymmetric=False, rz_map=False, rz_refine=RZ_REFINE,
+               cache_dir=None, cache_bytes=CACHE_MAX_BYTES,
+               adaptive=False, max_depth=MAX_DEPTH, tolerance=TOLERANCE,
+               tf_coil_path=None, tf_current=0.0, tf_core_radius=CORE_RADIUS,
+               mesh_path=None, mesh_scale=1.0, symmetry="auto",
+               psi_mode=False, psi_levels=None, boundary_path=None):
+    # The outputs are named from this, the tool's command moves them into place
+    out_name = "PF_B"
+    start_time = time.perf_counter()
 
     with open(bounding_box_filepath, 'r') as grid_file:
         reader = csv.reader(grid_file)
@@ -50,229 +417,239 @@ def loop_field(geom_type,pf_coil_datafile_path, bounding_box_filepath, dx, dy, d
 
     # Now you have x_min, x_max, y_min, y_max, z_min, z_max with the correct values
 
-    x_points=1+((x_max-x_min)/dx)
-    y_points=1+((y_max-y_min)/dy)
-    z_points=1+((z_max-z_min)/dz)
+    # Grid points along each axis, min to max inclusive in steps of dx, dy, dz
+    # (a small tolerance keeps max when the range is a whole number of steps)
+    x_axis = x_min + dx*np.arange(int(np.floor((x_max-x_min)/dx + 1e-9)) + 1)
+    y_axis = y_min + dy*np.arange(int(np.floor((y_max-y_min)/dy + 1e-9)) + 1)
+    z_axis = z_min + dz*np.arange(int(np.floor((z_max-z_min)/dz + 1e-9)) + 1)
 
-    coords_total = int((x_points)*(y_points)*(z_points))
+    # The points themselves are only made a chunk at a time by the workers
+    coords_total = len(x_axis)*len(y_axis)*len(z_axis)
     print('coords_total =',coords_total)
 
     print(x_min,x_max,dx,y_min,y_max,dy,z_min,z_max,dz)
 
  
-# creating empty lists to write to later
-    Nr_str = []
-    Nz_str = []
-    I_str= []
-    r_str = []
-    dr_str = []
-    coil_dz_str = []
-    x_centre_str = []
-    y_centre_str = []
-    z_centre_str = []
-    x_normal_str = []
-    y_normal_str = []
-    z_normal_str = []
-
-    coil_counter =0
-    for col in file:
-
-        #count number of coils
-        coil_counter=coil_counter+1
-
-        #Read in values
-        Nr_str.append(col['R_turns'])
-        Nz_str.append(col['R_turns'])
-        I_str.append(col['I'])
-        r_str.append(col['r_av'])
-        dr_str.append(col['dr'])
-        coil_dz_str.append(col['dr'])
-        x_centre_str.append(col['coil_x'])
-        y_centre_str.append(col['coil_y'])
-        z_centre_str.append(col['coil_z'])
-        x_normal_str.append(col['normal_z'])
-        y_normal_str.append(col['normal_y'])
-        z_normal_str.append(col['normal_x'])
-
-    coil_num=coil_counter
-    print("number of coils = ", coil_num)
-    count=0
-
-    #Create correct size arrays to store info about each coil
-    Nr = np.zeros(coil_num)
-    Nz = np.zeros(coil_num)
-    N = np.zeros(coil_num)
-    I= np.zeros(coil_num)
-    r = np.zeros(coil_num)
-    dr = np.zeros(coil_num)
-    coil_dz = np.zeros(coil_num)
-    x_centre = np.zeros(coil_num)
-    y_centre = np.zeros(coil_num)
-    z_centre = np.zeros(coil_num)
-    x_normal = np.zeros(coil_num)
-    y_normal = np.zeros(coil_num)
-    z_normal = np.zeros(coil_num)
-
-# convert to correct type (integer/float)
-
-    while count<= coil_num-1:
-   
-        Nr[count]=int(Nr_str[count]) 
-        Nz[count]=int(Nz_str[count]) 
-        N[count]=int((Nz[count]*Nr[count])) 
-        I[count]=float(I_str[count])
-        r[count]=float(r_str[count])
-        dr[count]=float(dr_str[count])
-        coil_dz[count]=float(coil_dz_str[count])
-        x_centre[count]=float(x_centre_str[count])
-        y_centre[count]=float(y_centre_str[count])
-        z_centre[count]=float(z_centre_str[count])
-        x_normal[count]=float(x_normal_str[count])
-        y_normal[count]=float(y_normal_str[count])
-        z_normal[count]=float(z_normal_str[count])
-
- #   print(N[count],I[count],N[count]*I[count])
-
-        count=count+1
-
+    # Coil set in the coilset schema (.npz or csv) or any older generator csv
+    coil_data = read_coil_set(pf_coil_datafile_path)
+    print("number of coils = ", len(coil_data["radii"]))
     print ("All coils identified")
 
-
-#Sampling points 
-#Creates grid of x_points by y points by z points 
-
-
-    count=0
-
-    print ("All coils created")
-
-    #Create arrays to store the field from the current coil and total field
-    field=np.zeros((coords_total,6))
-    total_field=np.zeros((coords_total,7))
-
-# Calculates the magnetic field from one coil using its properties
-    def Field_Calc(N_val,I_val,R_I,R_av,x_c,y_c,z_c,x_n,y_n,z_n): 
- 
-        coil_centre = array([x_c,y_c,z_c]) # coil centre 
-        coil_normal = array([x_n,y_n,z_n]) # normal vector to plane of coil 
-
-   # print(coil_centre) 
-   # print(coil_normal)
-
-        #Define coil 
-        c1=MagCoil(coil_centre, coil_normal, R=R_av, I=N_val*I_val) 
-        print(N_val*I_val)
-
-        #Use to define centre point of grid 
-        centre=MagCoil(array([0.0,0.0,0.0]), array([0,0,1.0]), R=R_av, I=N_val*I_val)
- 
-        x_current=x_min 
-        y_current=y_min
-        z_current=z_min
-
-        point_num=0
-
-        field_array=np.zeros((coords_total,6))
- 
-        while x_current <= x_max:
-
-                y_current = y_min
-
-                while y_current <= y_max:
-
-                        z_current = z_min
-        
-                        while z_current <= z_max: 
-
-                           # print(point_num)
-
-                                smidge =array([x_current,y_current,z_current])
-                                Bnet=c1.B(centre.r0+smidge)#+c2.B(c3.r0+smidge)
-                                Bx = Bnet[0,0] 
-                                By = Bnet[0,1]
-                                Bz = Bnet[0,2]
-                        
-                                #B_net_mag = (sqrt(((Bx)**2) + ((By)**2) + ((Bz)**2)))
-
-                                #Store values to an array 
-                        
-                                field_array[point_num,0] = x_current
-                                field_array[point_num,1] = y_current
-                                field_array[point_num,2] = z_current
-                                field_array[point_num,3] = Bx
-                                field_array[point_num,4] = By
-                                field_array[point_num,5] = Bz
-                                #field_array[point_num,6] = B_net_mag]                   
-
-                                point_num=point_num+1
-
-                                z_current = z_current+dz
-
-                        y_current=y_current+dz
-
-                x_current = x_current + dz
-
-        return(field_array)
- 
-#Calculate total field from all coils
-    while count<= coil_num-1:
-
-        print(count)
-   
-        field=Field_Calc(N[count],I[count],dr[count],r[count],x_centre[count],y_centre[count],z_centre[count],x_normal[count],y_normal[count],z_normal[count])
-        
-        #Update total field array
-
-        #Coordinates
-
-        total_field[:,0] = field[:,0]
-        total_field[:,1] = field[:,1]
-        total_field[:,2] = field[:,2]
-
-        #Magnetic field 
-        total_field[:,3] = total_field[:,3]+field[:,3]
-        total_field[:,4] = total_field[:,4]+field[:,4]
-        total_field[:,5] = total_field[:,5]+field[:,5]
-
-
-        count=count+1
-
-    total_field[:,6] = sqrt(((total_field[:,3])**2) +((total_field[:,4])**2) +((total_field[:,5])**2)) 
-
-    count = 0 
-
-#Write csv file with data for paraview
-
-    print("x,y,z,Bx,By,Bz,Bmag",file=B_file)
-
-    while count <= coords_total-1: 
-
-        print(total_field[count,0],",",total_field[count,1],",",total_field[count,2],",",total_field[count,3],",",total_field[count,4],",",total_field[count,5],",",total_field[count,6] ,file=B_file)
-        count=count+1
-
+    r = coil_data["radii"]
+    currents = coil_data["turns"]*coil_data["currents"]
+    centres = coil_data["centres"]
+    normals = coil_data["normals"]
+    axes = (x_axis, y_axis, z_axis)
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    coils = MagCoilSet(centres, normals, r, currents)
+
+    # TF coils are straight filaments along their centre lines, all with
+    # the same current, and are added to the field of the loops
+    tf = None
+    if tf_coil_path:
+        tf = SegmentCoilSet.from_csv(tf_coil_path, tf_current, tf_core_radius)
+        print("number of TF coils = ", tf.n_coils, "with", len(tf), "segments")
+
+    # Poloidal flux of coaxial coils on the (R, Z) half plane through the box,
+    # with its contours and how closely a plasma boundary follows them
+    if psi_mode:
+        if tf is not None:
+            print("TF coils add no poloidal flux, psi is of the PF coils only")
+        r_axis, z_axis, frame = rz_axes(flux_frame(coils), (x_min, y_min, z_min), (x_max, y_max, z_max),
+                                        min(dx, dy, dz))
+        psi = psi_map(coils, r_axis, z_axis, frame)
+        write_psi_map(out_name + "_psi.npz", r_axis, z_axis, psi, frame)
+        levels = default_levels(psi) if psi_levels is None else np.asarray(psi_levels, dtype=float)
+        if boundary_path:
+            boundary = read_boundary(boundary_path)
+            level, psi_boundary, distance, spread = compare_boundary(coils, frame, r_axis, z_axis, psi, boundary)
+            write_boundary(out_name + "_boundary.csv", boundary, psi_boundary, distance)
+            levels = np.append(levels, level)
+            print("Boundary mean psi", level, "Wb/rad, varying by", 100*spread, "% of the map's range along it")
+            print("Furthest boundary point is", np.max(distance), "m from that flux surface")
+        contours = flux_contours(r_axis, z_axis, psi, levels)
+        write_contours(out_name + "_psi_contours.csv", out_name + "_psi_contours.vtp", contours, coils, frame)
+        print("Wrote", out_name + "_psi.npz", "with", psi.size, "(R, Z) points and", len(contours), "contour lines")
+        print("Flux map in", time.perf_counter()-start_time, "s")
+        return
+
+    # At the nodes of a gmsh mesh instead of the grid, for thermal and
+    # structural models that run on that mesh
+    if mesh_path:
+        tags, nodes = read_msh_nodes(mesh_path)
+        initargs = (centres, normals, r, currents, nodes*mesh_scale, tf)
+        out_path = out_name + "_nodes.csv"
+        write_nodal_csv(out_path, tags, nodes, _evaluate(_eval_points_chunk, len(nodes), chunk_size, workers, initargs))
+        print("Wrote", out_path, "with the field at", len(nodes), "nodes of", mesh_path)
+        print("Field in", time.perf_counter()-start_time, "s")
+        return
+
+    if adaptive:
+        def evaluate(points):
+            initargs = (centres, normals, r, currents, points, tf)
+            return np.concatenate(list(_evaluate(_eval_points_chunk, len(points), chunk_size, workers, initargs)))
+
+        points, B, cells, depth = sample_adaptive(coils, (x_min, y_min, z_min), (dx, dy, dz),
+                                                  (len(x_axis), len(y_axis), len(z_axis)), evaluate,
+                                                  max_depth, tolerance, tf)
+        out_path = out_name + ".vtu"
+        write_vtu(out_path, points, B, cells, {"depth": depth})
+        finest = np.prod((np.array([len(x_axis), len(y_axis), len(z_axis)]) - 1)*2**max_depth + 1)
+        print("Wrote", out_path, "with", len(cells), "cells")
+        print("Evaluated", len(points), "points, a uniform grid at the finest spacing has", finest)
+        print("Field in", time.perf_counter()-start_time, "s")
+        return
+
+#Write the field map for paraview, a chunk at a time as they finish
+
+    out_path = out_name + FIELD_FORMATS[file_format]
+    B_file = open_field_writer(file_format, out_path, (x_min, y_min, z_min), (dx, dy, dz),
+                               (len(x_axis), len(y_axis), len(z_axis)))
+
+    # Each coil's unit current field is kept so new currents are only a sum.
+    # A cache that cannot be used only costs time, the field is calculated
+    cache = None
+    if cache_dir:
+        try:
+            cache = FieldCache(cache_dir, cache_bytes)
+        except OSError as error:
+            print("Field cache not used:", error)
+    # Coaxial coils (mirrors, tokamak PF sets) have a field that only depends
+    # on (rho, z). If asked, it is evaluated once for each distinct (rho, z)
+    # of the grid points, which holds an index of the whole grid in memory,
+    # otherwise they go through the symmetry path like any other set. TF
+    # coils make the field 3-D even when the loops are coaxial
+    axis = coils.common_axis() if (axisymmetric or rz_map) and tf is None else None
+    rz = None
+    if axis is not None:
+        frame = rz_frame(axis)
+        if axisymmetric:
+            rz = rz_points(axes, frame, chunk_size)
+            print("Coils are coaxial,", len(rz[0]), "distinct (rho, z) points of", coords_total, "grid points")
+            # Off centre or tilted axes leave few grid points sharing a (rho, z)
+            if len(rz[0]) > coords_total//2:
+                rz = None
+        if rz_map:
+            table = rz_table(coils, *rz_axes(axis, (x_min, y_min, z_min), (x_max, y_max, z_max),
+                                             min(dx, dy, dz)/rz_refine), chunk_size, workers, cache)
+            write_rz_map(out_name + "_rz" + FIELD_FORMATS[file_format], file_format, *table)
+    elif rz_map and tf is not None:
+        print("TF coils make the field 3-D, no (rho, z) map written")
+    elif rz_map:
+        print("Coils are not coaxial, no (rho, z) map written")
+
+    if rz is not None:
+        for block in rz_grid_field(coils, axes, frame, rz, chunk_size, workers, cache):
+            B_file.write(block)
+    else:
+        # Reflections and quarter or half turns that map the coils and the
+        # grid onto themselves, detected ("auto") or declared by name
+        group = None
+        if symmetry != "none":
+            group = grid_symmetries(axes, coils, tf, None if symmetry == "auto" else symmetry)
+        for block in grid_field(coils, axes, chunk_size, workers, cache, tf, group):
+            B_file.write(block)
+
+    B_file.close()
+    print("Wrote", out_path)
+    print("Field at", coords_total, "points on", workers, "workers in", time.perf_counter()-start_time, "s")
     print ("Magnetic field calculated")
 
 
-parser = argparse.ArgumentParser()
-parser.add_argument('pf_coil_csv')
-parser.add_argument('bounding_box')
-parser.add_argument('config')
-args = parser.parse_args()
-
-pf_coil_path = args.pf_coil_csv
-bb_filepath = args.bounding_box
-json_path = args.config
-
-
-with open(json_path, 'r') as file:
-    data = json.load(file)
-
-# Now, assign the values to variables
-mesh_data = data['mesh_res']  # Assuming your data is under the 'geometry' key
-dx = mesh_data['dx']
-dy = mesh_data['dy']
-dz = mesh_data['dz']
-
-
-loop_field('Torus', pf_coil_path, bb_filepath, dx, dy, dz)
+def write_rz_map(path, file_format, rho_axis, z_axis, table, frame):
+    """
+    Writes a (rho, z) table as a field map on the half plane through the
+    axis: x is rho, y is 0 and z is the distance along the axis from the
+    axis point, B holds (Brho, 0, Bz)
+    """
+    spacing = z_axis[1] - z_axis[0] if len(z_axis) > 1 else rho_axis[1] - rho_axis[0]
+    values = table.reshape(-1, 2)
+    with open_field_writer(file_format, path, (0.0, 0.0, z_axis[0]), (spacing, spacing, spacing),
+                           (len(rho_axis), 1, len(z_axis))) as writer:
+        writer.write(np.stack((values[:,0], np.zeros(len(values)), values[:,1]), axis=1))
+    point, e_rho, e_z = frame
+    print("Wrote", path, "about the axis through", point, "along", e_z)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('pf_coil_csv', help="Coil set, .npz or csv from any of the coil generators")
+    parser.add_argument('bounding_box')
+    parser.add_argument('config')
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE,
+                        help="Grid points evaluated per chunk, sets the peak memory")
+    parser.add_argument('--workers', type=int, default=None,
+                        help="Worker processes, defaults to the number of cores")
+    parser.add_argument('--format', choices=sorted(FIELD_FORMATS), default="npz",
+                        help="Field map format: npz, vtk (.vti ImageData), hdf5 or csv")
+    parser.add_argument('--axisymmetric', action='store_true',
+                        help="Evaluate coaxial coils once per distinct (rho, z) of the grid points, holds about "
+                             "100 bytes per grid point in memory whatever the chunk size")
+    parser.add_argument('--rz-map', action='store_true',
+                        help="Also write the (rho, z) field of coaxial coils as PF_B_rz")
+    parser.add_argument('--rz-refine', type=int, default=RZ_REFINE,
+                        help="(rho, z) map points per grid spacing for --rz-map")
+    parser.add_argument('--adaptive', action='store_true',
+                        help="Refine the grid where the field varies quickly and near windings, "
+                             "written as PF_B.vtu (VTK UnstructuredGrid) whatever --format is")
+    parser.add_argument('--max-depth', type=int, default=MAX_DEPTH,
+                        help="Times an adaptive cell can be halved")
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE,
+                        help="Relative error that splits an adaptive cell")
+    parser.add_argument('--mesh',
+                        help="gmsh .msh file (2.2 or 4.1, ASCII or binary), the field is evaluated at its "
+                             "nodes and written as PF_B_nodes.csv instead of a grid")
+    parser.add_argument('--mesh-scale', type=float, default=1.0,
+                        help="Mesh coordinates are multiplied by this to give m, e.g. 0.001 for a mesh in mm")
+    parser.add_argument('--psi-map', action='store_true',
+                        help="Write the poloidal flux psi(R, Z) of coaxial coils as PF_B_psi.npz with its contours "
+                             "(PF_B_psi_contours.csv and .vtp) instead of the field map")
+    parser.add_argument('--psi-levels', type=lambda text: [float(value) for value in text.split(",")],
+                        help="Comma separated psi values in Wb/rad to contour, defaults to 20 across the map")
+    parser.add_argument('--boundary',
+                        help="Plasma boundary csv (header then R,Z rows, as tokamak_gen_v2 writes "
+                             "plasma_boundary.csv) compared with the flux surface through it")
+    parser.add_argument('--tf-coils',
+                        help="TF coil csv (TF Coil n blocks of x,y,z from TF_step), added to the field")
+    parser.add_argument('--tf-current', type=float, default=0.0,
+                        help="Current in each TF coil in ampere turns")
+    parser.add_argument('--tf-core-radius', type=float, default=CORE_RADIUS,
+                        help="Radius in m below which the TF filament field is softened")
+    parser.add_argument('--symmetry', default="auto",
+                        help="auto to detect the reflections and quarter or half turns that map the coils and "
+                             "grid onto themselves, none, or a comma separated list of "
+                             + ", ".join(SYMMETRIES) + " (with a trailing - if the currents reverse)")
+    parser.add_argument('--cache-dir', default=os.environ.get("MAGNETIC_FIELD_CACHE"),
+                        help="Keep each coil's unit current field here so that runs with new currents "
+                             "are a weighted sum, defaults to $MAGNETIC_FIELD_CACHE, no cache if unset")
+    parser.add_argument('--cache-size', type=float, default=CACHE_MAX_BYTES/1024**3,
+                        help="GB the cache is trimmed to, least recently used coils first")
+    args = parser.parse_args()
+
+    pf_coil_path = args.pf_coil_csv
+    bb_filepath = args.bounding_box
+    json_path = args.config
+
+
+    with open(json_path, 'r') as file:
+        data = json.load(file)
+
+    # Now, assign the values to variables
+    mesh_data = data['mesh_res']  # Assuming your data is under the 'geometry' key
+    dx = mesh_data['dx']
+    dy = mesh_data['dy']
+    dz = mesh_data['dz']
+
+
+    loop_field(pf_coil_path, bb_filepath, dx, dy, dz, args.chunk_size, args.workers, args.format,
+               args.axisymmetric, args.rz_map, args.rz_refine,
+               args.cache_dir, int(args.cache_size*1024**3),
+               args.adaptive, args.max_depth, args.tolerance,
+               args.tf_coils, args.tf_current, args.tf_core_radius,
+               args.mesh, args.mesh_scale,
+               args.symmetry if args.symmetry in ("auto", "none") else args.symmetry.split(","),
+               args.psi_map, args.psi_levels, args.boundary)
 
@@ -0,0 +1,215 @@
+"""
+Reflection and rotation symmetries shared by a coil set and a field map
+grid, so that only one point of each set of symmetric grid points is
+evaluated.
+
+The transforms considered are the 48 that permute and flip the x, y and z
+axes (reflections in the planes x=0, y=0, z=0, and half and quarter turns
+about the axes): the others do not take a Cartesian grid onto itself. A
+transform T is a symmetry of the coils if it maps the currents onto
+sign*currents, and then the field obeys
+
+    B(T r) = sign*det(T)*T B(r)
+
+as B is an axial vector. sign is -1 for sets whose mirrored coils carry
+opposite currents, such as a cusp. Grid points whose image under T is not a
+grid point (an off-centre bounding box) are simply evaluated themselves.
+"""
+import itertools
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+# Coils and grid points this close, relative to the size of the set, are the same
+TOLERANCE = 1e-6
+# Declared symmetries that the coils miss by more than this are warned about
+DECLARED_TOLERANCE = 1e-3
+
+# Generators that can be declared instead of detected
+SYMMETRIES = {
+    "mirror_x": np.diag([-1.0, 1.0, 1.0]),
+    "mirror_y": np.diag([1.0, -1.0, 1.0]),
+    "mirror_z": np.diag([1.0, 1.0, -1.0]),
+    "rotate_x2": np.diag([1.0, -1.0, -1.0]),
+    "rotate_y2": np.diag([-1.0, 1.0, -1.0]),
+    "rotate_z2": np.diag([-1.0, -1.0, 1.0]),
+    "rotate_x4": np.array([[1.0, 0, 0], [0, 0, -1], [0, 1, 0]]),
+    "rotate_y4": np.array([[0, 0, 1.0], [0, 1, 0], [-1, 0, 0]]),
+    "rotate_z4": np.array([[0, -1.0, 0], [1, 0, 0], [0, 0, 1]]),
+}
+
+
+def signed_permutations():
+    """The 48 orthogonal matrices that permute and flip the axes, identity first"""
+    transforms = []
+    for order in itertools.permutations(range(3)):
+        for signs in itertools.product((1.0, -1.0), repeat=3):
+            T = np.zeros((3, 3))
+            T[list(order), range(3)] = signs
+            transforms.append(T)
+    return transforms
+
+
+def axis_maps(T, axes, tol=TOLERANCE):
+    """
+    How T moves grid indices: for each axis b of the image the axis a it
+    comes from and the index along b of each index along a, -1 where the
+    image is not a grid point. None if no grid point maps onto the grid.
+    """
+    maps = []
+    for b in range(3):
+        a = int(np.flatnonzero(T[b])[0])
+        image = T[b, a]*np.asarray(axes[a], dtype=float)
+        target = np.asarray(axes[b], dtype=float)
+        spacing = target[1] - target[0] if len(target) > 1 else 1.0
+        index = np.rint((image - target[0])/spacing).astype(np.int64)
+        inside = (index >= 0) & (index < len(target))
+        index[~inside] = 0
+        index[~inside | (np.abs(target[index] - image) > tol*abs(spacing))] = -1
+        if np.all(index < 0):
+            return None
+        maps.append((a, index))
+    return maps
+
+
+def _loop_signs(T, coils, tol):
+    """Signs s for which T maps the loops onto loops with s times the current"""
+    moments = coils.currents[:, None]*coils.normals
+    scale = np.max(np.abs(moments)) if len(coils) else 0.0
+    if scale == 0:
+        return {1, -1}
+    size = max(np.max(np.abs(coils.centres)), np.max(coils.radii))
+    positions = np.column_stack((coils.centres, coils.radii))
+    images = np.column_stack((coils.centres @ T.T, coils.radii))
+    distance, match = cKDTree(positions).query(images, distance_upper_bound=tol*size)
+    if not np.all(np.isfinite(distance)):
+        return set()
+    # The moment I n is an axial vector
+    image_moments = np.linalg.det(T)*moments @ T.T
+    return {sign for sign in (1, -1)
+            if np.allclose(moments[match], sign*image_moments, rtol=0, atol=tol*scale)}
+
+
+def _segment_signs(T, tf, tol):
+    """Signs s for which T maps the TF segments onto segments with s times the current"""
+    if tf is None or not len(tf) or not np.any(tf.currents):
+        return {1, -1}
+    size = max(np.max(np.abs(tf.starts)), np.max(np.abs(tf.ends)))
+    tree = cKDTree(np.hstack((tf.starts, tf.ends)))
+    currents = tf.currents[tf.coil]
+    signs = set()
+    # A segment run backwards is the same segment with the opposite current
+    for sign, first, second in ((1, tf.starts, tf.ends), (-1, tf.ends, tf.starts)):
+        distance, match = tree.query(np.hstack((first @ T.T, second @ T.T)), distance_upper_bound=tol*size)
+        if np.all(np.isfinite(distance)) and np.allclose(currents[match], currents, rtol=tol, atol=0):
+            signs.add(sign)
+    return signs
+
+
+def coil_sign(T, coils, tf=None, tol=TOLERANCE):
+    """1 or -1 if T is a symmetry of the coils (and TF coils), 0 if it is not"""
+    signs = _loop_signs(T, coils, tol) & _segment_signs(T, tf, tol)
+    return max(signs) if signs else 0
+
+
+def _closure(generators):
+    """The group generated by (T, sign) pairs"""
+    group = [(np.eye(3), 1)]
+    frontier = list(group)
+    while frontier:
+        new = []
+        for T, sign in frontier:
+            for G, g_sign in generators:
+                product = (G @ T, g_sign*sign)
+                if not any(np.array_equal(product[0], U) for U, _ in group):
+                    group.append(product)
+                    new.append(product)
+        frontier = new
+    return group
+
+
+def grid_symmetries(axes, coils, tf=None, declared=None, tol=TOLERANCE):
+    """
+    The symmetries of the coils that move points of the grid onto the grid
+
+    Args:
+        axes (tuple of ndarrays): x, y and z grid points
+        coils (MagCoilSet): The loops
+        tf (SegmentCoilSet): TF coils, or None
+        declared (list of strings): Names from SYMMETRIES, with a trailing
+            '-' if the currents reverse under it, to use instead of
+            detecting them. None to detect.
+
+    Returns:
+        group (list of (T, sign, maps)): Identity first, maps from axis_maps
+    """
+    if declared is None:
+        candidates = [(T, coil_sign(T, coils, tf, tol)) for T in signed_permutations()]
+        candidates = [(T, sign) for T, sign in candidates if sign]
+    else:
+        generators = []
+        for name in declared:
+            if name.rstrip('-') not in SYMMETRIES:
+                raise ValueError(f"Unknown symmetry {name}, expected one of {', '.join(SYMMETRIES)}")
+            generators.append((SYMMETRIES[name.rstrip('-')], -1 if name.endswith('-') else 1))
+            if coil_sign(generators[-1][0], coils, tf, DECLARED_TOLERANCE) != generators[-1][1]:
+                print("Warning: the coils do not have the declared symmetry", name)
+        candidates = _closure(generators)
+
+    group = []
+    for T, sign in candidates:
+        maps = axis_maps(T, axes, tol)
+        if maps is not None:
+            group.append((T, sign, maps))
+    return group
+
+
+def _image(maps, index):
+    """Grid index (3, n) of the image of the points at index (3, n), -1 where off the grid"""
+    image = np.stack([mapping[index[a]] for a, mapping in maps])
+    image[:, np.any(image < 0, axis=0)] = -1
+    return image
+
+
+def representatives(group, shape, start, stop):
+    """
+    For flat grid indices start to stop (x fastest, shape (nx, ny, nz)) the
+    smallest flat index of a symmetric point and which transform of the
+    group maps the point onto it
+    """
+    flat = np.arange(start, stop)
+    index = np.stack(np.unravel_index(flat, shape[::-1])[::-1])
+    rep = flat.copy()
+    which = np.zeros(len(flat), dtype=np.int64)
+    for t, (T, sign, maps) in enumerate(group[1:], 1):
+        image = _image(maps, index)
+        valid = image[0] >= 0
+        image_flat = np.where(valid, image[0] + shape[0]*(image[1] + shape[1]*image[2]), -1)
+        better = valid & (image_flat < rep)
+        rep[better] = image_flat[better]
+        which[better] = t
+    return rep, which
+
+
+def fundamental_points(group, shape, chunk_size):
+    """
+    Yields the sorted flat indices of the grid points that have to be
+    evaluated, those in each chunk of chunk_size grid points at a time
+    """
+    n_points = int(np.prod(shape))
+    for start in range(0, n_points, chunk_size):
+        rep, _ = representatives(group, shape, start, min(start + chunk_size, n_points))
+        yield np.flatnonzero(rep == np.arange(start, start + len(rep))) + start
+
+
+def from_representatives(group, B_rep, which):
+    """
+    The field at points from the field B_rep (n, 3) at their representatives,
+    B(r) = sign*det(T)*T^T B(T r)
+    """
+    B = np.empty_like(B_rep)
+    for t in np.unique(which):
+        T, sign = group[t][:2]
+        mask = which == t
+        B[mask] = sign*np.linalg.det(T)*B_rep[mask] @ T
+    return B
@@ -0,0 +1,113 @@
+"""
+Tests for the adaptive octree sampling, run with
+
+    python -m pytest galaxy-tools/nttau/magnetic_field_calc
+"""
+import re
+
+import numpy as np
+
+from MagCoilSet import MagCoilSet
+from adaptive_field import CORNER_OFFSETS, _PointStore, sample_adaptive, winding_distance
+from field_writers import VTK_VOXEL, write_vtu
+
+# One loop of radius 1 in the z=0 plane, offset so no grid point lies on it
+COILS = MagCoilSet([[0.05, 0.02, 0.03]], [[0, 0, 1]], [1.0], [1e5])
+LOWER, SPACING, SHAPE = (-2.0, -2.0, -1.0), (0.5, 0.5, 0.5), (9, 9, 5)
+
+
+class _Counter:
+    """The coils' field, recording every point it is asked for"""
+    def __init__(self, coils):
+        self.coils = coils
+        self.points = []
+
+    def __call__(self, points):
+        self.points.append(np.array(points))
+        return self.coils.B(points)
+
+
+def _read_vtu(path):
+    """The raw appended arrays of a vtu by name, with the Piece attributes"""
+    content = open(path, "rb").read()
+    marker = content.index(b'<AppendedData encoding="raw">')
+    header = content[:marker].decode()
+    start = content.index(b"_", marker) + 1
+    types = {"Float64": "<f8", "Int64": "<i8", "UInt8": "u1"}
+    arrays = {}
+    for vtk_type, name, components, offset in re.findall(
+            r'type="(\w+)" Name="(\w+)" NumberOfComponents="(\d+)" format="appended" offset="(\d+)"', header):
+        at = start + int(offset)
+        n_bytes = int(np.frombuffer(content, dtype="<u8", count=1, offset=at)[0])
+        dtype = np.dtype(types[vtk_type])
+        values = np.frombuffer(content, dtype=dtype, count=n_bytes//dtype.itemsize, offset=at + 8)
+        arrays[name] = values.reshape(-1, int(components)) if int(components) > 1 else values
+    piece = dict(re.findall(r'(\w+)="(\d+)"', re.search(r"<Piece ([^>]*)>", header).group(1)))
+    return {key: int(value) for key, value in piece.items()}, arrays
+
+
+def test_windings_refined_to_max_depth():
+    # With no tolerance to meet only the windings split cells
+    points, B, cells, depth = sample_adaptive(COILS, LOWER, SPACING, SHAPE, COILS.B, 3, np.inf)
+    lower, upper = points[cells[:, 0]], points[cells[:, 7]]
+    assert np.allclose(upper - lower, np.array(SPACING)/2.0**depth[:, None])
+
+    # Every cell a point of the winding lies in is at the finest level
+    theta = np.linspace(0, 2*np.pi, 2000, endpoint=False)
+    winding = COILS.centres[0] + np.stack((np.cos(theta), np.sin(theta), np.zeros_like(theta)), axis=1)
+    holds = np.any(np.all((winding[:, None] >= lower) & (winding[:, None] <= upper), axis=2), axis=0)
+    assert np.count_nonzero(holds) > 0 and np.all(depth[holds] == 3)
+
+    # and root cells the winding stays well clear of are not split
+    centres = 0.5*(lower + upper)
+    far = winding_distance(COILS, centres) > np.linalg.norm(SPACING)
+    assert np.count_nonzero(far) > 0 and np.all(depth[far] == 0)
+
+
+def test_tolerance_refines_the_field():
+    coarse = sample_adaptive(COILS, LOWER, SPACING, SHAPE, COILS.B, 2, np.inf)
+    fine = sample_adaptive(COILS, LOWER, SPACING, SHAPE, COILS.B, 2, 1e-3)
+    assert len(fine[2]) > len(coarse[2])
+    assert np.sum(fine[3] > 0) > np.sum(coarse[3] > 0)
+
+
+def test_points_evaluated_once():
+    counter = _Counter(COILS)
+    store = _PointStore(LOWER, np.array(SPACING)/4, (33, 33, 17), counter)
+    coords = np.array([[0, 0, 0], [1, 0, 0], [0, 0, 0], [4, 2, 1]])
+    first = store.field(coords)
+    assert len(counter.points[0]) == 3
+    # Points seen before are looked up, not evaluated again
+    second = store.field(np.array([[[4, 2, 1], [1, 0, 0]], [[5, 2, 1], [5, 2, 1]]]))
+    assert len(counter.points) == 2 and len(counter.points[1]) == 1
+    assert np.array_equal(second[0], first[[3, 1]])
+    assert np.array_equal(store.field(coords), first) and len(counter.points) == 2
+
+    # A whole sampling evaluates each lattice point once, neighbouring
+    # cells share corners and a split cell's centre is its children's corner
+    counter = _Counter(COILS)
+    points, B, cells, depth = sample_adaptive(COILS, LOWER, SPACING, SHAPE, counter, 3, 1e-3)
+    evaluated = np.concatenate(counter.points)
+    assert len(evaluated) == len(points) == len(np.unique(evaluated, axis=0))
+    assert np.array_equal(evaluated[np.lexsort(evaluated.T)], points[np.lexsort(points.T)])
+
+
+def test_vtu_output(tmp_path):
+    points, B, cells, depth = sample_adaptive(COILS, LOWER, SPACING, SHAPE, COILS.B, 2, 1e-3)
+    write_vtu(tmp_path/"field.vtu", points, B, cells, {"depth": depth})
+    piece, arrays = _read_vtu(tmp_path/"field.vtu")
+
+    assert piece == {"NumberOfPoints": len(points), "NumberOfCells": len(cells)}
+    assert np.array_equal(arrays["Points"], points)
+    assert np.array_equal(arrays["B"], B)
+    assert np.allclose(arrays["B"], COILS.B(points), rtol=1e-12, atol=0)
+    assert np.allclose(arrays["Bmag"], np.linalg.norm(B, axis=1))
+    assert np.array_equal(arrays["depth"], depth)
+    assert np.array_equal(arrays["connectivity"].reshape(-1, 8), cells)
+    assert np.array_equal(arrays["offsets"], 8*np.arange(1, len(cells) + 1))
+    assert np.all(arrays["types"] == VTK_VOXEL)
+
+    # Voxel corners are ordered x fastest then y then z
+    corners = arrays["Points"][arrays["connectivity"].reshape(-1, 8)]
+    size = np.array(SPACING)/2.0**depth[:, None]
+    assert np.allclose(corners - corners[:, :1], CORNER_OFFSETS*size[:, None, :])
@@ -0,0 +1,99 @@
+"""
+Tests for the coil set format, run with
+
+    python -m pytest galaxy-tools/nttau/magnetic_field_calc
+"""
+import filecmp
+import os
+
+import numpy as np
+import pytest
+
+from coilset import append_coil_set, coil_set, coil_set_from_rows, read_coil_set, write_coil_set
+
+LEGACY_ROWS = [[10, 10, 2, 1.5, 0.1, 0.2, 0, 1.25, 0, 0, 1, 0],
+               [10, 10, 2, 3.0, 0.1, 0.2, 0, -1.25, 0, 0, 1, 0]]
+
+
+def _random_set(n=50):
+    rng = np.random.default_rng(0)
+    return coil_set(rng.integers(1, 200, n), rng.normal(size=n)*1e3, rng.uniform(0.1, 5, n),
+                    rng.uniform(-5, 5, (n, 3)), rng.normal(size=(n, 3)), rng.uniform(0.01, 0.5, n),
+                    rng.uniform(0.01, 0.5, n))
+
+
+def _assert_same(a, b):
+    assert a.keys() == b.keys()
+    for name in a:
+        assert np.array_equal(a[name], b[name]), name
+
+
+@pytest.mark.parametrize("suffix", [".npz", ".csv"])
+def test_round_trip(tmp_path, suffix):
+    coils = _random_set()
+    path = tmp_path/("coils" + suffix)
+    write_coil_set(path, coils)
+    _assert_same(read_coil_set(path), coils)
+
+
+def test_append(tmp_path):
+    coils = _random_set()
+    path = tmp_path/"coils.csv"
+    path.touch()
+    for start in range(0, 50, 20):
+        append_coil_set(path, {name: values[start:start + 20] for name, values in coils.items()})
+    _assert_same(read_coil_set(path), coils)
+
+
+def test_newer_schema(tmp_path):
+    path = tmp_path/"coils.npz"
+    np.savez(path, schema_version=2, **_random_set())
+    with pytest.raises(ValueError):
+        read_coil_set(path)
+
+
+@pytest.mark.parametrize("header", ["", "R_turns,Z_turns,I,r_av,dr,dz,coil_x,coil_y,coil_z,normal_x,normal_y,normal_z\n",
+                                    "R_turns, Z_turns, I (A), R_av, dr, dz, Coil_X, Coil_Y, Coil_Z, "
+                                    "Normal_x, Normal_y, Normal_z\n"])
+def test_legacy_generators(tmp_path, header):
+    path = tmp_path/"pf.csv"
+    path.write_text(header + "\n".join(",".join(str(value) for value in row) for row in LEGACY_ROWS) + "\n")
+    coils = read_coil_set(path)
+    _assert_same(coils, coil_set_from_rows(LEGACY_ROWS))
+    assert np.array_equal(coils["turns"], [100, 100])
+    # Normals are read as written, y up for the tokamak generators
+    assert np.array_equal(coils["normals"], [[0, 1, 0], [0, 1, 0]])
+
+
+def test_legacy_cylinder(tmp_path):
+    path = tmp_path/"coils.csv"
+    path.write_text("N,I (A),Inner Radius,Outer radius,Coil_X,Coil_Y,Coil_Z,Normal X,Normal Y,Normal Z \n"
+                    "1,20,1.0,1.1,0,0,-2,0,0,1\n1,2,1.0,1.1,0,0,2,0,0,1\n")
+    coils = read_coil_set(path)
+    assert np.allclose(coils["radii"], 1.05)
+    assert np.allclose(coils["dz"], coils["dr"])
+    assert np.allclose(coils["dr"], 0.1)
+    assert np.array_equal(coils["currents"], [20, 2])
+
+
+def test_legacy_spreadsheet_csv(tmp_path):
+    # Saved from a spreadsheet: CRLF, a blank line first, trailing empty
+    # cells and a row of empty cells at the end
+    path = tmp_path/"pf.csv"
+    rows = ["\r\n", "R_turns,Z_turns,I,r_av,dr,dz,coil_x,coil_y,coil_z,normal_x,normal_y,normal_z,,\r\n"]
+    rows += [",".join(str(value) for value in row) + ",,\r\n" for row in LEGACY_ROWS]
+    path.write_bytes("".join(rows + [",,,,,,,,,,,,,\r\n"]).encode())
+    _assert_same(read_coil_set(path), coil_set_from_rows(LEGACY_ROWS))
+
+    path.write_text(",".join(str(value) for value in LEGACY_ROWS[0]) + "\n")
+    _assert_same(read_coil_set(path), coil_set_from_rows(LEGACY_ROWS[:1]))
+
+
+def test_copies_are_the_same():
+    # coilset.py is copied into every tool that reads or writes coil sets
+    here = os.path.dirname(os.path.abspath(__file__))
+    tools = os.path.dirname(os.path.dirname(here))
+    copies = [os.path.join(tools, "nttau", name, "coilset.py") for name in ("cylinder_gen", "tokamakgen")]
+    copies += [os.path.join(tools, "new_nttau", name, "coilset.py") for name in ("tokamak_gen_v2", "mfe_mirror_geometry")]
+    for copy in copies:
+        assert filecmp.cmp(os.path.join(here, "coilset.py"), copy, shallow=False), copy
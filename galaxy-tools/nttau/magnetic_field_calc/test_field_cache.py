@@ -0,0 +1,84 @@
+"""
+Tests for the unit current field cache, run with
+
+    python -m pytest galaxy-tools/nttau/magnetic_field_calc
+"""
+import os
+
+import numpy as np
+import pytest
+
+import magnetic_field_calc
+from MagCoilSet import MagCoilSet
+from SegmentCoilSet import SegmentCoilSet
+from field_cache import FieldCache, unit_responses
+from magnetic_field_calc import grid_field, rz_frame, rz_grid_field, rz_points
+
+AXES = (np.linspace(-2.05, 2.05, 9), np.linspace(-2.05, 2.05, 8), np.linspace(-2.05, 2.05, 11))
+CENTRES = [[0, 0, -1], [0, 0, 1], [0.3, 0.1, 0]]
+NORMALS = [[0, 0, 1], [0, 0, 1], [0.2, 0, 1]]
+RADII = [1.5, 1.5, 0.8]
+TF = SegmentCoilSet([np.array([[1.0, 0, -1.2], [2.2, 0, 0], [1.0, 0, 1.2], [1.0, 0, -1.2]])], 0.0)
+
+
+def _grid(coils, cache=None, tf=None):
+    return np.concatenate(list(grid_field(coils, AXES, 97, 1, cache, tf)))
+
+
+def _rz(coils, cache=None):
+    frame = rz_frame(coils.common_axis())
+    return np.concatenate(list(rz_grid_field(coils, AXES, frame, rz_points(AXES, frame), 97, 1, cache)))
+
+
+def _no_evaluation(*args, **kwargs):
+    raise AssertionError("evaluated a coil that should have been cached")
+
+
+@pytest.mark.parametrize("coaxial", [False, True])
+def test_new_currents_from_cache(tmp_path, monkeypatch, coaxial):
+    n = 2 if coaxial else 3
+    field, tf = (_rz, None) if coaxial else (_grid, TF.with_currents(2e5))
+    first = MagCoilSet(CENTRES[:n], NORMALS[:n], RADII[:n], [1e5, -2e5, 3e4][:n])
+    cache = FieldCache(str(tmp_path))
+    extra = {} if coaxial else {"tf": tf}
+    field(first, cache, **extra)
+
+    second = MagCoilSet(CENTRES[:n], NORMALS[:n], RADII[:n], [-4e4, 7e5, 1e5][:n])
+    if not coaxial:
+        extra["tf"] = TF.with_currents(-5e4)
+    direct = field(second, **extra)
+    monkeypatch.setattr(magnetic_field_calc, "_evaluate", _no_evaluation)
+    cached = field(second, cache, **extra)
+    assert np.allclose(cached, direct, rtol=1e-12, atol=1e-12*np.max(np.abs(direct)))
+
+
+def _fill(cache, keys, shape=(100, 3)):
+    for age, key in enumerate(keys):
+        cache.commit(key, cache.create(key, shape))
+        # Keys filled later were used more recently
+        os.utime(os.path.join(cache.path, key + ".npy"), (1e9 + age, 1e9 + age))
+
+
+def test_evict_least_recently_used(tmp_path):
+    cache = FieldCache(str(tmp_path), 0)
+    _fill(cache, ["a", "b", "c", "d", "e"])
+    cache.get("b")
+    assert cache.evict() == []
+
+    # Room for three: a is protected and b was just read, so c and d go
+    cache.max_bytes = 3*os.path.getsize(os.path.join(tmp_path, "a.npy"))
+    assert cache.evict(protect=["a"]) == ["c", "d"]
+    assert sorted(name[:-4] for name in os.listdir(tmp_path)) == ["a", "b", "e"]
+
+
+def test_failed_evaluation_leaves_nothing(tmp_path):
+    cache = FieldCache(str(tmp_path))
+
+    def evaluate(missing):
+        yield [np.ones((10, 3)) for _ in missing]
+        raise RuntimeError("worker failed")
+
+    with pytest.raises(RuntimeError):
+        unit_responses(cache, ["a", "b"], (20, 3), evaluate)
+    assert os.listdir(tmp_path) == []
+    assert cache.get("a") is None
@@ -0,0 +1,153 @@
+"""
+Tests for the field line tracer, run with
+
+    python -m pytest galaxy-tools/nttau/magnetic_field_calc
+"""
+import re
+
+import numpy as np
+import pytest
+
+from MagCoilSet import MagCoilSet
+from coilset import coil_set, write_coil_set
+from field_lines import CoilField, GridField, disc_seeds, field_lines, load_field, trace, trace_both
+from field_writers import grid_points, open_field_writer
+
+# A mirror pair about z
+MIRROR = MagCoilSet([[0, 0, -1], [0, 0, 1]], [[0, 0, 1]]*2, [1.0, 1.0], [1e5, 1e5])
+SEEDS = disc_seeds((0, 0, 0), (0, 0, 1), 0.5, 6)
+
+
+def _write_coils(path, coils=MIRROR):
+    write_coil_set(path, coil_set(1, coils.currents, coils.radii, coils.centres, coils.normals, 0.1, 0.1))
+    return str(path)
+
+
+def _write_tf(path, n_coils=16):
+    """n_coils circles in vertical planes through the z axis, centred at R = 1.5"""
+    theta = np.linspace(0, 2*np.pi, 65)
+    with open(path, "w") as f_write:
+        for coil, phi in enumerate(2*np.pi*np.arange(n_coils)/n_coils):
+            R, z = 1.5 + 0.8*np.cos(theta), 0.8*np.sin(theta)
+            f_write.write(f"TF Coil {coil + 1}\nx,y,z\n")
+            for row in zip(R*np.cos(phi), R*np.sin(phi), z):
+                f_write.write(",".join(str(value) for value in row) + "\n")
+    return str(path)
+
+
+def _read_vtp(path):
+    """The raw appended arrays of a vtp by name, with the Piece attributes"""
+    content = open(path, "rb").read()
+    marker = content.index(b'<AppendedData encoding="raw">')
+    header = content[:marker].decode()
+    start = content.index(b"_", marker) + 1
+    types = {"Float64": "<f8", "Int64": "<i8"}
+    arrays = {}
+    for vtk_type, name, components, offset in re.findall(
+            r'type="(\w+)" Name="(\w+)" NumberOfComponents="(\d+)" format="appended" offset="(\d+)"', header):
+        at = start + int(offset)
+        n_bytes = int(np.frombuffer(content, dtype="<u8", count=1, offset=at)[0])
+        values = np.frombuffer(content, dtype=types[vtk_type], count=n_bytes//8, offset=at + 8)
+        arrays[name] = values.reshape(-1, int(components)) if int(components) > 1 else values
+    piece = dict(re.findall(r'(Number\w+)="(\d+)"', header))
+    return {key: int(value) for key, value in piece.items()}, arrays
+
+
+def test_trilinear_interpolation(tmp_path):
+    origin, spacing, shape = np.array([-1.0, -0.5, -0.8]), np.array([0.1, 0.125, 0.2]), np.array([21, 9, 9])
+    points = grid_points(origin, spacing, shape, 0, int(np.prod(shape)))
+
+    # Trilinear interpolation is exact for a field linear in each coordinate
+    def bilinear(r):
+        x, y, z = r.T
+        return np.stack((x*y + z, 2*y - x*z, x*y*z + 1), axis=1)
+
+    field = GridField(origin, spacing, shape, bilinear(points).reshape(*shape[::-1], 3))
+    rng = np.random.default_rng(0)
+    inside = origin + rng.uniform(0, 1, (200, 3))*spacing*(shape - 1)
+    assert np.allclose(field(inside), bilinear(inside), rtol=0, atol=1e-12)
+
+    # A coil field, away from the windings, to the second order error of
+    # trilinear interpolation: halving the spacing near enough quarters it
+    inside = rng.uniform(-0.6, 0.6, (500, 3))
+    B = MIRROR.B(inside)
+    errors = []
+    for n in (25, 49):
+        cube = (np.full(3, -0.6), np.full(3, 1.2/(n - 1)), np.full(3, n))
+        with open_field_writer("npz", tmp_path/f"map{n}.npz", *cube) as writer:
+            writer.write(MIRROR.B(grid_points(*cube, 0, n**3)))
+        field = GridField.from_file(tmp_path/f"map{n}.npz", fallback=CoilField(MIRROR))
+        errors.append(np.max(np.linalg.norm(field(inside) - B, axis=1))/np.max(np.linalg.norm(B, axis=1)))
+    assert errors[0] < 2e-3 and errors[0]/errors[1] > 3
+
+    # The coils are used outside the grid
+    outside = np.array([[2.0, 0, 0], [0, 0, 1.5]])
+    assert np.array_equal(field(outside), MIRROR.B(outside))
+    field.fallback = None
+    assert np.all(np.isnan(field(outside)))
+
+
+def test_psi_constant_along_coaxial_lines():
+    lines, fields, closed = trace_both(CoilField(MIRROR), SEEDS, 0.02, 3.0)
+    assert not np.any(closed)
+    for line, B in zip(lines, fields):
+        assert len(line) > 20
+        assert np.allclose(B, MIRROR.B(line), rtol=1e-12, atol=0)
+        # psi = R*A_phi is the flux inside a field line's surface of revolution
+        psi = MIRROR.psi(line)
+        assert np.ptp(psi) < 1e-6*np.max(np.abs(psi))
+
+
+def test_lines_stop_at_the_map_edge():
+    origin, spacing, shape = np.array([-0.6, -0.6, -0.5]), np.array([0.05]*3), np.array([25, 25, 21])
+    points = grid_points(origin, spacing, shape, 0, int(np.prod(shape)))
+    field = GridField(origin, spacing, shape, MIRROR.B(points).reshape(*shape[::-1], 3))
+    lines, _, _ = trace(field, SEEDS, 0.05, 10.0)
+    for line in lines:
+        # Each line runs up the bore and ends close to the top of the map
+        assert np.all(np.abs(line[:, 2]) <= 0.5 + 1e-9)
+        assert line[-1, 2] > 0.5 - 0.05
+
+
+def test_pool_matches_one_worker(tmp_path):
+    coils = _write_coils(tmp_path/"coils.csv")
+    one = _read_vtp(field_lines(str(tmp_path/"one.vtp"), coil_csv=coils, seeds=SEEDS, workers=1))
+    pool = _read_vtp(field_lines(str(tmp_path/"pool.vtp"), coil_csv=coils, seeds=SEEDS, workers=3))
+    assert one[0] == pool[0]
+    for name in one[1]:
+        assert np.allclose(pool[1][name], one[1][name], rtol=1e-12, atol=0), name
+
+
+def test_vtp_output(tmp_path):
+    coils = _write_coils(tmp_path/"coils.csv")
+    field_lines(str(tmp_path/"lines.vtp"), coil_csv=coils, seeds=SEEDS[:3], workers=1)
+    piece, arrays = _read_vtp(tmp_path/"lines.vtp")
+    lines, fields, _ = trace_both(load_field(coil_csv=coils), SEEDS[:3], 0.01*4.0, 16.0)
+
+    assert piece["NumberOfLines"] == 3 and piece["NumberOfPoints"] == sum(len(line) for line in lines)
+    assert np.array_equal(arrays["offsets"], np.cumsum([len(line) for line in lines]))
+    assert np.array_equal(arrays["connectivity"], np.arange(piece["NumberOfPoints"]))
+    assert np.allclose(arrays["Points"], np.concatenate(lines), rtol=1e-12, atol=1e-12)
+    assert np.allclose(arrays["B"], np.concatenate(fields), rtol=1e-12, atol=0)
+    assert np.allclose(arrays["Bmag"], np.linalg.norm(arrays["B"], axis=1))
+    lengths = [np.sum(np.linalg.norm(np.diff(line, axis=0), axis=1)) for line in lines]
+    assert np.allclose(arrays["length"], lengths) and np.array_equal(arrays["closed"], np.zeros(3))
+
+
+def test_tf_coils_on_their_own(tmp_path):
+    tf = _write_tf(tmp_path/"tf.csv")
+    field = load_field(tf_csv=tf, tf_current=1e6)
+    assert isinstance(field, CoilField) and field.coils is None
+
+    # The toroidal field lines close round the z axis at a near constant R
+    seeds = np.array([[1.3, 0, 0], [1.6, 0, 0.2]])
+    field_lines(str(tmp_path/"tf.vtp"), tf_csv=tf, tf_current=1e6, seeds=seeds, workers=1)
+    piece, arrays = _read_vtp(tmp_path/"tf.vtp")
+    assert np.array_equal(arrays["closed"], [1, 1])
+    first = arrays["offsets"][0]
+    for line, seed in ((arrays["Points"][:first], seeds[0]), (arrays["Points"][first:], seeds[1])):
+        R = np.hypot(line[:, 0], line[:, 1])
+        assert np.allclose(R, seed[0], rtol=0.02) and np.allclose(line[:, 2], seed[2], atol=0.02)
+
+    with pytest.raises(ValueError, match="TF coil csv"):
+        load_field()
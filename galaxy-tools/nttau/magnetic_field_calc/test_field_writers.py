@@ -0,0 +1,95 @@
+"""
+Tests for the field map writers, run with
+
+    python -m pytest galaxy-tools/nttau/magnetic_field_calc
+"""
+import re
+import zipfile
+
+import numpy as np
+import pytest
+
+from field_writers import FIELD_FORMATS, grid_points, open_field_writer, read_field_map
+
+ORIGIN, SPACING, SHAPE = np.array([-1.0, 0.5, -2.0]), np.array([0.25, 0.1, 0.5]), np.array([7, 5, 6])
+N_POINTS = int(np.prod(SHAPE))
+# Uneven blocks, as the last chunk of a grid usually is
+BLOCKS = [0, 1, 64, 100, 171, N_POINTS]
+
+
+def _field():
+    """A field that differs at every point and carries full precision"""
+    points = grid_points(ORIGIN, SPACING, SHAPE, 0, N_POINTS)
+    return np.stack((np.sin(points[:, 0]*7.3), points[:, 1]/3.0, np.exp(points[:, 2])*1e-7), axis=1)
+
+
+def _write(file_format, path, B=None):
+    B = _field() if B is None else B
+    with open_field_writer(file_format, path, ORIGIN, SPACING, SHAPE) as writer:
+        for start, stop in zip(BLOCKS[:-1], BLOCKS[1:]):
+            writer.write(B[start:stop])
+    return B
+
+
+@pytest.mark.parametrize("file_format", sorted(FIELD_FORMATS))
+def test_round_trip(tmp_path, file_format):
+    if file_format == "hdf5":
+        pytest.importorskip("h5py")
+    # Galaxy datasets lose their extension, the format is read from the file
+    path = tmp_path/"field.dat"
+    B = _write(file_format, path)
+    origin, spacing, shape, B_read = read_field_map(path)
+    # csv keeps each point's coordinates, the spacing comes back to rounding
+    assert np.allclose(origin, ORIGIN, rtol=1e-15, atol=0) and np.allclose(spacing, SPACING, rtol=1e-12, atol=0)
+    assert np.array_equal(shape, SHAPE) and shape.dtype == np.int64
+    assert B_read.shape == (SHAPE[2], SHAPE[1], SHAPE[0], 3)
+    assert np.array_equal(B_read.reshape(-1, 3), B)
+
+
+def test_npz_streamed(tmp_path):
+    B = _write("npz", tmp_path/"field.npz")
+    with zipfile.ZipFile(tmp_path/"field.npz") as archive:
+        # B is written last, after the grid, in one zip64 entry
+        assert archive.namelist() == ["origin.npy", "spacing.npy", "shape.npy", "B.npy"]
+    with np.load(tmp_path/"field.npz") as data:
+        assert data["B"].shape == (N_POINTS, 3) and np.array_equal(data["B"], B)
+
+
+def test_vti_appended_data(tmp_path):
+    B = _write("vtk", tmp_path/"field.vti")
+    content = (tmp_path/"field.vti").read_bytes()
+    marker = content.index(b'<AppendedData encoding="raw">')
+    header = content[:marker].decode()
+    assert 'header_type="UInt64"' in header and 'byte_order="LittleEndian"' in header
+    assert re.search(r'WholeExtent="0 6 0 4 0 5"', header)
+    assert re.findall(r'offset="(\d+)"', header) == ["0"]
+
+    # The data of the only array starts right after the "_", with its byte
+    # count as a UInt64, and runs up to the closing tags
+    start = content.index(b"_", marker) + 1
+    assert np.frombuffer(content, dtype="<u8", count=1, offset=start)[0] == N_POINTS*3*8
+    data = np.frombuffer(content, dtype="<f8", count=N_POINTS*3, offset=start + 8)
+    assert np.array_equal(data.reshape(-1, 3), B)
+    assert content[start + 8 + N_POINTS*3*8:] == b'\n  </AppendedData>\n</VTKFile>\n'
+
+
+def test_csv_any_row_order(tmp_path):
+    B = _write("csv", tmp_path/"field.csv")
+    rows = np.loadtxt(tmp_path/"field.csv", delimiter=',', skiprows=1)
+    assert np.array_equal(rows[:, 0:3], grid_points(ORIGIN, SPACING, SHAPE, 0, N_POINTS))
+    assert np.allclose(rows[:, 6], np.linalg.norm(B, axis=1), rtol=1e-15, atol=0)
+
+    shuffled = rows[np.random.default_rng(0).permutation(N_POINTS)]
+    np.savetxt(tmp_path/"shuffled.csv", shuffled, delimiter=',', fmt='%.17g', header="x,y,z,Bx,By,Bz,Bmag",
+               comments="")
+    origin, spacing, shape, B_read = read_field_map(tmp_path/"shuffled.csv")
+    assert np.array_equal(shape, SHAPE) and np.allclose(origin, ORIGIN) and np.allclose(spacing, SPACING)
+    assert np.array_equal(B_read.reshape(-1, 3), B)
+
+
+def test_incomplete_map(tmp_path):
+    with pytest.raises(ValueError, match="Wrote 10 of 210"):
+        with open_field_writer("npz", tmp_path/"field.npz", ORIGIN, SPACING, SHAPE) as writer:
+            writer.write(_field()[:10])
+    with pytest.raises(ValueError, match="Unknown field format"):
+        open_field_writer("vtu", tmp_path/"field.vtu", ORIGIN, SPACING, SHAPE)
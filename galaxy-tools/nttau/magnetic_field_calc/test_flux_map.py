@@ -0,0 +1,61 @@
+"""
+Tests for the poloidal flux map, run with
+
+    python -m pytest galaxy-tools/nttau/magnetic_field_calc
+"""
+import numpy as np
+import pytest
+
+from MagCoilSet import MagCoilSet
+from flux_map import compare_boundary, flux_contours, flux_frame, psi_map, read_boundary, write_contours
+from magnetic_field_calc import rz_axes
+
+# Up-down PF pairs about y, as the tokamak generators place them, one with its normal reversed
+COILS = MagCoilSet([[0, 1, 0], [0, -1, 0], [0, 0.3, 0]], [[0, 1, 0], [0, -1, 0], [0, 1, 0]],
+                   [2.0, 2.0, 0.8], [1e5, -1e5, 5e4])
+
+
+@pytest.fixture(scope="module")
+def flux():
+    r_axis, z_axis, frame = rz_axes(flux_frame(COILS), (-3, -3, -3), (3, 3, 3), 0.05)
+    return r_axis, z_axis, psi_map(COILS, r_axis, z_axis, frame), frame
+
+
+def test_frame():
+    point, direction = flux_frame(COILS)
+    assert np.allclose(point, 0) and np.allclose(direction, [0, 1, 0])
+    with pytest.raises(ValueError):
+        flux_frame(MagCoilSet([[0, 0, 0], [1, 0, 0]], [[0, 0, 1], [0, 0, 1]], [1, 1], [1, 1]))
+
+
+def test_flux_through_disc(flux):
+    r_axis, z_axis, psi, (point, e_r, e_z) = flux
+    k, i = 32, 26
+    # psi is the flux of B along the axis through the disc of radius R, per radian
+    rho = (np.arange(4000) + 0.5)/4000*r_axis[i]
+    Bz = COILS.B(point + rho[:, None]*e_r + z_axis[k]*e_z) @ e_z
+    assert psi[k, i] == pytest.approx(np.sum(Bz*rho)*r_axis[i]/4000, rel=1e-6)
+    assert np.all(psi[:, 0] == 0)
+
+
+def test_boundary_on_a_flux_surface(flux):
+    r_axis, z_axis, psi, frame = flux
+    level = psi[32, 26]
+    line = max((line for _, line in flux_contours(r_axis, z_axis, psi, [level])), key=len)
+    found, psi_boundary, distance, spread = compare_boundary(COILS, frame, r_axis, z_axis, psi, line[::5])
+    assert found == pytest.approx(level, rel=1e-3)
+    assert np.max(distance) < 1e-3 and spread < 1e-2
+    # A circle about the coils' midplane is not a flux surface of this set
+    theta = np.linspace(0, 2*np.pi, 50)
+    circle = np.stack((1.4 + 0.5*np.cos(theta), 0.5*np.sin(theta)), axis=1)
+    assert np.max(compare_boundary(COILS, frame, r_axis, z_axis, psi, circle)[2]) > 0.01
+
+
+def test_contour_files(tmp_path, flux):
+    r_axis, z_axis, psi, frame = flux
+    contours = flux_contours(r_axis, z_axis, psi, [psi[32, 26], 1e9])
+    write_contours(tmp_path/"contours.csv", tmp_path/"contours.vtp", contours, COILS, frame)
+    rows = np.loadtxt(tmp_path/"contours.csv", delimiter=',', skiprows=1)
+    assert len(rows) == sum(len(line) for _, line in contours)
+    assert np.allclose(read_boundary(tmp_path/"contours.csv"), rows[:, :2])
+    assert (tmp_path/"contours.vtp").read_bytes().startswith(b"<?xml")
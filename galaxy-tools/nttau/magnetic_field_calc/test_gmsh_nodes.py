@@ -0,0 +1,88 @@
+"""
+Tests for the gmsh node reader, run with
+
+    python -m pytest galaxy-tools/nttau/magnetic_field_calc
+"""
+import os
+import struct
+
+import numpy as np
+import pytest
+
+from gmsh_nodes import read_msh_nodes
+
+SPHERE_MESH = os.path.join(os.path.dirname(__file__), "..", "sphereBCMesh", "outputfile.msh")
+
+
+@pytest.fixture(scope="module")
+def sphere_nodes():
+    return read_msh_nodes(SPHERE_MESH)
+
+
+def _write_41_binary(path, tags, coords, byte_order):
+    """Nodes in five blocks of mixed dimension, one of them parametric, out of tag order"""
+    blocks = np.array_split(np.random.default_rng(0).permutation(len(tags)), 5)
+    with open(path, 'wb') as file:
+        file.write(b"$MeshFormat\n4.1 1 8\n" + struct.pack(byte_order + 'i', 1) + b"\n$EndMeshFormat\n$Nodes\n")
+        file.write(np.array([len(blocks), len(tags), 1, len(tags)], dtype=byte_order + 'u8').tobytes())
+        for entity, block in enumerate(blocks):
+            dim = entity % 4
+            parametric = int(entity == 2)
+            file.write(struct.pack(byte_order + 'iiiQ', dim, entity + 1, parametric, len(block)))
+            file.write(tags[block].astype(byte_order + 'u8').tobytes())
+            values = np.hstack((coords[block], np.full((len(block), dim*parametric), 0.5)))
+            file.write(values.astype(byte_order + 'f8').tobytes())
+        file.write(b"\n$EndNodes\n")
+
+
+def _write_22(path, tags, coords, binary):
+    with open(path, 'wb') as file:
+        file.write(b"$MeshFormat\n2.2 %d 8\n" % binary)
+        if binary:
+            file.write(struct.pack('<i', 1) + b"\n")
+        file.write(b"$EndMeshFormat\n$Nodes\n%d\n" % len(tags))
+        if binary:
+            nodes = np.zeros(len(tags), dtype=[("tag", '<i4'), ("xyz", '<f8', 3)])
+            nodes["tag"] = tags[::-1]
+            nodes["xyz"] = coords[::-1]
+            file.write(nodes.tobytes() + b"\n")
+        else:
+            for tag, (x, y, z) in zip(tags[::-1], coords[::-1]):
+                file.write(b"%d %.17g %.17g %.17g\n" % (tag, x, y, z))
+        file.write(b"$EndNodes\n")
+
+
+def test_sphere_mesh(sphere_nodes):
+    tags, coords = sphere_nodes
+    assert np.array_equal(tags, np.arange(1, 13094))
+    assert coords.shape == (13093, 3)
+    # First node of the file
+    assert np.allclose(coords[0], [75, 0, 0], atol=1e-9)
+    assert np.max(np.linalg.norm(coords, axis=1)) == pytest.approx(3575, rel=1e-3)
+
+
+@pytest.mark.parametrize("byte_order", ['<', '>'])
+def test_binary_41(tmp_path, sphere_nodes, byte_order):
+    tags, coords = sphere_nodes
+    path = tmp_path/"binary.msh"
+    _write_41_binary(path, tags, coords, byte_order)
+    read_tags, read_coords = read_msh_nodes(path)
+    assert np.array_equal(read_tags, tags)
+    assert np.array_equal(read_coords, coords)
+
+
+@pytest.mark.parametrize("binary", [0, 1])
+def test_format_22(tmp_path, sphere_nodes, binary):
+    tags, coords = sphere_nodes
+    path = tmp_path/"mesh22.msh"
+    _write_22(path, tags, coords, binary)
+    read_tags, read_coords = read_msh_nodes(path)
+    assert np.array_equal(read_tags, tags)
+    assert np.array_equal(read_coords, coords)
+
+
+def test_not_a_mesh(tmp_path):
+    path = tmp_path/"coils.csv"
+    path.write_text("R_turns,Z_turns,I\n1,1,1\n")
+    with pytest.raises(ValueError):
+        read_msh_nodes(path)
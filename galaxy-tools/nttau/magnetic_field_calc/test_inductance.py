@@ -0,0 +1,72 @@
+"""
+Tests for the coil inductances, run with
+
+    python -m pytest galaxy-tools/nttau/magnetic_field_calc
+"""
+import numpy as np
+import pytest
+
+import inductance
+from MagCoilSet import MU0, MagCoilSet
+from inductance import coil_inductance, filament_inductance, mutual_coaxial, power_supply, self_inductance
+
+
+def test_coaxial_matches_line_integral():
+    coils = MagCoilSet([[0, 0, 0], [0, 0, 0.5]], [[0, 0, 1], [0, 0, 1]], [1.0, 0.7], [1, 1])
+    inductance._init_worker(coils.centres, coils.normals, coils.radii)
+    quadrature = inductance._mutual_rows(0, 2, 32)
+    assert quadrature[0, 1] == pytest.approx(mutual_coaxial(1.0, 0.7, 0.5), rel=1e-10)
+    assert quadrature[1, 0] == pytest.approx(quadrature[0, 1], rel=1e-10)
+
+
+def test_opposed_normals_are_negative():
+    coils = MagCoilSet([[0, 0, 0], [0, 0, 1]], [[0, 0, 1], [0, 0, -1]], [1.0, 1.0], [1, 1])
+    M = filament_inductance(coils)
+    assert M[0, 1] == pytest.approx(-mutual_coaxial(1.0, 1.0, 1.0))
+
+
+def test_distant_coils_are_dipoles():
+    radii = np.array([0.3, 0.4])
+    offset = np.array([5.0, 3.0, 20.0])
+    normal = np.array([1.0, 0.0, 1.0])/np.sqrt(2)
+    coils = MagCoilSet([[0, 0, 0], offset], [[0, 0, 1], normal], radii, [1, 1])
+    moment = np.pi*radii[0]**2*np.array([0, 0, 1])
+    d = np.linalg.norm(offset)
+    B = MU0/(4*np.pi)*(3*(moment @ offset)*offset/d**5 - moment/d**3)
+    assert filament_inductance(coils)[0, 1] == pytest.approx(B @ normal*np.pi*radii[1]**2, rel=1e-2)
+
+
+def test_thin_coil_self_inductance():
+    # mu0 R (ln(8R/g) - 2) for a winding pack small against its radius
+    gmd = inductance.GMD_RECTANGLE*0.02
+    assert self_inductance(1.0, 0.01, 0.01) == pytest.approx(MU0*(np.log(8/gmd) - 2), rel=1e-4)
+    with pytest.raises(ValueError):
+        self_inductance(1.0, 0.0, 0.0)
+
+
+def test_random_set_is_symmetric():
+    rng = np.random.default_rng(0)
+    coils = MagCoilSet(rng.uniform(-3, 3, (20, 3)), rng.normal(size=(20, 3)), rng.uniform(0.2, 1, 20), np.ones(20))
+    M = filament_inductance(coils)
+    assert np.allclose(M, M.T)
+    assert np.all(np.diag(M) == 0)
+
+
+def test_power_supply():
+    L = np.array([[2.0, 0.5], [0.5, 1.0]])
+    flux, voltage, power, energy = power_supply(L, [10.0, -4.0], 2.0)
+    assert np.allclose(flux, [18.0, 1.0])
+    assert np.allclose(voltage, [9.0, 0.5])
+    assert np.allclose(power, [90.0, -2.0])
+    assert energy == pytest.approx(0.5*(10*18 - 4*1))
+
+
+def test_coil_csv(tmp_path):
+    coil_csv = tmp_path/"coils.csv"
+    coil_csv.write_text("R_turns,Z_turns,I (A),R_av,dr,dz,Coil_X,Coil_Y,Coil_Z,Normal_x,Normal_y,Normal_z\n"
+                        "10,10,100,0.5,0.1,0.1,0,0,-1,0,0,1\n"
+                        "10,10,100,0.5,0.1,0.1,0,0,1,0,0,1\n")
+    L = coil_inductance(coil_csv, tmp_path/"L.csv", tmp_path/"supply.csv", workers=1)
+    assert L[0, 1] == pytest.approx(100*100*mutual_coaxial(0.5, 0.5, 2.0))
+    assert L[0, 0] == pytest.approx(100*100*self_inductance(0.5, 0.1, 0.1))
+    assert np.allclose(np.loadtxt(tmp_path/"L.csv", delimiter=',', skiprows=1), L, rtol=1e-9)
@@ -0,0 +1,103 @@
+"""
+Regression tests for the loop field engines, run with
+
+    python -m pytest galaxy-tools/nttau/magnetic_field_calc
+"""
+import json
+
+import numpy as np
+import pytest
+
+from MagCoil import MagCoil
+from MagCoilSet import MagCoilSet
+from SegmentCoilSet import SegmentCoilSet
+from benchmark_magcoil import (ENGINES, benchmark, dipole_error, divergence_error, flux_error, on_axis_error,
+                               random_coils, tilted_coil)
+
+engines = pytest.mark.parametrize("engine", ENGINES, ids=[engine.name for engine in ENGINES])
+
+
+@engines
+def test_on_axis(engine):
+    assert on_axis_error(engine) < 1e-12
+
+
+@engines
+def test_dipole_far_field(engine):
+    # The next term of the multipole expansion is ~(R/d)^2 = 1e-4
+    assert dipole_error(engine, 100.0) < 5e-4
+    assert dipole_error(engine, 10.0) > dipole_error(engine, 100.0)
+
+
+@engines
+def test_divergence_free(engine):
+    assert divergence_error(engine) < 1e-4
+
+
+@engines
+def test_psi_is_flux(engine):
+    assert flux_error(engine) < 1e-5
+
+
+def test_psi_is_rho_A_phi():
+    coil = MagCoil(np.zeros(3), np.array([0.0, 0.0, 1.0]), R=2.0, I=1e3)
+    r = np.array([[0.3, 0.0, 0.2], [2.5, 0.0, -1.0], [5.0, 0.0, 3.0]])
+    assert np.allclose(coil.psi(r), r[:, 0]*coil.A(r)[:, 1], rtol=1e-12)
+
+
+@pytest.mark.parametrize("quantity, rtol", [("B", 1e-12), ("A", 1e-11), ("psi", 1e-12)])
+def test_set_matches_single_coils(quantity, rtol):
+    # Every element of B agrees to 1e-12 (9.6e-13 at worst here), A to
+    # 3.5e-12 where a component nearly cancels between coils
+    coils = random_coils(5)
+    coil_set = MagCoilSet.from_coils(coils)
+    r = np.random.default_rng(5).uniform(-3, 3, (300, 3))
+    single = sum(getattr(coil, quantity)(r) for coil in coils)
+    assert np.allclose(getattr(coil_set, quantity)(r), single, rtol=rtol, atol=0)
+
+
+def test_per_coil_sums_to_total():
+    coil_set = MagCoilSet.from_coils(random_coils(4))
+    r = np.random.default_rng(6).uniform(-3, 3, (100, 3))
+    assert np.allclose(coil_set.B(r, per_coil=True).sum(axis=0), coil_set.B(r))
+
+
+def test_frame_is_repeatable():
+    r = np.random.default_rng(7).uniform(-2, 2, (50, 3))
+    assert np.array_equal(tilted_coil().B(r), tilted_coil().B(r))
+    assert np.array_equal(np.asarray(tilted_coil().rotmtx), np.asarray(tilted_coil().rotmtx))
+
+
+def test_setters_update_field():
+    coil = tilted_coil()
+    r = np.random.default_rng(8).uniform(-2, 2, (50, 3))
+    B = coil.B(r)
+    coil.set_I(2*coil.I)
+    assert np.allclose(coil.B(r), 2*B)
+    coil.normal = -coil.normal
+    assert np.allclose(coil.B(r), -2*B)
+    coil.move(np.array([1.0, 0.0, 0.0]))
+    assert np.allclose(coil.B(r + [1.0, 0.0, 0.0]), -2*B)
+    coil.R = 2*coil.R
+    assert coil.B0 == pytest.approx(coil.mu*coil.I/2/coil.R)
+
+
+def test_segments_match_loop():
+    coil = tilted_coil()
+    theta = np.linspace(0, 2*np.pi, 2001)[:-1]
+    rotmtx = np.asarray(coil.rotmtx)
+    line = coil.r0 + coil.R*(np.cos(theta)[:, None]*rotmtx[0] + np.sin(theta)[:, None]*rotmtx[1])
+    segments = SegmentCoilSet([line], coil.I, core_radius=0.0)
+    r = coil.r0 + np.random.default_rng(9).uniform(-0.3, 0.3, (50, 3))
+    B = coil.B(r)
+    assert np.max(np.linalg.norm(segments.B(r) - B, axis=1)/np.linalg.norm(B, axis=1)) < 1e-4
+
+
+def test_benchmark_is_json(tmp_path):
+    results = benchmark(coil_counts=(1, 10), pairs=1000, repeats=1)
+    path = tmp_path/"benchmark.json"
+    path.write_text(json.dumps(results))
+    loaded = json.loads(path.read_text())
+    assert len(loaded["timings"]) == 2*len(ENGINES)*3
+    assert all(record["seconds_per_million_points"] > 0 for record in loaded["timings"])
+    assert set(loaded["accuracy"]) == {engine.name for engine in ENGINES}
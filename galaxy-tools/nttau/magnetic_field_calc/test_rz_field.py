@@ -0,0 +1,34 @@
+"""
+Tests for the (rho, z) evaluation of coaxial coil sets, run with
+
+    python -m pytest galaxy-tools/nttau/magnetic_field_calc
+"""
+import numpy as np
+import pytest
+
+from MagCoilSet import MagCoilSet
+from magnetic_field_calc import grid_field, rz_frame, rz_grid_field, rz_points
+
+# A mirror along z with its windings between grid points
+COILS = MagCoilSet([[0, 0, -1.55], [0, 0, -0.55], [0, 0, 0.55], [0, 0, 1.55]], [[0, 0, 1]]*4,
+                   [0.65, 0.95, 0.95, 0.65], [3e5, 1e5, 1e5, 3e5])
+
+
+@pytest.mark.parametrize("lower", [(-1, -1, -2), (-0.93, -1.17, -2.05)])
+def test_matches_direct_evaluation(lower):
+    axes = tuple(start + 0.1*np.arange(n) for start, n in zip(lower, (21, 22, 41)))
+    frame = rz_frame(COILS.common_axis())
+    rz = rz_points(axes, frame, 997)
+    n_points = 21*22*41
+    assert len(rz[0]) < n_points//2
+    B = np.concatenate(list(grid_field(COILS, axes, 997)))
+    B_rz = np.concatenate(list(rz_grid_field(COILS, axes, frame, rz, 997)))
+    # Only the engine's rounding differs, the points are not interpolated
+    assert np.max(np.linalg.norm(B_rz - B, axis=1)/np.linalg.norm(B, axis=1)) < 1e-9
+
+
+def test_on_axis_points():
+    axes = (np.array([0.0]), np.array([0.0]), np.linspace(-2, 2, 9))
+    frame = rz_frame(COILS.common_axis())
+    B = np.concatenate(list(rz_grid_field(COILS, axes, frame, rz_points(axes, frame))))
+    assert np.allclose(B[:, :2], 0) and np.all(B[:, 2] > 0)
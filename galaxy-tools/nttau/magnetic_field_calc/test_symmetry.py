@@ -0,0 +1,95 @@
+"""
+Tests for the coil set symmetries, run with
+
+    python -m pytest galaxy-tools/nttau/magnetic_field_calc
+"""
+import os
+import tempfile
+
+import numpy as np
+import pytest
+
+from MagCoilSet import MagCoilSet
+from SegmentCoilSet import SegmentCoilSet
+from magnetic_field_calc import grid_field
+from symmetry import SYMMETRIES, grid_symmetries, signed_permutations
+
+# Grid points stay off the windings, where the field is singular, and z
+# runs further up than down so some points have no mirror image
+AXES = (np.linspace(-2.1, 2.1, 15), np.linspace(-2.1, 2.1, 15), -2.1 + 0.2*np.arange(24))
+
+
+def _tf_coils(n, current=1e6):
+    """n D shaped coils about the z axis, each closed in its own plane"""
+    theta = np.linspace(0, 2*np.pi, 24, endpoint=False)
+    outline = np.stack((1.2 + 0.5*np.cos(theta), np.zeros_like(theta), 0.8*np.sin(theta)), axis=1)
+    lines = []
+    for phi in 2*np.pi*np.arange(n)/n:
+        rotation = np.array([[np.cos(phi), -np.sin(phi), 0], [np.sin(phi), np.cos(phi), 0], [0, 0, 1]])
+        lines.append(outline @ rotation.T)
+    return SegmentCoilSet(lines, current)
+
+
+def _field(coils, tf=None, group=None, workers=1):
+    return np.concatenate(list(grid_field(coils, AXES, 997, workers, None, tf, group)))
+
+
+def test_group():
+    transforms = signed_permutations()
+    assert len(transforms) == 48
+    assert np.array_equal(transforms[0], np.eye(3))
+    for T in SYMMETRIES.values():
+        assert any(np.array_equal(T, U) for U in transforms)
+
+
+@pytest.mark.parametrize("currents, sign", [([1e5, 1e5], 1), ([1e5, -1e5], -1)])
+def test_mirror(currents, sign):
+    # Tilted coils, only symmetric under the z reflection
+    normal = [0.3, 0.1, 1.0]
+    coils = MagCoilSet([[0.2, 0.1, -1], [0.2, 0.1, 1]], [normal, [-0.3, -0.1, 1.0]], [1, 1], currents)
+    group = grid_symmetries(AXES, coils)
+    assert [np.diag(T).tolist() for T, _, _ in group] == [[1, 1, 1], [1, 1, -1]]
+    assert group[1][1] == sign
+    assert np.allclose(_field(coils, group=group), _field(coils), rtol=0, atol=1e-10)
+
+
+def test_tf_set():
+    coils = MagCoilSet([[0, 0, -1], [0, 0, 1]], [[0, 0, 1]]*2, [1.5, 1.5], [1e5, 1e5])
+    tf = _tf_coils(12)
+    group = grid_symmetries(AXES, coils, tf)
+    # The z reflection reverses the TF currents but not the loops', which
+    # leaves the quarter turns about z and the half turns about x, y and the diagonals
+    assert len(group) == 8
+    assert not any(np.array_equal(T, SYMMETRIES["mirror_z"]) for T, _, _ in group)
+    B = _field(coils, tf)
+    assert np.allclose(_field(coils, tf, group), B, rtol=0, atol=1e-9*np.max(np.abs(B)))
+
+
+def test_pool_and_scratch_files(tmp_path, monkeypatch):
+    # The workers read the evaluated points from the scratch directory,
+    # which is gone once the field has been written
+    monkeypatch.setattr(tempfile, "tempdir", str(tmp_path))
+    coils = MagCoilSet([[0, 0, -1], [0, 0, 1]], [[0, 0, 1]]*2, [1.5, 1.5], [1e5, 3e5])
+    group = grid_symmetries(AXES, coils)
+    B = _field(coils, group=group, workers=2)
+    assert np.array_equal(B, _field(coils, group=group))
+    assert np.allclose(B, _field(coils), rtol=0, atol=1e-10)
+    assert os.listdir(tmp_path) == []
+
+
+def test_no_symmetry():
+    rng = np.random.default_rng(0)
+    coils = MagCoilSet(rng.normal(size=(4, 3)), rng.normal(size=(4, 3)), rng.uniform(0.5, 1, 4), np.ones(4))
+    assert len(grid_symmetries(AXES, coils)) == 1
+    # Of a 5-fold TF set only the reflections in y=0 and z=0 fit the grid
+    group = grid_symmetries(AXES, MagCoilSet(np.zeros((0, 3)), np.zeros((0, 3)), [], []), _tf_coils(5))
+    assert sorted(np.diag(T).tolist() for T, _, _ in group) == [[1, -1, -1], [1, -1, 1], [1, 1, -1], [1, 1, 1]]
+
+
+def test_declared(capsys):
+    coils = MagCoilSet([[0, 0, -1], [0, 0, 1]], [[0, 0, 1]]*2, [1, 1], [1e5, 2e5])
+    group = grid_symmetries(AXES, coils, declared=["mirror_z", "rotate_z4"])
+    assert len(group) == 8
+    assert "do not have the declared symmetry mirror_z" in capsys.readouterr().out
+    with pytest.raises(ValueError):
+        grid_symmetries(AXES, coils, declared=["mirror_w"])
@@ -3,6 +3,7 @@ from typing import Iterable, Tuple
 from itertools import accumulate
 from pylab import *
 from TF_step_V3 import TF_step
+from coilset import append_coil_set, coil_set_from_rows
 import csv
 import os
 from operator import itemgetter
@@ -385,9 +386,9 @@ def generate_solenoid(
 
 # Function to write or append coil data to a CSV file
 def write_PF_coils_to_csv(coil_data, csv_file_path="pf_coils_1.csv"):
-    with open(csv_file_path, "a", newline="") as csvfile:  # 'a' is for append mode
-        csv_writer = csv.writer(csvfile)
-        csv_writer.writerows(coil_data)
+    # Rows of R_turns, Z_turns, I, r_av, dr, dz, coil_x, coil_y, coil_z, normal_x, normal_y, normal_z,
+    # added to the coil set (.npz or coilset csv) at csv_file_path
+    append_coil_set(csv_file_path, coil_set_from_rows(coil_data))
     print(f"PF Coil data appended to {csv_file_path}")
 
 
@@ -1,6 +1,5 @@
 import TokamakGen as tg
 import cadquery as cq
-import csv
 import argparse
 import json
 
@@ -36,26 +35,8 @@ major_rad = aspect_ratio * radial_build[0]
 max_a = sum(radial_build)
 print(max)
 
-# Init csv 
-with open(pf_coil_path, "a", newline="") as csvfile:  # 'a' is for append mode
-    csv_writer = csv.writer(csvfile)
-
-    csv_writer.writerow(
-        [
-                "R_turns",
-                "Z_turns",
-                "I",
-                "r_av",
-                "dr",
-                "dz",
-                "coil_x",
-                "coil_y",
-                "coil_z",
-                "normal_x",
-                "normal_y",
-                "normal_z",
-            ]
-        )
+# Init csv, the coils are added to it in the coilset schema as they are made
+open(pf_coil_path, "w").close()
 
 reactor, coils, radial_build = tg.run_code(
     radial_build, component_names, aspect_ratio, TF_dz, TF_dr, PF_dz, PF_dr, With_Sol, tf_coil_path, pf_coil_path
@@ -0,0 +1,92 @@
+"""
+Paged preview of run outputs in the window.
+
+Only one page of a file is read from disk at a time, cut back to a whole
+line (or a whole utf-8 character), so previews of large outputs stay
+cheap. JSON is pretty printed a page at a time, carrying the nesting and
+string state from one page to the next instead of parsing the document.
+
+Nothing here needs Kit, so it is tested with plain pytest (see tests/ in
+the extension folder).
+"""
+
+# Largest number of bytes read from disk for a single preview page
+PREVIEW_PAGE_BYTES = 64 * 1024
+
+
+def read_file_window(file_path, offset=0, max_bytes=PREVIEW_PAGE_BYTES):
+    """
+    Reads a bounded window of a file from disk, without loading the rest
+
+    Args:
+        file_path (string): File to read from
+        offset (int): Byte offset to start reading at
+        max_bytes (int): Maximum number of bytes to read
+
+    Returns:
+        text (string): Decoded window, cut back to the last full line
+            (or full character) when the file carries on past the window
+        next_offset (int): Byte offset the following window starts at
+    """
+    with open(file_path, 'rb') as f_read:
+        f_read.seek(offset)
+        data = f_read.read(max_bytes)
+
+    if len(data) == max_bytes:
+        cut = data.rfind(b'\n') + 1
+        if cut == 0:
+            # No line break in the window, so only back off to the start of
+            # the last (possibly split) utf-8 character
+            cut = len(data)
+            while cut > 0 and (data[cut - 1] & 0xC0) == 0x80:
+                cut -= 1
+            if cut > 0 and data[cut - 1] >= 0xC0:
+                cut -= 1
+            if cut == 0:
+                cut = len(data)
+        data = data[:cut]
+
+    return data.decode('utf-8', errors='replace'), offset + len(data)
+
+
+def pretty_json_chunk(text, state=(0, False, False), indent=4):
+    """
+    Pretty prints a piece of a JSON document without parsing the whole file
+
+    Args:
+        text (string): The next piece of the JSON document
+        state (tuple): (depth, in_string, escaped) left over from the
+            previous piece, (0, False, False) for the start of a file
+        indent (int): Number of spaces per nesting level
+
+    Returns:
+        pretty (string): The indented piece
+        state (tuple): State to pass in with the piece that follows
+    """
+    depth, in_string, escaped = state
+    out = []
+    for char in text:
+        if in_string:
+            out.append(char)
+            if escaped:
+                escaped = False
+            elif char == '\\':
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+            out.append(char)
+        elif char in '{[':
+            depth += 1
+            out.append(char + '\n' + ' ' * indent * depth)
+        elif char in '}]':
+            depth = max(depth - 1, 0)
+            out.append('\n' + ' ' * indent * depth + char)
+        elif char == ',':
+            out.append(',\n' + ' ' * indent * depth)
+        elif char == ':':
+            out.append(': ')
+        elif not char.isspace():
+            out.append(char)
+    return ''.join(out), (depth, in_string, escaped)
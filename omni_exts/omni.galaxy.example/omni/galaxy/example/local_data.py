@@ -0,0 +1,232 @@
+"""
+Disk budget for the run folders in omni-data.
+
+uid_track.json lists the runs downloaded from Galaxy and the workflow of
+each. The last time each run was used and whether the user wants to keep
+it are tracked in uid_access.json next to it. When the runs take up more
+than the budget, the least recently used runs that are not kept are
+deleted until the total fits again.
+
+Component layers shared between runs (see usd_payloads) live in
+omni-data/layers with one manifest per source file, a layer is removed
+once no remaining source file uses it.
+"""
+import os
+import re
+import json
+import time
+import shutil
+import threading
+from datetime import datetime
+
+current_path = os.path.dirname(os.path.abspath(__file__))
+parent_path = current_path.split('omni_exts')[0]
+data_path = os.path.join(parent_path, "omni-data")
+
+ACCESS_FILE = os.path.join(data_path, "uid_access.json")
+UID_TRACK_FILE = os.path.join(data_path, "uid_track.json")
+layers_path = os.path.join(data_path, "layers")
+manifests_path = os.path.join(layers_path, "manifests")
+# Finished component layers, <sha256>.usdc or <sha256>.lod.usdc
+LAYER_NAME = re.compile(r"^([0-9a-f]{64})(\.lod)?\.usdc$")
+
+# Guards uid_track.json, which is written from download and eviction workers
+prov_lock = threading.Lock()
+# Guards uid_access.json, which is updated from the UI and from downloads
+_access_lock = threading.Lock()
+# Only one eviction pass runs at a time, later requests are skipped while
+# one is in progress
+_evict_lock = threading.Lock()
+# Held while component layers are written or collected, so a layer is not
+# removed between being reused and its manifest being written
+layers_lock = threading.RLock()
+
+
+def add_uid_to_prov(uid, wf_name):
+    """Records a downloaded run and its workflow in uid_track.json"""
+    file_path = UID_TRACK_FILE
+
+    with prov_lock:
+        uid_previous = {}
+        if os.path.exists(file_path):
+            with open(file_path, 'r') as file:
+                uid_previous = json.load(file)
+
+        uid_previous[uid] = f'{wf_name} at {datetime.now()}'
+
+        with open(file_path, 'w') as file:
+            json.dump(uid_previous, file)
+
+
+def remove_uids_from_prov(uids):
+    """Removes deleted runs from uid_track.json"""
+    file_path = UID_TRACK_FILE
+
+    with prov_lock:
+        if not os.path.exists(file_path):
+            return
+        with open(file_path, 'r') as file:
+            uid_previous = json.load(file)
+
+        for uid in uids:
+            uid_previous.pop(uid, None)
+
+        with open(file_path, 'w') as file:
+            json.dump(uid_previous, file)
+
+
+def _read_access():
+    if not os.path.exists(ACCESS_FILE):
+        return {}
+    with open(ACCESS_FILE, 'r') as file:
+        return json.load(file)
+
+
+def _write_access(access):
+    os.makedirs(data_path, exist_ok=True)
+    with open(ACCESS_FILE + ".tmp", 'w') as file:
+        json.dump(access, file)
+    os.replace(ACCESS_FILE + ".tmp", ACCESS_FILE)
+
+
+def touch_run(uid):
+    """Records that a run has just been used"""
+    with _access_lock:
+        access = _read_access()
+        access.setdefault(uid, {"keep": False})["last_access"] = time.time()
+        _write_access(access)
+
+
+def set_run_kept(uid, keep):
+    """Marks a run as kept (never evicted) or not"""
+    with _access_lock:
+        access = _read_access()
+        entry = access.setdefault(uid, {"last_access": time.time()})
+        entry["keep"] = bool(keep)
+        _write_access(access)
+
+
+def is_run_kept(uid):
+    with _access_lock:
+        return _read_access().get(uid, {}).get("keep", False)
+
+
+def _folder_size(folder):
+    total = 0
+    for root, _, files in os.walk(folder):
+        for file in files:
+            try:
+                total += os.path.getsize(os.path.join(root, file))
+            except OSError:
+                # Removed or renamed while walking, e.g. a finished .partial
+                pass
+    return total
+
+
+def run_sizes():
+    """
+    Gets the size on disk of each tracked run
+
+    Returns:
+        sizes (dict): {uid: bytes} for every run in uid_track.json
+    """
+    if not os.path.exists(UID_TRACK_FILE):
+        return {}
+    with open(UID_TRACK_FILE, 'r') as file:
+        uids = json.load(file)
+    return {
+        uid: _folder_size(os.path.join(data_path, uid))
+        for uid in uids
+        if os.path.isdir(os.path.join(data_path, uid))
+    }
+
+
+def enforce_budget(budget_bytes, protect=()):
+    """
+    Deletes least recently used runs until the tracked runs fit the budget
+
+    Args:
+        budget_bytes (int): Disk budget for all runs, 0 or less for no limit
+        protect (iterable of strings): Runs that must not be removed, such
+            as a run that is still downloading
+
+    Returns:
+        evicted (list of strings): uids of the runs that were deleted
+    """
+    if budget_bytes <= 0:
+        return []
+    if not _evict_lock.acquire(blocking=False):
+        return []
+    try:
+        sizes = run_sizes()
+        total = sum(sizes.values())
+        if total <= budget_bytes:
+            return []
+
+        with _access_lock:
+            access = _read_access()
+
+        def last_access(uid):
+            if uid in access and "last_access" in access[uid]:
+                return access[uid]["last_access"]
+            return os.path.getmtime(os.path.join(data_path, uid))
+
+        candidates = sorted(
+            (
+                uid for uid in sizes
+                if uid not in protect and not access.get(uid, {}).get("keep", False)
+            ),
+            key=last_access
+        )
+
+        evicted = []
+        for uid in candidates:
+            if total <= budget_bytes:
+                break
+            shutil.rmtree(os.path.join(data_path, uid), ignore_errors=True)
+            total -= sizes[uid]
+            evicted.append(uid)
+
+        if evicted:
+            remove_uids_from_prov(evicted)
+            with _access_lock:
+                access = _read_access()
+                for uid in evicted:
+                    access.pop(uid, None)
+                _write_access(access)
+            collect_layers()
+        return evicted
+    finally:
+        _evict_lock.release()
+
+
+def collect_layers():
+    """
+    Removes manifests of source files that no longer exist and the
+    component layers none of the remaining manifests use
+
+    Returns:
+        removed (list of strings): Names of the layer files removed
+    """
+    if not os.path.isdir(manifests_path):
+        return []
+    with layers_lock:
+        used = set()
+        for name in os.listdir(manifests_path):
+            if not name.endswith(".json"):
+                continue
+            manifest_path = os.path.join(manifests_path, name)
+            with open(manifest_path, 'r') as file:
+                manifest = json.load(file)
+            if not os.path.exists(manifest["source"]):
+                os.remove(manifest_path)
+                continue
+            used.update(component["hash"] for component in manifest["components"])
+
+        removed = []
+        for name in os.listdir(layers_path):
+            match = LAYER_NAME.match(name)
+            if match and match.group(1) not in used:
+                os.remove(os.path.join(layers_path, name))
+                removed.append(name)
+        return removed
@@ -0,0 +1,113 @@
+"""
+Serializes prims from the open stage into a string that can be uploaded
+to Galaxy as a workflow input, without writing anything to disk.
+"""
+import io
+
+import numpy as np
+import omni.usd  # pylint: disable=import-error
+from pxr import Usd, UsdGeom  # pylint: disable=import-error
+
+# Formats a selection can be uploaded as, the value is the Galaxy datatype
+STAGE_EXPORT_FORMATS = {
+    "usda": "usda",
+    "obj": "obj",
+    "stl": "stl",
+}
+
+
+def serialize_prims(prim_paths, file_format="usda"):
+    """
+    Serializes the given prims (and everything below them) from the open
+    stage, including edits that have not been saved
+
+    Args:
+        prim_paths (list of strings): Prims to serialize
+        file_format (string): One of STAGE_EXPORT_FORMATS, usda keeps the
+            prims as flattened USD, obj and stl hold the Mesh prims as
+            triangles in world coordinates
+
+    Returns:
+        content (string): The serialized prims
+        file_type (string): Galaxy datatype of the content
+    """
+    stage = omni.usd.get_context().get_stage()
+    if file_format == "usda":
+        mask = Usd.StagePopulationMask()
+        for prim_path in prim_paths:
+            mask.Add(prim_path)
+        masked = Usd.Stage.OpenMasked(stage.GetRootLayer(), stage.GetSessionLayer(), mask)
+        return masked.Flatten().ExportToString(), STAGE_EXPORT_FORMATS[file_format]
+
+    meshes = list(_world_meshes(stage, prim_paths))
+    if file_format == "obj":
+        return _to_obj(meshes), STAGE_EXPORT_FORMATS[file_format]
+    if file_format == "stl":
+        return _to_stl(meshes), STAGE_EXPORT_FORMATS[file_format]
+    raise ValueError(f"Unknown export format {file_format}")
+
+
+def _world_meshes(stage, prim_paths):
+    """Yields (name, world points, triangles) for every mesh under the prims"""
+    xform_cache = UsdGeom.XformCache()
+    seen = set()
+    for prim_path in prim_paths:
+        root = stage.GetPrimAtPath(prim_path)
+        if not root:
+            continue
+        for prim in Usd.PrimRange(root, Usd.TraverseInstanceProxies()):
+            # Selecting a prim and one of its children exports it once
+            if prim.GetPath() in seen or not prim.IsA(UsdGeom.Mesh):
+                continue
+            seen.add(prim.GetPath())
+            mesh = UsdGeom.Mesh(prim)
+            points = mesh.GetPointsAttr().Get()
+            counts = mesh.GetFaceVertexCountsAttr().Get()
+            indices = mesh.GetFaceVertexIndicesAttr().Get()
+            if not points or not counts or not indices:
+                continue
+
+            mat = np.array(xform_cache.GetLocalToWorldTransform(prim), dtype=float)
+            world = np.asarray(points, dtype=float) @ mat[:3, :3] + mat[3, :3]
+            yield prim.GetName(), world, _triangulate(np.asarray(counts), np.asarray(indices))
+
+
+def _triangulate(counts, indices):
+    """Fan triangulates polygons: (s, s + k, s + k + 1) for k = 1 .. n - 2"""
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    n_tris = np.maximum(counts - 2, 0)
+    tri_start = np.repeat(starts, n_tris)
+    tri_k = np.arange(n_tris.sum()) - np.repeat(np.cumsum(n_tris) - n_tris, n_tris) + 1
+    return np.stack((
+        indices[tri_start],
+        indices[tri_start + tri_k],
+        indices[tri_start + tri_k + 1],
+    ), axis=1)
+
+
+def _to_obj(meshes):
+    out = io.StringIO()
+    offset = 1
+    for name, points, tris in meshes:
+        out.write(f"o {name}\n")
+        np.savetxt(out, points, fmt="v %.9g %.9g %.9g")
+        np.savetxt(out, tris + offset, fmt="f %d %d %d")
+        offset += len(points)
+    return out.getvalue()
+
+
+def _to_stl(meshes):
+    out = io.StringIO()
+    for name, points, tris in meshes:
+        corners = points[tris]
+        normals = np.cross(corners[:, 1] - corners[:, 0], corners[:, 2] - corners[:, 0])
+        normals /= np.maximum(np.linalg.norm(normals, axis=1), 1e-300)[:, None]
+        facets = np.concatenate((normals[:, None, :], corners), axis=1).reshape(len(tris), 12)
+        out.write(f"solid {name}\n")
+        np.savetxt(out, facets, fmt=(
+            "facet normal %.9g %.9g %.9g\n outer loop\n"
+            "  vertex %.9g %.9g %.9g\n  vertex %.9g %.9g %.9g\n  vertex %.9g %.9g %.9g\n"
+            " endloop\nendfacet"
+        ))
+        out.write(f"endsolid {name}\n")
+    return out.getvalue()
@@ -0,0 +1,78 @@
+# NOTE:
+#   Startup timing probe, the results are logged and written to
+#   ${logs}/omni.galaxy.example.startup.json so the cost can be tracked
+import os
+import sys
+import json
+import time
+import importlib.util
+
+import carb
+import carb.tokens
+import omni.kit.app
+import omni.kit.test
+
+import omni.galaxy.example.window
+
+# Generous upper limit on importing the extension afresh, it should not
+# need to load anything beyond omni.ui and this extension
+IMPORT_BUDGET_S = 0.5
+
+# The extension is imported again under this name, so none of its own
+# modules are cached while Kit and omni.ui are there as they are at startup
+PROBE_PACKAGE = "omni_galaxy_example_startup_probe"
+
+
+def _fresh_import():
+    """
+    Imports the extension package (and with it the window module) in this
+    process under a new name, returns the time taken and the modules it loaded
+    """
+    package_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    spec = importlib.util.spec_from_file_location(
+        PROBE_PACKAGE, os.path.join(package_dir, "__init__.py"), submodule_search_locations=[package_dir]
+    )
+    before = set(sys.modules)
+    sys.modules[PROBE_PACKAGE] = importlib.util.module_from_spec(spec)
+    try:
+        start = time.perf_counter()
+        spec.loader.exec_module(sys.modules[PROBE_PACKAGE])
+        import_s = time.perf_counter() - start
+        loaded = sorted(set(sys.modules) - before)
+    finally:
+        for name in set(sys.modules) - before:
+            if name.split(".")[0] == PROBE_PACKAGE:
+                del sys.modules[name]
+    return {"window_import_s": import_s, "loaded": loaded}
+
+
+class TestStartup(omni.kit.test.AsyncTestCase):
+
+    async def test_galaxy_api_not_imported_at_startup(self):
+        # The extension is enabled (and its window shown) before the tests
+        # run, nothing has talked to Galaxy yet
+        self.assertNotIn("helper_functs", sys.modules)
+        self.assertNotIn("bioblend", sys.modules)
+
+    async def test_startup_timing_probe(self):
+        probe = _fresh_import()
+
+        start = time.perf_counter()
+        window = omni.galaxy.example.window.Window("Startup Probe", width=300, height=365)
+        await omni.kit.app.get_app().next_update_async()
+        build_s = time.perf_counter() - start
+        window.destroy()
+
+        results = {"window_import_s": probe["window_import_s"], "window_build_s": build_s}
+        carb.log_warn(f"omni.galaxy.example startup: {json.dumps(results)}")
+        logs = carb.tokens.get_tokens_interface().resolve("${logs}")
+        with open(f"{logs}/omni.galaxy.example.startup.json", "w") as f_write:
+            json.dump(results, f_write)
+        with open(f"{logs}/omni.galaxy.example.startup_modules.txt", "w") as f_write:
+            f_write.write("\n".join(probe["loaded"]))
+
+        # A fresh import must not pull in the Galaxy api either
+        self.assertNotIn("helper_functs", probe["loaded"])
+        self.assertNotIn("bioblend", probe["loaded"])
+        self.assertIn(f"{PROBE_PACKAGE}.window", probe["loaded"])
+        self.assertLess(probe["window_import_s"], IMPORT_BUDGET_S)
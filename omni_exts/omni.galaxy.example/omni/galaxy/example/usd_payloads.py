@@ -0,0 +1,411 @@
+"""
+Payload based USD import, large reactor outputs are brought into the stage
+one component at a time instead of as a single reference.
+
+Each mesh in an imported file is written once to a content hashed layer in
+omni-data/layers (write_component_layers), so a coil or vessel that is the
+same in several runs is stored and loaded once. In the stage every distinct
+component becomes a class prim under /GalaxyComponents, which carries the
+payload to its shared layer and a LOD variant set (full / decimated /
+proxy). The components of each imported file are instanceable prims under
+/<basename> that reference those classes, so rigid copies within a run (TF
+coils, identical PF coils) and unchanged components across runs all share
+one prototype. Components can be loaded and unloaded individually.
+"""
+import os
+import json
+import hashlib
+import threading
+
+import numpy as np
+import carb  # pylint: disable=import-error
+import omni.usd  # pylint: disable=import-error
+from pxr import Gf, Sdf, Tf, Usd, UsdGeom, Vt  # pylint: disable=import-error
+
+from .local_data import layers_path, manifests_path, layers_lock
+
+# Components whose vertices line up to within this fraction of their size
+# after a rigid transform are treated as copies of each other
+INSTANCE_TOLERANCE = 1e-5
+# Number of clustering cells along the longest side of a decimated component
+LOD_CELLS = 32
+LOD_VARIANT_SET = "LOD"
+# Classes for the distinct components of every imported file live here
+COMPONENTS_ROOT = Sdf.Path("/GalaxyComponents")
+# Bumped when the layout of the component layers changes
+LAYER_VERSION = 1
+
+
+def import_USD_payloads(path_to_import, load=False, instance=True, lod=True):
+    """
+    Imports a USD file as one payload per component under /<basename>
+
+    Args:
+        path_to_import (string): USD file to import
+        load (bool): Load the payloads straight away, otherwise they are
+            left unloaded until requested with load_prims
+        instance (bool): Make the components instanceable so copies share
+            a prototype, within this file and with earlier imports
+        lod (bool): Author a LOD variant set on each distinct component
+
+    Returns:
+        root_path (Sdf.Path): Path of the prim the components live under
+    """
+    stage = omni.usd.get_context().get_stage()
+    components = write_component_layers(path_to_import)
+
+    # Runs of the same workflow share file names, keep each import separate
+    basename = os.path.splitext(os.path.basename(path_to_import))[0]
+    used_roots = {prim.GetName() for prim in stage.GetPseudoRoot().GetChildren()}
+    root_path = Sdf.Path.absoluteRootPath.AppendChild(_unique_name(basename, used_roots))
+    UsdGeom.Xform.Define(stage, root_path)
+
+    if not components:
+        carb.log_warn(f"No meshes found in {path_to_import}, adding as a single payload")
+        stage.GetPrimAtPath(root_path).GetPayloads().AddPayload(path_to_import)
+        if not load:
+            stage.Unload(root_path)
+        return root_path
+
+    new_classes = []
+    used_names = set()
+    for component in components:
+        class_path = _component_class_path(component["hash"])
+        if not stage.GetPrimAtPath(class_path):
+            _define_component_class(stage, class_path, component, lod)
+            new_classes.append(class_path)
+
+        name = _unique_name(component["name"], used_names)
+        prim = stage.DefinePrim(root_path.AppendChild(name), "Xform")
+        # The class holds the mesh in its own frame, this transform places
+        # it where the component sits in the source file
+        UsdGeom.Xformable(prim).ClearXformOpOrder()
+        UsdGeom.Xformable(prim).AddTransformOp().Set(Gf.Matrix4d(component["transform"]))
+        prim.GetReferences().AddInternalReference(class_path)
+        if instance:
+            prim.SetInstanceable(True)
+
+    distinct = len({component["hash"] for component in components})
+    carb.log_info(
+        f"Imported {len(components)} components from {path_to_import} as payloads, "
+        f"{distinct} distinct, {len(new_classes)} not seen in earlier imports"
+    )
+
+    if not load:
+        for class_path in new_classes:
+            stage.Unload(class_path)
+        stage.Unload(root_path)
+    return root_path
+
+
+def load_prims(prim_paths):
+    """Loads the payloads at and below each of the given prim paths"""
+    stage = omni.usd.get_context().get_stage()
+    for prim_path in prim_paths:
+        stage.Load(prim_path)
+
+
+def unload_prims(prim_paths):
+    """Unloads the payloads at and below each of the given prim paths"""
+    stage = omni.usd.get_context().get_stage()
+    for prim_path in prim_paths:
+        stage.Unload(prim_path)
+
+
+def write_component_layers(path_to_import):
+    """
+    Splits a USD file into one content hashed layer per distinct component
+    in omni-data/layers, layers that already exist (from this or another
+    run) are not written again. The result is kept in a manifest and reused
+    while the source file is unchanged.
+
+    Returns:
+        components (list of dicts): name, hash and transform (row major
+            4x4 nested lists) of every mesh in the file, plus lower / upper
+            bounds of the mesh in its own frame
+    """
+    with layers_lock:
+        return _write_component_layers(os.path.abspath(path_to_import))
+
+
+def _write_component_layers(path_to_import):
+    manifest_path = os.path.join(
+        manifests_path, hashlib.sha1(path_to_import.encode()).hexdigest() + ".json"
+    )
+    mtime = os.path.getmtime(path_to_import)
+    if os.path.exists(manifest_path):
+        with open(manifest_path, 'r') as file:
+            manifest = json.load(file)
+        if manifest.get("mtime") == mtime and manifest.get("version") == LAYER_VERSION:
+            return manifest["components"]
+
+    components = _find_components(Usd.Stage.Open(path_to_import))
+    entries = []
+    for group in _group_components(components):
+        prototype = group[0][0]
+        digest = _write_component_layer(prototype)
+        points = _transform_points(prototype["points"], prototype["local"])
+        lower, upper = points.min(axis=0).tolist(), points.max(axis=0).tolist()
+        for component, alignment in group:
+            transform = prototype["parent"] if alignment is None else prototype["parent"] * alignment
+            entries.append({
+                "name": component["name"],
+                "hash": digest,
+                "transform": [list(row) for row in transform],
+                "lower": lower,
+                "upper": upper,
+            })
+
+    os.makedirs(manifests_path, exist_ok=True)
+    manifest = {"source": path_to_import, "mtime": mtime, "version": LAYER_VERSION, "components": entries}
+    tmp_path = f"{manifest_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'w') as file:
+        json.dump(manifest, file)
+    os.replace(tmp_path, manifest_path)
+    return entries
+
+
+def component_layer_paths(digest):
+    """Full and decimated layer of a component, by content hash"""
+    return (
+        os.path.join(layers_path, f"{digest}.usdc"),
+        os.path.join(layers_path, f"{digest}.lod.usdc"),
+    )
+
+
+def _component_hash(component):
+    """Hash of everything written to a component's layer"""
+    key = hashlib.sha256()
+    key.update(str(LAYER_VERSION).encode())
+    key.update(component["counts"].astype(np.int32).tobytes())
+    key.update(component["indices"].astype(np.int32).tobytes())
+    key.update(component["points"].astype(np.float32).tobytes())
+    key.update(np.array(component["local"], dtype=np.float64).tobytes())
+    return key.hexdigest()
+
+
+def _write_component_layer(component):
+    """Writes the full and decimated layers of a component unless they exist"""
+    digest = _component_hash(component)
+    full_path, lod_path = component_layer_paths(digest)
+    if os.path.exists(full_path) and os.path.exists(lod_path):
+        return digest
+
+    os.makedirs(layers_path, exist_ok=True)
+    decimated = _decimate(component["points"], component["counts"], component["indices"])
+    for layer_path, (points, counts, indices) in (
+        (full_path, (component["points"], component["counts"], component["indices"])),
+        (lod_path, decimated),
+    ):
+        layer_stage = Usd.Stage.CreateInMemory()
+        mesh = UsdGeom.Mesh.Define(layer_stage, "/Component")
+        mesh.GetPointsAttr().Set(Vt.Vec3fArray.FromNumpy(points.astype(np.float32)))
+        mesh.GetFaceVertexCountsAttr().Set(Vt.IntArray.FromNumpy(counts.astype(np.int32)))
+        mesh.GetFaceVertexIndicesAttr().Set(Vt.IntArray.FromNumpy(indices.astype(np.int32)))
+        mesh.AddTransformOp().Set(component["local"])
+        layer_stage.SetDefaultPrim(mesh.GetPrim())
+        # Written under a temporary name so that a concurrent import never
+        # opens a half written layer, the extension keeps the usdc format
+        tmp_path = f"{layer_path[:-len('.usdc')]}.{os.getpid()}.{threading.get_ident()}.tmp.usdc"
+        layer_stage.GetRootLayer().Export(tmp_path)
+        os.replace(tmp_path, layer_path)
+    return digest
+
+
+def _component_class_path(digest):
+    return COMPONENTS_ROOT.AppendChild(f"C_{digest[:16]}")
+
+
+def _define_component_class(stage, class_path, component, lod):
+    """Defines the class prim every copy of a component references"""
+    if not stage.GetPrimAtPath(COMPONENTS_ROOT):
+        stage.DefinePrim(COMPONENTS_ROOT, "Scope")
+    prim = stage.CreateClassPrim(class_path)
+    prim.SetTypeName("Xform")
+
+    full_path, lod_path = component_layer_paths(component["hash"])
+    if not lod:
+        _add_geom_payload(prim, full_path)
+        return prim
+
+    variant_set = prim.GetVariantSets().AddVariantSet(LOD_VARIANT_SET)
+
+    variant_set.AddVariant("full")
+    variant_set.SetVariantSelection("full")
+    with variant_set.GetVariantEditContext():
+        _add_geom_payload(prim, full_path)
+
+    variant_set.AddVariant("decimated")
+    variant_set.SetVariantSelection("decimated")
+    with variant_set.GetVariantEditContext():
+        _add_geom_payload(prim, lod_path)
+
+    # The proxy is a box matching the component's extent in its own frame
+    variant_set.AddVariant("proxy")
+    variant_set.SetVariantSelection("proxy")
+    with variant_set.GetVariantEditContext():
+        lower = np.array(component["lower"])
+        upper = np.array(component["upper"])
+        cube = UsdGeom.Cube.Define(stage, class_path.AppendChild("proxy"))
+        cube.GetSizeAttr().Set(1.0)
+        cube.AddTranslateOp().Set(Gf.Vec3d(*((lower + upper) / 2)))
+        cube.AddScaleOp().Set(Gf.Vec3f(*np.maximum(upper - lower, 1e-6)))
+        cube.GetPurposeAttr().Set(UsdGeom.Tokens.proxy)
+
+    variant_set.SetVariantSelection("full")
+    return prim
+
+
+def _add_geom_payload(prim, asset_path):
+    """
+    Adds the payload as a typeless child so that the mesh's own type and
+    transform come from the payload
+    """
+    geom = prim.GetStage().DefinePrim(prim.GetPath().AppendChild("geom"))
+    geom.GetPayloads().AddPayload(asset_path)
+
+
+def _find_components(source):
+    """Collects the meshes of the source stage along with their geometry"""
+    components = []
+    for prim in source.Traverse():
+        if not prim.IsA(UsdGeom.Mesh):
+            continue
+        mesh = UsdGeom.Mesh(prim)
+        points = mesh.GetPointsAttr().Get()
+        counts = mesh.GetFaceVertexCountsAttr().Get()
+        indices = mesh.GetFaceVertexIndicesAttr().Get()
+        if not points or not counts or not indices:
+            continue
+        xformable = UsdGeom.Xformable(prim)
+        parent = xformable.ComputeParentToWorldTransform(Usd.TimeCode.Default())
+        local = xformable.GetLocalTransformation(Usd.TimeCode.Default())
+        points = np.asarray(points, dtype=float)
+        components.append({
+            "name": prim.GetName(),
+            "path": prim.GetPath(),
+            "parent": parent,
+            "local": local,
+            "counts": np.asarray(counts, dtype=np.int64),
+            "indices": np.asarray(indices, dtype=np.int64),
+            "points": points,
+            "world_points": _transform_points(points, local * parent),
+        })
+    return components
+
+
+def _transform_points(points, matrix):
+    """Applies a Gf.Matrix4d (row vector convention) to an (n, 3) array"""
+    mat = np.array(matrix, dtype=float).reshape(4, 4)
+    return points @ mat[:3, :3] + mat[3, :3]
+
+
+def _signature(component):
+    """Hash that is equal for components that may be rigid copies"""
+    points = component["world_points"]
+    radii = np.sort(np.linalg.norm(points - points.mean(axis=0), axis=1))
+    scale = max(radii[-1], 1e-12)
+    key = hashlib.sha1()
+    key.update(component["counts"].tobytes())
+    key.update(component["indices"].tobytes())
+    key.update(np.round(radii.sum() / scale / len(radii), 3).tobytes())
+    return key.hexdigest()
+
+
+def _rigid_alignment(source, target):
+    """
+    Finds the rigid transform taking the source points onto the target
+    points (matched by index), None if they are not rigid copies
+
+    Returns:
+        alignment (Gf.Matrix4d): Row vector transform, target = source * alignment
+    """
+    source_centre = source.mean(axis=0)
+    target_centre = target.mean(axis=0)
+    cov = (source - source_centre).T @ (target - target_centre)
+    u, _, vt = np.linalg.svd(cov)
+    flip = np.sign(np.linalg.det(vt.T @ u.T))
+    rot = vt.T @ np.diag([1.0, 1.0, flip]) @ u.T
+    shift = target_centre - rot @ source_centre
+
+    error = np.abs(source @ rot.T + shift - target).max()
+    size = np.abs(target - target_centre).max()
+    if error > INSTANCE_TOLERANCE * max(size, 1e-12):
+        return None
+
+    mat = np.identity(4)
+    mat[:3, :3] = rot.T
+    mat[3, :3] = shift
+    return Gf.Matrix4d(mat.tolist())
+
+
+def _group_components(components):
+    """
+    Splits the components into groups of rigid copies, each entry is
+    (component, alignment from the group's first component or None)
+    """
+    candidates = {}
+    for component in components:
+        candidates.setdefault(_signature(component), []).append(component)
+
+    groups = []
+    for same_signature in candidates.values():
+        while same_signature:
+            prototype = same_signature.pop(0)
+            group = [(prototype, None)]
+            remaining = []
+            for component in same_signature:
+                alignment = _rigid_alignment(prototype["world_points"], component["world_points"])
+                if alignment is None:
+                    remaining.append(component)
+                else:
+                    group.append((component, alignment))
+            same_signature = remaining
+            groups.append(group)
+    return groups
+
+
+def _unique_name(name, used_names):
+    name = Tf.MakeValidIdentifier(name)
+    candidate = name
+    count = 1
+    while candidate in used_names:
+        candidate = f"{name}_{count}"
+        count += 1
+    used_names.add(candidate)
+    return candidate
+
+
+def _decimate(points, counts, indices, cells=LOD_CELLS):
+    """
+    Vertex clustering decimation, every vertex is snapped to the mean of the
+    vertices in its grid cell and triangles that collapse are dropped
+    """
+    lower = points.min(axis=0)
+    size = max((points.max(axis=0) - lower).max() / cells, 1e-12)
+    keys = np.floor((points - lower) / size).astype(np.int64)
+    _, cluster = np.unique(keys, axis=0, return_inverse=True)
+    cluster = cluster.reshape(-1)
+    n_clusters = cluster.max() + 1
+    new_points = np.zeros((n_clusters, 3))
+    np.add.at(new_points, cluster, points)
+    new_points /= np.bincount(cluster, minlength=n_clusters)[:, None]
+
+    # Fan triangulate every face: (s, s + k, s + k + 1) for k = 1 .. n - 2
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    n_tris = np.maximum(counts - 2, 0)
+    tri_start = np.repeat(starts, n_tris)
+    tri_k = np.arange(n_tris.sum()) - np.repeat(np.cumsum(n_tris) - n_tris, n_tris) + 1
+    tris = np.stack((
+        indices[tri_start],
+        indices[tri_start + tri_k],
+        indices[tri_start + tri_k + 1],
+    ), axis=1)
+    tris = cluster[tris]
+
+    keep = (tris[:, 0] != tris[:, 1]) & (tris[:, 1] != tris[:, 2]) & (tris[:, 0] != tris[:, 2])
+    tris = tris[keep]
+    _, first = np.unique(np.sort(tris, axis=1), axis=0, return_index=True)
+    tris = tris[np.sort(first)]
+
+    return new_points, np.full(len(tris), 3, dtype=np.int64), tris.reshape(-1)
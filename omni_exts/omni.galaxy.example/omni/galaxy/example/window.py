@@ -1,59 +1,141 @@
 __all__ = ["Window"]
 
-# Add the api helper functions to the python path
 import sys
 import os
 import json
 import asyncio
 import uuid
 import shutil
+import zipfile
 from typing import List
 
 
 import carb  # pylint: disable=import-error
 import omni.ui as ui  # pylint: disable=import-error
-from omni.kit.window.file_importer import get_file_importer  # pylint: disable=import-error
-from .ui_helpers import MinimalModel, import_USD, add_uid_to_prov
+import omni.usd  # pylint: disable=import-error
+from .ui_helpers import MinimalModel, import_USD
+from .file_preview import read_file_window, pretty_json_chunk
+from .local_data import add_uid_to_prov, touch_run, set_run_kept, is_run_kept, run_sizes, enforce_budget
 
 current_path = os.path.dirname(os.path.abspath(__file__))
 parent_path = current_path.split('omni_exts')[0]
 api_path = os.path.join(parent_path, "galaxy-api")
+field_to_usd_path = os.path.join(parent_path, "galaxy-tools", "nttau", "field_to_usd")
 data_path = os.path.join(parent_path, "omni-data")
-sys.path.append(api_path)
 
-from helper_functs import launch_workflow, get_workflows, get_inputs, get_outputs # pylint: disable=import-error
+# Suffix helper_functs gives downloads that are still in progress, kept
+# here so that listing files does not need the galaxy api
+PARTIAL_SUFFIX = ".partial"
 
 LABEL_WIDTH = 50
 HEIGHT = 300
 SPACING = 4
 
+# Text outputs that are shown page by page in the File Manager preview
+PREVIEW_EXTENSIONS = (".json", ".txt", ".out")
+
+# Header magnetic_field_calc writes, csv outputs starting with it are
+# converted to arrow glyphs instead of being reported as unsupported
+FIELD_MAP_HEADER = "x,y,z,Bx,By,Bz"
+# Binary field maps, an npz needs the arrays magnetic_field_calc writes
+FIELD_MAP_EXTENSIONS = (".csv", ".npz", ".vti", ".h5")
+FIELD_MAP_NPZ_ARRAYS = {"origin.npy", "spacing.npy", "shape.npy", "B.npy"}
+# Arrows in a field map pulled into the stage, the map is averaged down to this
+FIELD_MAP_MAX_ARROWS = 50000
+
+# Dataset inputs set to "stage:<format>:<prim path>,..." are serialized from
+# the open stage when the workflow is launched and uploaded from memory, in
+# one of stage_export.STAGE_EXPORT_FORMATS
+STAGE_INPUT_PREFIX = "stage:"
+
+# Ways a USD output can be brought into the stage from the File Manager
+USD_IMPORT_MODES = ["Reference", "Payload (deferred)"]
+
 path = os.path.join(current_path, "default.json")
 
-if os.path.exists(path):
-    carb.log_info(f"Loading default settings from {path}")
-    with open(path) as f_read:
-        default = json.load(f_read)
-else:
-    carb.log_info(f"Could not find {path}, using hardcoded defaults")
-    default = {
-        "galaxy_server": "localhost:8080",
-        "galaxy_api_key": "",
-        "workflow_idx": 0,
-        "workflow_inputs": {},
-        "selected_folder_idx": 0,
-        "selected_file_idx": 0,
-        "local_file_selector": 0,
-    }
+# Hardcoded defaults, default.json is read over these the first time a
+# window is built (see _load_default) rather than when the module loads
+default = {
+    "galaxy_server": "localhost:8080",
+    "galaxy_api_key": "",
+    "workflow_idx": 0,
+    "workflow_inputs": {},
+    "selected_folder_idx": 0,
+    "selected_file_idx": 0,
+    "local_file_selector": 0,
+    "stage_input_format": 0,
+    "usd_import_mode": 0,
+    "usd_lod_variants": True,
+    "live_usd_import": True,
+    "data_budget_gb": 0.0,
+}
+
+default_loaded = False
 
 
 collapsible_frames_default = {
     "Server Settings": True,
     "Workflow Message Composer": False,
     "File Manager": True,
-    "WARNING": True,
+    "Local Data": True,
 }
 
 
+def _load_default():
+    """Reads default.json into the settings the first time it is needed"""
+    global default_loaded
+
+    if default_loaded:
+        return
+    default_loaded = True
+
+    if os.path.exists(path):
+        carb.log_info(f"Loading default settings from {path}")
+        with open(path) as f_read:
+            # Settings files written before newer options existed keep the
+            # hardcoded value for those options
+            default.update(json.load(f_read))
+    else:
+        carb.log_info(f"Could not find {path}, using hardcoded defaults")
+
+
+def _galaxy_api():
+    """
+    Imports the galaxy-api helper functions (and with them bioblend) the
+    first time the extension talks to Galaxy, not when it is enabled
+    """
+    if api_path not in sys.path:
+        sys.path.append(api_path)
+    import helper_functs  # pylint: disable=import-error
+    return helper_functs
+
+
+def _field_to_usd():
+    """Imports the field_to_usd Galaxy tool the first time a field map is pulled"""
+    if field_to_usd_path not in sys.path:
+        sys.path.append(field_to_usd_path)
+    import field_to_usd  # pylint: disable=import-error
+    return field_to_usd
+
+
+def _is_field_map(file_path):
+    ext = os.path.splitext(file_path)[-1]
+    if ext not in FIELD_MAP_EXTENSIONS:
+        return False
+    if ext == ".npz":
+        with zipfile.ZipFile(file_path) as archive:
+            return FIELD_MAP_NPZ_ARRAYS.issubset(archive.namelist())
+    if ext == ".vti":
+        with open(file_path, 'rb') as f_read:
+            return b'Name="B"' in f_read.read(4096)
+    if ext == ".h5":
+        # Any other h5 fails in field_to_usd and is reported there
+        return True
+    with open(file_path, 'r') as f_read:
+        header = f_read.readline().replace(" ", "").strip()
+    return header.startswith(FIELD_MAP_HEADER)
+
+
 def fire_and_forget(f):
     '''To wrap a function for a fire and forget call.'''
     def wrapped(*args, **kwargs):
@@ -84,6 +166,14 @@ class Window(ui.Window):
     output_field = None
     output_prev_commands = ""
 
+    usage_label = None
+    keep_model = None
+
+    # State of the paged file preview, None when no file is being previewed
+    preview = None
+    preview_field = None
+    preview_label = None
+
     def __init__(self, title: str, delegate=None, **kwargs):
         self.__label_width = LABEL_WIDTH
 
@@ -113,7 +203,9 @@ class Window(ui.Window):
     ##################################
 
     def _build_main(self):
-        if not self.initial_build:
+        if self.initial_build:
+            _load_default()
+        else:
             self._write_settings()
 
         # Build the widgets of the Run group
@@ -141,9 +233,9 @@ class Window(ui.Window):
 
         ui.Button("Clear", clicked_fn=lambda: self._clear_print())
 
-        with self._build_frame("WARNING"):
+        with self._build_frame("Local Data"):
             with ui.VStack(height=0, spacing=SPACING):
-                self._build_warning()
+                self._build_local_data()
 
         self.initial_build = False
 
@@ -156,6 +248,8 @@ class Window(ui.Window):
                 default[key] = value.get_value_as_int()
             elif val_type is ui._ui.SimpleFloatModel:
                 default[key] = value.get_value_as_float()
+            elif val_type is ui._ui.SimpleBoolModel:
+                default[key] = value.get_value_as_bool()
             elif val_type is dict:
                 for sub_key, sub_value in value.items():
                     try:
@@ -234,6 +328,19 @@ class Window(ui.Window):
                 self.settings["local_file_selector"].set_model_state(default["local_file_selector"])
                 ui.ComboBox(self.settings["local_file_selector"])
                 ui.Button("Select File", clicked_fn=lambda: self._get_fname_from_explorer())
+            with ui.HStack(height=0, spacing=SPACING):
+                # Imported here like serialize_prims, stage_export needs numpy
+                from .stage_export import STAGE_EXPORT_FORMATS
+
+                self.settings["stage_input_format"] = MinimalModel(list(STAGE_EXPORT_FORMATS))
+                self.settings["stage_input_format"].set_model_state(default["stage_input_format"])
+                ui.ComboBox(self.settings["stage_input_format"])
+                ui.Button("Use Selected Prims", clicked_fn=lambda: self._use_selected_prims())
+
+        with ui.HStack(height=0, spacing=SPACING):
+            ui.Label("Import USD Outputs As Steps Finish:")
+            self.settings["live_usd_import"] = ui.SimpleBoolModel(default["live_usd_import"])
+            ui.CheckBox(self.settings["live_usd_import"])
 
         # Only want launch_workflow when we have the inputs
         ui.Button("Launch Workflow", clicked_fn=lambda: self._launch_workflow())
@@ -247,6 +354,11 @@ class Window(ui.Window):
 
         carb.log_info(f"Folders: {list(self.folders.values())}")
 
+        # Runs may have been evicted since the selection was saved
+        if default["selected_folder_idx"] >= len(self.folders):
+            default["selected_folder_idx"] = 0
+            default["selected_file_idx"] = 0
+
         ui.Label("Folders:")
         self.settings["selected_folder_idx"] = MinimalModel(list(self.folders.values()))
         self.settings["selected_folder_idx"].set_model_state(default["selected_folder_idx"])
@@ -262,17 +374,76 @@ class Window(ui.Window):
         self.settings["selected_file_idx"].set_model_state(default["selected_file_idx"])
         ui.ComboBox(self.settings["selected_file_idx"])
 
+        ui.Label("USD Import Mode:")
+        with ui.HStack(height=0, spacing=SPACING):
+            self.settings["usd_import_mode"] = MinimalModel(USD_IMPORT_MODES)
+            self.settings["usd_import_mode"].set_model_state(default["usd_import_mode"])
+            ui.ComboBox(self.settings["usd_import_mode"])
+            ui.Label("LOD Variants:")
+            self.settings["usd_lod_variants"] = ui.SimpleBoolModel(default["usd_lod_variants"])
+            ui.CheckBox(self.settings["usd_lod_variants"])
+
+        with ui.HStack(height=0, spacing=SPACING):
+            ui.Label("Keep This Run (never evicted):")
+            self.keep_model = ui.SimpleBoolModel(is_run_kept(self._selected_uid()))
+            self.keep_model.add_value_changed_fn(lambda model: self._set_run_kept(model))
+            ui.CheckBox(self.keep_model)
+        # The checkbox follows the run picked in the Folders combobox
+        self.settings["selected_folder_idx"].get_item_value_model(None, 1).add_value_changed_fn(
+            lambda _: self.keep_model.set_value(is_run_kept(self._selected_uid()))
+        )
+
         ui.Button("Pull File", clicked_fn=lambda: self._pull_file(
             self.settings["selected_folder_idx"].get_item_value_model(None, 1).get_value_as_int(),
             self.settings["selected_file_idx"].get_item_value_model(None, 1).get_value_as_int()
         ))
 
-    def _build_warning(self):
+        with ui.HStack(height=0, spacing=SPACING):
+            ui.Button("Load Selected Prims", clicked_fn=lambda: self._load_selected(True))
+            ui.Button("Unload Selected Prims", clicked_fn=lambda: self._load_selected(False))
+
+        if self.preview is not None:
+            self._build_preview()
+
+    def _selected_uid(self):
+        """uid of the run currently picked in the Folders combobox"""
+        folder_idx = self.settings["selected_folder_idx"].get_item_value_model(None, 1).get_value_as_int()
+        return list(self.folders.keys())[folder_idx]
+
+    def _set_run_kept(self, model):
+        uid = self._selected_uid()
+        keep = model.get_value_as_bool()
+        # Also called when the checkbox is refreshed for a newly picked run
+        if keep != is_run_kept(uid):
+            set_run_kept(uid, keep)
+
+    def _build_preview(self):
+        ui.Label(f"Preview of {self.preview['file']} from {self.preview['uid']}:")
+        self.preview_label = ui.Label(self._preview_status())
+        with ui.HStack(height=0, spacing=SPACING):
+            ui.Button("Previous Page", clicked_fn=lambda: self._preview_page(-1))
+            ui.Button("Next Page", clicked_fn=lambda: self._preview_page(1))
+            ui.Button("Close Preview", clicked_fn=lambda: self._close_preview())
+        preview_string_model = ui.SimpleStringModel(self.preview["text"])
+        self.preview_field = ui.StringField(
+            preview_string_model,
+            height=HEIGHT,
+            multiline=True,
+            read_only=True).model
+
+    def _build_local_data(self):
+        with ui.HStack(height=0, spacing=SPACING):
+            ui.Label("Disk Budget (GB, 0 for no limit):")
+            self.settings["data_budget_gb"] = ui.FloatField().model
+            self.settings["data_budget_gb"].set_value(default["data_budget_gb"])
         ui.Label(
-            "WARNING - This will clear all local simulation data - use with caution!",
-            width=self.label_width
+            "Least recently used runs are deleted once the budget is exceeded, "
+            "runs marked as kept never are.",
+            word_wrap=True
         )
-        ui.Button("Clear Local Data", clicked_fn=lambda: self._clear_local_data())
+        self.usage_label = ui.Label("Disk usage: calculating...")
+        ui.Button("Apply Budget Now", clicked_fn=lambda: self._async_evict(self._data_budget_bytes()))
+        self._async_update_usage()
 
     def _build_frame(self, frame_name):
         """To Build a Collapsable Frame"""
@@ -309,7 +480,7 @@ class Window(ui.Window):
         server = self.settings["galaxy_server"].get_value_as_string()
         api_key = self.settings["galaxy_api_key"].get_value_as_string()
 
-        self.workflows = get_workflows(server, api_key)
+        self.workflows = _galaxy_api().get_workflows(server, api_key)
         self._new_print(f"Workflows: {self.workflows}")
         self._refresh_screen()
 
@@ -322,7 +493,7 @@ class Window(ui.Window):
 
         self.workflow_inputs = []
 
-        for input_type, name, step_id in get_inputs(server, api_key, workflow):
+        for input_type, name, step_id in _galaxy_api().get_inputs(server, api_key, workflow):
             carb.log_info(f"Input: {input_type}, {name}, {step_id}")
             self.workflow_inputs.append((input_type, name))
         self._new_print(f"Inputs: {self.workflow_inputs}")
@@ -335,7 +506,7 @@ class Window(ui.Window):
         wf_idx = self.settings["workflow_idx"].get_item_value_model(None, 1).get_value_as_int()
         workflow = self.workflows[wf_idx]
 
-        self.workflow_outputs = get_outputs(server, api_key, workflow)
+        self.workflow_outputs = _galaxy_api().get_outputs(server, api_key, workflow)
         self._new_print(f"Outputs: {self.workflow_outputs}")
         self._refresh_screen()
 
@@ -353,8 +524,30 @@ class Window(ui.Window):
             value = self.settings["workflow_inputs"][input_name].get_value_as_string()
             inputs[input_name] = value
 
-        self._new_print(f"Launching workflow {workflow} with inputs {inputs}")
-        self._async_launch(server, api_key, workflow, inputs)
+        # Serialized now so the upload matches the stage as it is at launch
+        shown_inputs = dict(inputs)
+        for input_name, value in inputs.items():
+            if not value.startswith(STAGE_INPUT_PREFIX):
+                continue
+            file_format, prim_paths = value[len(STAGE_INPUT_PREFIX):].split(":", 1)
+            from .stage_export import serialize_prims
+
+            content, file_type = serialize_prims(prim_paths.split(","), file_format)
+            inputs[input_name] = (content, file_type)
+            shown_inputs[input_name] = f"{value} ({len(content)} characters)"
+
+        # Stage edits have to happen on the main thread, the launch runs on a
+        # worker so it hands finished USD outputs back through this loop
+        live_import = self.settings["live_usd_import"].get_value_as_bool()
+        main_loop = asyncio.get_event_loop() if live_import else None
+        # Payload imports read shared component layers, those are written
+        # as each USD output arrives so the import itself stays quick
+        split_layers = self._usd_import_options()[0] != "Reference"
+
+        self._new_print(f"Launching workflow {workflow} with inputs {shown_inputs}")
+        self._async_launch(
+            server, api_key, workflow, inputs, main_loop, self._data_budget_bytes(), split_layers
+        )
         self._new_print("Workflow launched")
 
     def _new_print(self, console_text):
@@ -377,6 +570,9 @@ class Window(ui.Window):
     def _get_files(self, uid):
         self.files = []
         for file in os.listdir(data_path + os.sep + uid):
+            # Skip downloads that are still in progress
+            if file.endswith(PARTIAL_SUFFIX):
+                continue
             self.files.append(file)
 
     def _pull_file(self, uid_idx, file_idx):
@@ -384,57 +580,215 @@ class Window(ui.Window):
         file = self.files[file_idx]
 
         carb.log_info(f"Pulling {file} from {uid}")
+        touch_run(uid)
         file_path = data_path + os.sep + uid + os.sep + file
         if not os.path.exists(file_path):
             carb.log_error(f"File {file} does not exist in {uid}, try again and remeber to refresh!")
             return
         ext = os.path.splitext(file_path)[-1]
-        if ext == ".json":
-            with open(file_path) as f_read:
-                data = json.load(f_read)
-                nice_string = json.dumps(data, indent=4)
-                self._new_print(f"File {file} from {uid}:\n{nice_string}")
-        elif ext == ".txt":
-            with open(file_path) as f_read:
-                data = f_read.read()
-                self._new_print(f"File {file} from {uid}:\n{data}")
-        elif ext == ".out":
-            with open(file_path) as f_read:
-                data = f_read.read()
-                self._new_print(f"File {file} from {uid}:\n{data}")
+        if ext in PREVIEW_EXTENSIONS:
+            self._open_preview(uid, file, file_path)
         elif 'usd' in ext:
             carb.log_info(f"Opening {file_path}")
-            import_USD(file_path)
+            self._import_usd(file_path)
             # carb.log_error("USD File IO not yet implemented")
+        elif _is_field_map(file_path):
+            self._async_field_to_usd(file_path, asyncio.get_event_loop())
         else:
             carb.log_error(f"File type {ext} not yet implemented")
 
-    def _clear_local_data(self):
-        for uid in os.listdir(data_path):
-            shutil.rmtree(data_path + os.sep + uid)
+    def _usd_import_options(self):
+        # The File Manager options are not built until a run exists, so a
+        # live import of the first run falls back to the saved settings
+        if "usd_import_mode" in self.settings:
+            mode = self.settings["usd_import_mode"].get_item_value_model(None, 1).get_value_as_int()
+            lod = self.settings["usd_lod_variants"].get_value_as_bool()
+        else:
+            mode = default["usd_import_mode"]
+            lod = default["usd_lod_variants"]
+        return USD_IMPORT_MODES[mode], lod
+
+    def _import_usd(self, file_path):
+        mode, lod = self._usd_import_options()
+        if mode == "Reference":
+            import_USD(file_path)
+            return
+
+        # pxr and numpy are only needed once something is imported this way
+        from .usd_payloads import import_USD_payloads
+
+        root_path = import_USD_payloads(file_path, lod=lod)
+        self._new_print(
+            f"Imported {file_path} as unloaded payloads under {root_path}, "
+            "select components and use Load Selected Prims to bring them in"
+        )
 
     @fire_and_forget
-    def _async_launch(self, server, api_key, workflow, inputs):
-        uid = str(uuid.uuid4())
-        tempdir = launch_workflow(server, api_key, workflow, inputs, uid, True)
+    def _async_field_to_usd(self, file_path, main_loop):
+        """
+        Converts a field map to arrow glyphs next to the map and imports it,
+        an existing conversion is reused if it is newer than the map
+        """
+        usd_path = os.path.splitext(file_path)[0] + ".usdc"
+        if not os.path.exists(usd_path) or os.path.getmtime(usd_path) < os.path.getmtime(file_path):
+            self._new_print(f"Converting field map {file_path} to USD arrows")
+            try:
+                _field_to_usd().field_to_usd(file_path, usd_path, FIELD_MAP_MAX_ARROWS)
+            except Exception as e:
+                carb.log_error(f"Could not convert {file_path}: {e}")
+                return
+        main_loop.call_soon_threadsafe(self._import_usd, usd_path)
+
+    def _load_selected(self, load):
+        from .usd_payloads import load_prims, unload_prims
+
+        selected = omni.usd.get_context().get_selection().get_selected_prim_paths()
+        if not selected:
+            self._new_print("No prims selected")
+            return
+        if load:
+            load_prims(selected)
+        else:
+            unload_prims(selected)
+
+    def _open_preview(self, uid, file, file_path):
+        """
+        Starts a paged preview of a text output, only the first page is read
+        """
+        self.preview = {
+            "uid": uid,
+            "file": file,
+            "path": file_path,
+            "size": os.path.getsize(file_path),
+            "json": file_path.endswith(".json"),
+            "page": 0,
+            # Byte offset and pretty print state at the start of each page
+            # that has been read so far
+            "offsets": [0],
+            "states": [(0, False, False)],
+            "text": "Loading...",
+        }
+        self._refresh_screen()
+        self._async_preview(self.preview, 0)
+
+    def _preview_page(self, step):
+        preview = self.preview
+        if preview is None:
+            return
+        page = preview["page"] + step
+        if page < 0 or page >= len(preview["offsets"]):
+            return
+        if step > 0 and preview["offsets"][page] >= preview["size"]:
+            return
+        self._async_preview(preview, page)
+
+    def _preview_status(self):
+        preview = self.preview
+        page = preview["page"]
+        start = preview["offsets"][page]
+        end = preview["offsets"][page + 1] if page + 1 < len(preview["offsets"]) else start
+        return f"Page {page + 1}: bytes {start} to {end} of {preview['size']}"
+
+    def _close_preview(self):
+        self.preview = None
+        self.preview_field = None
+        self.preview_label = None
+        self._refresh_screen()
+
+    @fire_and_forget
+    def _async_preview(self, preview, page):
+        """
+        Reads one page of the previewed file off the UI thread, only that
+        window of the file is decoded and (for json) pretty printed
+        """
+        text, next_offset = read_file_window(preview["path"], preview["offsets"][page])
+        if preview["json"]:
+            text, state = pretty_json_chunk(text, preview["states"][page])
+            if page + 1 == len(preview["states"]):
+                preview["states"].append(state)
+        if page + 1 == len(preview["offsets"]):
+            preview["offsets"].append(next_offset)
+
+        preview["page"] = page
+        preview["text"] = text
+
+        # The preview may have been closed or replaced while reading
+        if preview is not self.preview or self.preview_field is None:
+            return
+        self.preview_field.set_value(text)
+        self.preview_label.text = self._preview_status()
+
+    def _data_budget_bytes(self):
+        if "data_budget_gb" in self.settings:
+            budget_gb = self.settings["data_budget_gb"].get_value_as_float()
+        else:
+            budget_gb = default["data_budget_gb"]
+        return int(budget_gb * 1024 ** 3)
 
-        self._new_print(f"Workflow {workflow} finished, saving outputs to: {data_path + os.sep + uid}")
+    def _evict(self, budget_bytes, protect=()):
+        evicted = enforce_budget(budget_bytes, protect)
+        if evicted:
+            self._new_print(f"Disk budget exceeded, removed least recently used runs: {evicted}")
+        self._update_usage()
 
-        if not os.path.exists(data_path):
-            os.mkdir(data_path)
+    @fire_and_forget
+    def _async_evict(self, budget_bytes):
+        self._evict(budget_bytes)
 
-        os.mkdir(data_path + os.sep + uid)
+    @fire_and_forget
+    def _async_update_usage(self):
+        self._update_usage()
 
-        for file_name in os.listdir(tempdir.name):
-            file = tempdir.name + os.sep + file_name
-            self._new_print(f"Saving file: {file}")
-            shutil.move(file, data_path + os.sep + uid + os.sep + file_name)
+    def _update_usage(self):
+        if self.usage_label is None:
+            return
+        usage_gb = sum(run_sizes().values()) / 1024 ** 3
+        self.usage_label.text = f"Disk usage: {usage_gb:.2f} GB"
 
-        add_uid_to_prov(uid, workflow)
-        tempdir.cleanup()
+    @fire_and_forget
+    def _async_launch(self, server, api_key, workflow, inputs, main_loop=None, budget_bytes=0,
+                      split_layers=False):
+        uid = str(uuid.uuid4())
+        run_path = data_path + os.sep + uid
+        os.makedirs(run_path)
+
+        saved_files = []
+
+        def on_download(file_path):
+            # The run shows up in the File Manager as soon as it has a file
+            if not saved_files:
+                add_uid_to_prov(uid, workflow)
+            saved_files.append(file_path)
+            self._new_print(f"Saved file: {file_path}")
+            # Already on a worker, so the eviction pass runs here too
+            touch_run(uid)
+            self._evict(budget_bytes, (uid,))
+
+            if 'usd' not in os.path.splitext(file_path)[-1]:
+                return
+            if split_layers:
+                from .usd_payloads import write_component_layers
+                write_component_layers(file_path)
+            # Bring geometry into the stage while later steps are still running
+            if main_loop is not None:
+                main_loop.call_soon_threadsafe(self._import_usd, file_path)
+
+        self._new_print(f"Saving outputs of workflow {workflow} to: {run_path}")
+        _galaxy_api().launch_workflow(
+            server, api_key, workflow, inputs, uid, True,
+            out_dir=run_path,
+            on_download=on_download
+        )
+
+        if not saved_files:
+            shutil.rmtree(run_path)
+            self._new_print(f"Workflow {workflow} did not return any outputs.")
+            return
         self._new_print(f'Workflow call finished.')
 
     def _get_fname_from_explorer(self):
+        from omni.kit.window.file_importer import get_file_importer  # pylint: disable=import-error
+
         name_idx = self.settings["local_file_selector"].get_item_value_model(None, 1).get_value_as_int()
         name = self.dataset_input_names[name_idx]
 
@@ -444,6 +798,24 @@ class Window(ui.Window):
             import_handler=self._import_handler
         )
 
+    def _use_selected_prims(self):
+        """Sets the chosen dataset input to the prims selected in the stage"""
+        selected = omni.usd.get_context().get_selection().get_selected_prim_paths()
+        if not selected:
+            self._new_print("No prims selected")
+            return
+
+        name_idx = self.settings["local_file_selector"].get_item_value_model(None, 1).get_value_as_int()
+        name = self.dataset_input_names[name_idx]
+        from .stage_export import STAGE_EXPORT_FORMATS
+
+        format_idx = self.settings["stage_input_format"].get_item_value_model(None, 1).get_value_as_int()
+        file_format = list(STAGE_EXPORT_FORMATS)[format_idx]
+        self.settings["workflow_inputs"][name].set_value(
+            f"{STAGE_INPUT_PREFIX}{file_format}:{','.join(selected)}"
+        )
+        self._refresh_screen()
+
     def _import_handler(self, filename: str, dirname: str, selections: List[str] = []):
         '''To import the file'''
         carb.log_info(f"> Import '{filename}' from '{dirname}' or selected files '{selections}'")
@@ -0,0 +1,103 @@
+"""
+Tests for the paged file preview, they do not need Kit. Run with
+
+    python -m pytest omni_exts/omni.galaxy.example/tests
+"""
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "omni", "galaxy", "example"))
+
+from file_preview import PREVIEW_PAGE_BYTES, pretty_json_chunk, read_file_window  # noqa: E402
+
+# A document with everything the pretty printer has to track inside strings
+DOCUMENT = {
+    "name": "run {1}, [a: b]",
+    "quote": 'say "hi", then \\ leave',
+    "nested": [{"x": 1.5, "y": [True, None, "\\\"}"]}, [], {}],
+    "unicode": "é€\U0001f600",
+}
+
+
+def _pages(path, max_bytes=PREVIEW_PAGE_BYTES):
+    """Every window of the file in turn, as the window pages through it"""
+    pages, offset = [], 0
+    while offset < os.path.getsize(path):
+        text, offset = read_file_window(path, offset, max_bytes)
+        pages.append(text)
+    return pages
+
+
+def test_character_split_at_the_page_boundary(tmp_path):
+    # A 2, 3 and 4 byte character straddling the end of the first page,
+    # with no line break in it
+    for char in ("é", "€", "\U0001f600"):
+        path = tmp_path/"split.txt"
+        text = "a"*(PREVIEW_PAGE_BYTES - 1) + char + "b"*10
+        path.write_bytes(text.encode("utf-8"))
+        first, next_offset = read_file_window(path)
+        assert first == "a"*(PREVIEW_PAGE_BYTES - 1) and next_offset == PREVIEW_PAGE_BYTES - 1
+        assert read_file_window(path, next_offset) == (char + "b"*10, len(text.encode("utf-8")))
+
+
+def test_pages_cut_at_line_ends(tmp_path):
+    path = tmp_path/"lines.txt"
+    text = "".join(f"line {i} é€\n" for i in range(20000))
+    path.write_bytes(text.encode("utf-8"))
+    pages = _pages(path)
+    assert len(pages) > 1 and "".join(pages) == text
+    assert all(page.endswith("\n") for page in pages)
+
+
+def test_window_with_no_newline(tmp_path):
+    # Whole characters are kept however the window falls
+    path = tmp_path/"one_line.txt"
+    text = "€\U0001f600x"*1000
+    path.write_bytes(text.encode("utf-8"))
+    for max_bytes in (5, 7, 64, 1000):
+        pages = _pages(path, max_bytes)
+        assert "".join(pages) == text
+        assert all("�" not in page for page in pages)
+
+    # ASCII fills the window exactly
+    path.write_bytes(b"x"*100)
+    assert read_file_window(path, 10, 32) == ("x"*32, 42)
+    assert read_file_window(path, 90, 32) == ("x"*10, 100)
+
+
+def test_pretty_json_one_piece():
+    pretty, state = pretty_json_chunk(json.dumps(DOCUMENT))
+    assert state == (0, False, False)
+    assert json.loads(pretty) == DOCUMENT
+    assert pretty.splitlines()[1] == '    "name": "run {1}, [a: b]",'
+
+
+@pytest.mark.parametrize("ensure_ascii", [True, False])
+def test_pretty_json_state_carried_across_pages(ensure_ascii):
+    text = json.dumps(DOCUMENT, ensure_ascii=ensure_ascii)
+    whole, _ = pretty_json_chunk(text)
+    # Split at every point, including inside strings and between a
+    # backslash and the character it escapes
+    for cut in range(1, len(text)):
+        first, state = pretty_json_chunk(text[:cut])
+        second, end = pretty_json_chunk(text[cut:], state)
+        assert first + second == whole, cut
+        assert end == (0, False, False)
+
+    inside_escape = text.index('\\"')
+    _, state = pretty_json_chunk(text[:inside_escape + 1])
+    assert state == (1, True, True)
+
+
+def test_pretty_json_pages_of_a_file(tmp_path):
+    path = tmp_path/"outputs.json"
+    document = [dict(DOCUMENT, index=i) for i in range(2000)]
+    path.write_text(json.dumps(document, ensure_ascii=False), encoding="utf-8")
+    pages, state = [], (0, False, False)
+    for text in _pages(path, 4096):
+        pretty, state = pretty_json_chunk(text, state)
+        pages.append(pretty)
+    assert json.loads("".join(pages)) == document
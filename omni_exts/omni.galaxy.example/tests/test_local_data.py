@@ -0,0 +1,137 @@
+"""
+Tests for the omni-data disk budget and layer collection, they do not
+need Kit. Run with
+
+    python -m pytest omni_exts/omni.galaxy.example/tests
+"""
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "omni", "galaxy", "example"))
+
+import local_data  # noqa: E402
+
+RUN_BYTES = 1000
+
+
+@pytest.fixture
+def data_path(tmp_path, monkeypatch):
+    """local_data pointed at an empty omni-data folder"""
+    monkeypatch.setattr(local_data, "data_path", str(tmp_path))
+    monkeypatch.setattr(local_data, "ACCESS_FILE", str(tmp_path/"uid_access.json"))
+    monkeypatch.setattr(local_data, "UID_TRACK_FILE", str(tmp_path/"uid_track.json"))
+    monkeypatch.setattr(local_data, "layers_path", str(tmp_path/"layers"))
+    monkeypatch.setattr(local_data, "manifests_path", str(tmp_path/"layers"/"manifests"))
+    return tmp_path
+
+
+def _add_runs(data_path, uids):
+    """Runs of RUN_BYTES each, used in the order given (first is oldest)"""
+    for uid in uids:
+        os.makedirs(data_path/uid/"outputs")
+        (data_path/uid/"outputs"/"field.vtu").write_bytes(b"x"*RUN_BYTES)
+        local_data.add_uid_to_prov(uid, "workflow")
+    local_data._write_access({uid: {"keep": False, "last_access": 1e9 + age} for age, uid in enumerate(uids)})
+
+
+def _tracked(data_path):
+    with open(data_path/"uid_track.json") as f_read:
+        return sorted(json.load(f_read))
+
+
+def test_least_recently_used_first(data_path):
+    _add_runs(data_path, ["a", "b", "c", "d"])
+    # b was used last of all
+    local_data.touch_run("b")
+    assert local_data.run_sizes() == dict.fromkeys("abcd", RUN_BYTES)
+    assert local_data.enforce_budget(4*RUN_BYTES) == []
+
+    assert local_data.enforce_budget(int(2.5*RUN_BYTES)) == ["a", "c"]
+    assert sorted(os.listdir(data_path)) == ["b", "d", "uid_access.json", "uid_track.json"]
+    # A budget of 0 is no limit
+    assert local_data.enforce_budget(0) == []
+
+
+def test_run_without_access_uses_folder_time(data_path):
+    _add_runs(data_path, ["a", "b"])
+    local_data._write_access({"a": {"keep": False, "last_access": 1e9}, "b": {"keep": False}})
+    os.utime(data_path/"b", (1.0, 1.0))
+    assert local_data.enforce_budget(RUN_BYTES) == ["b"]
+
+
+def test_kept_and_protected_runs_stay(data_path):
+    _add_runs(data_path, ["kept", "busy", "c", "d"])
+    local_data.set_run_kept("kept", True)
+    assert local_data.is_run_kept("kept") and not local_data.is_run_kept("c")
+
+    # Even with no room for anything, the kept and protected runs stay
+    assert local_data.enforce_budget(1, protect=["busy"]) == ["c", "d"]
+    assert os.path.isdir(data_path/"kept") and os.path.isdir(data_path/"busy")
+    assert local_data.enforce_budget(1, protect=["busy"]) == []
+
+    local_data.set_run_kept("kept", False)
+    assert local_data.enforce_budget(1, protect=["busy"]) == ["kept"]
+    assert os.path.isdir(data_path/"busy")
+
+
+def test_tracking_files_pruned(data_path):
+    _add_runs(data_path, ["a", "b", "c"])
+    assert _tracked(data_path) == ["a", "b", "c"]
+    assert local_data.enforce_budget(RUN_BYTES) == ["a", "b"]
+    assert _tracked(data_path) == ["c"]
+    assert list(local_data._read_access()) == ["c"]
+
+    # uids that are not tracked are passed over
+    local_data.remove_uids_from_prov(["c", "missing"])
+    assert _tracked(data_path) == []
+    assert local_data.run_sizes() == {}
+
+
+def _layer(data_path, digest, lod=False):
+    os.makedirs(data_path/"layers", exist_ok=True)
+    name = digest + (".lod" if lod else "") + ".usdc"
+    (data_path/"layers"/name).write_bytes(b"usdc")
+    return name
+
+
+def _manifest(data_path, name, source, digests):
+    os.makedirs(data_path/"layers"/"manifests", exist_ok=True)
+    manifest = {"source": str(source), "components": [{"hash": digest} for digest in digests]}
+    (data_path/"layers"/"manifests"/name).write_text(json.dumps(manifest))
+
+
+def test_collect_layers(data_path):
+    kept, shared, gone, unused = ("%064x" % n for n in range(1, 5))
+    layers = [_layer(data_path, kept), _layer(data_path, kept, lod=True), _layer(data_path, shared),
+              _layer(data_path, gone), _layer(data_path, unused)]
+    (data_path/"layers"/"half_written.usdc.tmp").write_bytes(b"")
+    source = data_path/"a.usd"
+    source.write_text("#usda 1.0")
+    _manifest(data_path, "a.json", source, [kept, shared])
+    # The source of this one has been deleted, the layer only it used goes
+    # and the one it shares with a.json stays
+    _manifest(data_path, "b.json", data_path/"b.usd", [shared, gone])
+
+    assert sorted(local_data.collect_layers()) == sorted(layers[3:])
+    assert os.listdir(data_path/"layers"/"manifests") == ["a.json"]
+    assert sorted(os.listdir(data_path/"layers")) == sorted(layers[:3] + ["half_written.usdc.tmp", "manifests"])
+
+    # Once no manifest uses them every layer goes
+    source.unlink()
+    assert sorted(local_data.collect_layers()) == sorted(layers[:3])
+    assert local_data.collect_layers() == []
+
+
+def test_eviction_collects_the_run_layers(data_path):
+    _add_runs(data_path, ["old", "new"])
+    ours, theirs = "%064x" % 1, "%064x" % 2
+    _layer(data_path, ours)
+    _layer(data_path, theirs)
+    _manifest(data_path, "old.json", data_path/"old"/"outputs"/"field.vtu", [ours])
+    _manifest(data_path, "new.json", data_path/"new"/"outputs"/"field.vtu", [theirs])
+
+    assert local_data.enforce_budget(RUN_BYTES) == ["old"]
+    assert sorted(os.listdir(data_path/"layers")) == [theirs + ".usdc", "manifests"]